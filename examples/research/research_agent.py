@@ -1,17 +1,21 @@
 # examples/research/server.py
 import os
 import sys
+import asyncio
 import json
 import uuid
 import time
+import hashlib
 import random
 import logging
+import redis
 import uvicorn
 from typing import Any, List, Dict, Optional
 
-from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 # 让 python 找到 src/deepagents
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
@@ -37,6 +41,19 @@ from deepagents.simple_file_memory import save_memory, load_memory, clear_memory
 
 # LangGraph（可选）
 from langgraph.graph import StateGraph, START, END
+
+# 主 Agent 线程检查点（AGENT_CHECKPOINTER=sqlite/redis/memory；默认关闭）
+from deepagents.checkpointer import (
+    CHECKPOINT_PRUNE_INTERVAL_S,
+    current_thread,
+    delete_thread as delete_checkpoint_thread,
+    has_thread,
+    latest_turn,
+    make_checkpointer,
+    prune_checkpoints,
+    thread_config,
+    use_thread,
+)
 from deepagents.state import DeepAgentState
 
 # 运行态/ToDo/校验/持久化
@@ -45,12 +62,51 @@ from deepagents.run_state import (
     append_step,
     set_validation,
     load_state as load_trace_state,
+    load_checkpoint,
+    find_orphaned_runs,
     list_states as list_trace_states,
     get_runtime_dirs,
 )
 
+# Redis 幂等键（/generate 的 Idempotency-Key）
+from deepagents.redis_utils import (
+    aclaim_idempotent,
+    aclose_async_redis,
+    acomplete_idempotent,
+    aping as redis_ping,
+    arelease_idempotent,
+    await_idempotent,
+    pool_stats as redis_pool_stats,
+)
+
+# 限流中间件
+from deepagents.rate_limit import RateLimitMiddleware, load_rules
+
+# 进程内指标
+from deepagents import metrics
+
 # 三角色调度（注意：此处按你的导入路径）
-from deepagents.tri_role_scheduler import run_textual_flow
+from deepagents.tri_role_scheduler import arun_textual_flow, resume_textual_flow, run_textual_flow
+
+# 协作式取消（客户端断开 / DELETE /state/{trace_id} / 超时）
+from deepagents import cancellation
+from deepagents.cancellation import CancelToken, cancel_config, check_cancelled
+
+# 阻塞调用卸载（专用线程池）+ 事件循环延迟监控
+from deepagents.offload import LoopLagMonitor, blocking_stats, run_blocking, shutdown_blocking_executor
+
+# 准入控制 + 过载降级
+from deepagents.admission import AdmissionController, Overloaded
+
+# 多租户公平调度（/generate 与 /jobs 共用执行槽）
+from deepagents.fair_scheduler import FairScheduler, SchedulerTimeout, TenantBusy
+
+# 已编译 agent 图缓存（/health 展示命中情况）
+from deepagents.graph_cache import graph_cache
+from deepagents.parse_cache import parse_cache
+
+# 后台任务队列（/jobs）
+from deepagents.job_queue import Deferred, JobWorkerPool, QueueFull, make_job_queue
 
 # ====== 子代理 ======
 doc_writer_subagent = {
@@ -81,6 +137,7 @@ doc_writer_subagent = {
         "generate_recommendation",
         "name_document",
     ],
+    "state_keys": [],  # 输入都在 description 的 JSON 里，不需要父 state
 }
 
 # ====== 主 Agent Prompt ======
@@ -97,6 +154,7 @@ main_prompt = """
 """
 
 # ====== 创建主 Agent：只暴露 task ======
+agent_checkpointer = make_checkpointer()
 agent = create_deep_agent(
     tools=[
         parse_resume_text_tool,
@@ -111,6 +169,7 @@ agent = create_deep_agent(
     instructions=main_prompt,
     subagents=[doc_writer_subagent],
     expose_tools_to_main=False,  # 主 Agent 只看到 task，业务工具走子代理
+    checkpointer=agent_checkpointer,
 )
 
 # ====== LangGraph（可选）======
@@ -151,9 +210,9 @@ def build_langgraph_app(underlying_agent):
         # 不再写死 ToDo；LangGraph 在此只是演示用途
         return {}
 
-    def delegate_node(state: DeepAgentState):
+    async def delegate_node(state: DeepAgentState):
         msgs = state.get("messages", [])
-        res = underlying_agent.invoke({"messages": msgs})
+        res = await underlying_agent.ainvoke({"messages": msgs}, config={**cancel_config(), **thread_config()})
         text = _pick_output(res)
         return {
             "rewritten_text": text,
@@ -181,6 +240,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 限流（Redis Lua 令牌桶 / 滑动日志；Redis 不可用时回退进程内）；规则见 RATE_LIMIT_RULES
+if os.getenv("RATE_LIMIT_ENABLED", "1") == "1":
+    app.add_middleware(RateLimitMiddleware, rules=load_rules())
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s | pid=%(process)d | %(levelname)s | %(message)s",
@@ -208,50 +271,94 @@ def _sleep_backoff(i: int):
     delay = RETRY_BASE * (2**i) + random.uniform(0, RETRY_JITTER)
     time.sleep(delay)
 
+def _thread_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """当前（步骤）线程已有检查点：历史由检查点提供，只发送最新一轮（保留开头的 system 提示），避免把历史重复写进线程"""
+    if agent_checkpointer is not None and has_thread(agent):
+        return latest_turn(messages)
+    return messages
+
+def _agent_thread() -> Optional[str]:
+    """
+    启用 checkpointer 时每次 agent 调用都必须带 thread_id：优先用当前线程（use_thread / scoped_thread），
+    不在任何线程范围内（脚本、测试直接调用）时给一个一次性线程，由周期清理按空闲时间回收
+    """
+    if agent_checkpointer is None:
+        return None
+    return current_thread() or f"adhoc:{uuid.uuid4()}"
+
 def invoke_agent_with_retry(messages: List[Dict[str, str]]) -> Dict[str, Any]:
     """统一的调用入口：优先走 LangGraph；失败重试；最终兜底回显用户输入"""
+    with use_thread(_agent_thread()):
+        return _invoke_agent_with_retry(messages)
+
+def _invoke_agent_with_retry(messages: List[Dict[str, str]]) -> Dict[str, Any]:
     last_err = None
+    all_messages, messages = messages, _thread_messages(messages)
     for i in range(RETRY_ATTEMPTS):
+        check_cancelled()  # 已取消则不再重试（Cancelled 不被下方 except Exception 捕获）
+        config = {**cancel_config(), **thread_config()}
         try:
             if LG_ENABLED and lg_app is not None:
                 # LangGraph 路径
-                state = lg_app.invoke({"messages": messages})
+                state = lg_app.invoke({"messages": messages}, config=config)
                 txt = state.get("rewritten_text")
                 if not txt:
                     # 兜底再调一次底层 agent
-                    res = agent.invoke({"messages": messages})
+                    res = agent.invoke({"messages": messages}, config=config)
                     txt = _pick_output(res)
                 return {"rewritten_text": txt}
             else:
                 # 直连路径
-                return agent.invoke({"messages": messages})
+                return agent.invoke({"messages": messages}, config=config)
         except Exception as e:
             last_err = e
             _sleep_backoff(i)
 
     # 全失败：回退为最后一条用户输入
     last_user = next(
-        (m["content"] for m in reversed(messages) if m.get("role") == "user"), ""
+        (m["content"] for m in reversed(all_messages) if m.get("role") == "user"), ""
     )
     return {"rewritten_text": last_user}
 
-# ====== 路由（使用三角色轮转）======
-@app.post("/generate")
-async def generate_report(
-    q: Question, x_session_id: Optional[str] = Header(default=None)
-):
-    # 1) Entrance：会话 & 历史
-    session_id = x_session_id or q.session_id or str(uuid.uuid4())
-    last_n = int(os.getenv("MEMORY_LOAD_LAST_N", "8"))
-    history = load_memory(session_id, last_n=last_n)
+async def _asleep_backoff(i: int):
+    delay = RETRY_BASE * (2**i) + random.uniform(0, RETRY_JITTER)
+    await asyncio.sleep(delay)
 
-    # 2) 跑 Textual Flow：Planner → (Loop) → Executor（逐个）→ Validator（逐个）→ Planner 总体复评（可重跑）
-    result = run_textual_flow(
-        user_input=q.user_input,
-        session_id=session_id,
-        history=history,
-        pick_output=_pick_output,
-        agent_invoke_with_retry=invoke_agent_with_retry,
+async def ainvoke_agent_with_retry(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """invoke_agent_with_retry 的 async 版本：走 ainvoke，退避不阻塞事件循环"""
+    with use_thread(_agent_thread()):
+        return await _ainvoke_agent_with_retry(messages)
+
+async def _ainvoke_agent_with_retry(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    last_err = None
+    all_messages = messages
+    if agent_checkpointer is not None:
+        messages = await run_blocking(_thread_messages, messages)
+    for i in range(RETRY_ATTEMPTS):
+        check_cancelled()
+        config = {**cancel_config(), **thread_config()}
+        try:
+            if LG_ENABLED and lg_app is not None:
+                state = await lg_app.ainvoke({"messages": messages}, config=config)
+                txt = state.get("rewritten_text")
+                if not txt:
+                    res = await agent.ainvoke({"messages": messages}, config=config)
+                    txt = _pick_output(res)
+                return {"rewritten_text": txt}
+            else:
+                return await agent.ainvoke({"messages": messages}, config=config)
+        except Exception as e:
+            last_err = e
+            await _asleep_backoff(i)
+
+    last_user = next(
+        (m["content"] for m in reversed(all_messages) if m.get("role") == "user"), ""
+    )
+    return {"rewritten_text": last_user}
+
+def _flow_options() -> Dict[str, Any]:
+    """三角色流程的可调参数（/generate 与后台任务共用）"""
+    return dict(
         plan_max_loops=int(os.getenv("PLAN_MAX_LOOPS","3")),
         step_max_attempts=int(os.getenv("STEP_MAX_ATTEMPTS","2")),
         pass_threshold=float(os.getenv("VAL_PASS_THRESHOLD","0.75")),
@@ -259,25 +366,361 @@ async def generate_report(
         overall_replan_max=int(os.getenv("OVERALL_REPLAN_MAX","1")),
     )
 
+def _finish_flow(session_id: str, user_input: str, result: Dict[str, Any],
+                 history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    """记录对话记忆（文件记忆 + 会话线程）并组装响应（/generate 与后台任务共用）"""
     output = result.get("final_text","")
 
-    # 3) Memory：记录对话
+    # Memory：记录对话
     try:
-        save_memory(session_id, "user", q.user_input)
+        save_memory(session_id, "user", user_input)
         save_memory(session_id, "assistant", output)
+        _record_turn(session_id, history or [], user_input, output)
         append_step(result["trace_id"], "persist_memory", "ok")
     except Exception as e:
         append_step(result["trace_id"], "persist_memory", "error", {"error": str(e)})
 
-    # 4) 返回（可在 /state/{trace_id} 查看完整 ToDo/步骤状态）
+    # 返回（可在 /state/{trace_id} 查看完整 ToDo/步骤状态）
     return {
         "trace_id": result["trace_id"],
         "session_id": session_id,
         "rewritten_letter": output,
         "done": result["done"],
+        "cancelled": result.get("cancelled", False),
+        "degraded": result.get("degraded", []),
         "plan_rationale": result.get("plan_rationale",""),
         "steps": result.get("checklist", []),
+        "budget": result.get("budget"),
+    }
+
+# ====== 路由（使用三角色轮转）======
+async def _cancel_on_disconnect(request: Request, token: CancelToken) -> None:
+    """轮询连接状态：客户端断开即取消本次运行"""
+    interval = float(os.getenv("DISCONNECT_POLL_S", "1.0"))
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("client_disconnected")
+            return
+        await asyncio.sleep(interval)
+
+# 公平调度：租户取 X-Tenant-Id（未给则按会话）；优先级取 X-Priority（/generate 默认 interactive，/jobs 默认 batch）
+fair_scheduler = FairScheduler()
+admission = AdmissionController()
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"overloaded: {e}", headers={"Retry-After": str(int(e.retry_after + 0.999))})
+SCHED_MAX_WAIT_S = float(os.getenv("SCHED_MAX_WAIT_S", "0")) or None
+
+# 幂等：重复请求等待首个请求结果的最长时间
+IDEMPOTENCY_WAIT_S = float(os.getenv("IDEMPOTENCY_WAIT_S", "30"))
+
+def _tenant_of(x_tenant_id: Optional[str], session_id: str) -> str:
+    return x_tenant_id or f"session:{session_id}"
+
+def _thread_id(session_id: str) -> Optional[str]:
+    """
+    会话线程（可续接的对话，每轮结束由 _record_turn 写入）；流程内各步骤的 agent 调用落在其下的草稿子线程
+    "<会话>:<trace>:<步骤>"（见 checkpointer.scoped_thread），运行结束即删除。未启用 checkpointer 时不设线程
+    """
+    return session_id if agent_checkpointer is not None else None
+
+def _memory_last_n() -> int:
+    return int(os.getenv("MEMORY_LOAD_LAST_N", "8"))
+
+def _session_history(session_id: str, last_n: int) -> List[Dict[str, str]]:
+    """会话历史：会话线程已有检查点时从检查点取；否则读文件记忆（本轮结束时连同本轮写入线程）"""
+    tid = _thread_id(session_id)
+    if not tid or not has_thread(agent, tid):
+        return load_memory(session_id, last_n=last_n)
+    msgs = agent.get_state(thread_config(tid)).values.get("messages") or []
+    turns = [
+        {"role": "user" if m.type == "human" else "assistant", "content": m.content}
+        for m in msgs
+        if m.type in ("human", "ai") and isinstance(m.content, str) and m.content and not getattr(m, "tool_calls", None)
+    ]
+    return turns[-last_n:] if last_n > 0 else []
+
+def _record_turn(session_id: str, history: List[Dict[str, str]], user_input: str, output: str) -> None:
+    """把本轮对话写入会话线程；线程尚无检查点时连同文件记忆里的历史一起写入（之后只追加最新一轮）"""
+    tid = _thread_id(session_id)
+    if not tid:
+        return
+    turn = [*history, {"role": "user", "content": user_input}, {"role": "assistant", "content": output}]
+    if has_thread(agent, tid):
+        turn = latest_turn(turn)
+    agent.update_state(thread_config(tid), {"messages": turn}, as_node="agent")
+
+def _drop_run_threads(session_id: str, trace_id: str) -> None:
+    """删除本次运行的步骤草稿子线程（"<会话>:<trace>:*"）；会话线程保留"""
+    tid = _thread_id(session_id)
+    if tid:
+        try:
+            delete_checkpoint_thread(agent_checkpointer, f"{tid}:{trace_id}")
+        except Exception as e:
+            logging.warning("failed to drop step threads of %s: %r", trace_id, e)
+
+@app.post("/generate")
+async def generate_report(
+    q: Question,
+    request: Request,
+    x_session_id: Optional[str] = Header(default=None),
+    x_tenant_id: Optional[str] = Header(default=None),
+    x_priority: Optional[str] = Header(default=None),
+    idempotency_key: Optional[str] = Header(default=None),
+):
+    run = lambda: _generate(q, request, x_session_id, x_tenant_id, x_priority)
+    if not idempotency_key:
+        return await run()
+    # 指纹：同一幂等键只允许同一请求体（用户输入 + 显式会话）
+    fingerprint = hashlib.sha1(
+        json.dumps([q.user_input, x_session_id or q.session_id or ""], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    return await _idempotent(idempotency_key, fingerprint, run)
+
+async def _idempotent(key: str, fingerprint: str, run) -> Any:
+    """
+    Idempotency-Key：
+    - 首个请求 SET NX 认领（pending 标记）并执行，完成后把响应写回 Redis（IDEMPOTENCY_TTL 内重放）
+    - 并发重复请求：轮询等待同一结果（≤ IDEMPOTENCY_WAIT_S），仍未完成返回 409 + Retry-After
+    - 执行失败 / 被取消：释放认领，允许客户端重试
+    Redis 不可用时退化为无幂等保护，直接执行。
+    """
+    owner = str(uuid.uuid4())
+    try:
+        claimed, rec = await aclaim_idempotent(key, fingerprint, owner)
+    except redis.RedisError as e:
+        logging.warning("idempotency disabled for this request (redis error: %r)", e)
+        return await run()
+
+    if not claimed:
+        if rec and rec.get("fingerprint") != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key reused with a different request body")
+        if not rec or rec.get("status") != "done":
+            rec = await await_idempotent(key, IDEMPOTENCY_WAIT_S)
+        if rec and rec.get("status") == "done":
+            metrics.incr("idempotency_replays")
+            return JSONResponse(rec["result"], headers={"Idempotent-Replayed": "true"})
+        raise HTTPException(status_code=409, detail="request with this Idempotency-Key is still in progress",
+                            headers={"Retry-After": str(int(IDEMPOTENCY_WAIT_S) or 1)})
+
+    try:
+        result = await run()
+    except BaseException:
+        await arelease_idempotent(key, owner)
+        raise
+    if result.get("cancelled"):
+        await arelease_idempotent(key, owner)
+    else:
+        await acomplete_idempotent(key, fingerprint, result)
+    return result
+
+async def _generate(
+    q: Question,
+    request: Request,
+    x_session_id: Optional[str],
+    x_tenant_id: Optional[str],
+    x_priority: Optional[str],
+) -> Dict[str, Any]:
+    # 0) 准入：在途过多 / 估算排队过久 → 503 + Retry-After
+    try:
+        started = admission.try_admit()
+    except Overloaded as e:
+        raise _overloaded(e)
+    ok = False
+    try:
+        out = await _generate_admitted(q, request, x_session_id, x_tenant_id, x_priority)
+        ok = not out.get("cancelled")
+        return out
+    finally:
+        admission.release(started, completed=ok)
+
+async def _generate_admitted(
+    q: Question,
+    request: Request,
+    x_session_id: Optional[str],
+    x_tenant_id: Optional[str],
+    x_priority: Optional[str],
+) -> Dict[str, Any]:
+    # 1) Entrance：会话 & 历史
+    session_id = x_session_id or q.session_id or str(uuid.uuid4())
+    history = await run_blocking(_session_history, session_id, _memory_last_n())
+    trace_id = str(uuid.uuid4())
+
+    # 取消令牌：客户端断开 / DELETE /state/{trace_id} / REQUEST_CANCEL_AFTER_S 超时
+    cancel_after = float(os.getenv("REQUEST_CANCEL_AFTER_S", "0")) or None
+    token = CancelToken(timeout_s=cancel_after)
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, token))
+
+    # 2) 跑 Textual Flow：Planner → (Loop) → Executor（逐个）→ Validator（逐个）→ Planner 总体复评（可重跑）
+    #    先在公平调度器排队拿执行槽
+    try:
+        async with fair_scheduler.aslot(_tenant_of(x_tenant_id, session_id), x_priority or "interactive",
+                                        timeout=SCHED_MAX_WAIT_S):
+            with use_thread(_thread_id(session_id)):
+                result = await arun_textual_flow(
+                    user_input=q.user_input,
+                    session_id=session_id,
+                    history=history,
+                    pick_output=_pick_output,
+                    agent_invoke_with_retry=ainvoke_agent_with_retry,
+                    trace_id=trace_id,
+                    cancel_token=token,
+                    degrade=admission.level,
+                    **_flow_options(),
+                )
+    except SchedulerTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": os.getenv("JOB_RETRY_AFTER", "30")})
+    finally:
+        watcher.cancel()
+        await run_blocking(_drop_run_threads, session_id, trace_id)
+
+    # 3) Memory + 返回
+    return await run_blocking(_finish_flow, session_id, q.user_input, result, history)
+
+# ====== 后台任务模式：POST /jobs 立即返回 trace_id，worker 池执行，GET /jobs/{id} 取结果 ======
+def _run_job(job_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    worker 线程中执行；job_id 即 trace_id（重新投递时沿用同一 trace）。
+    该 trace 已有计划检查点（重新投递 / 启动时 sweeper 接管的中断运行）→ 从最后完成的步骤续跑。
+    租户已占满执行槽时不在此阻塞：抛 Deferred，任务回到队尾，worker 去领其它租户的任务。
+    """
+    session_id = payload["session_id"]
+    tenant = payload.get("tenant_id") or f"session:{session_id}"
+    try:
+        with admission.admit(force=True), fair_scheduler.slot(tenant, payload.get("priority") or "batch",
+                                                              skip_if_tenant_busy=True):
+            return _run_job_flow(job_id, payload, session_id)
+    except TenantBusy as e:
+        raise Deferred(str(e)) from e
+
+def _run_job_flow(job_id: str, payload: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+    try:
+        with use_thread(_thread_id(session_id)):
+            return _run_job_flow_in_thread(job_id, payload, session_id)
+    finally:
+        _drop_run_threads(session_id, job_id)
+
+def _run_job_flow_in_thread(job_id: str, payload: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+    cp = load_checkpoint(job_id)
+    if payload.get("resume") or (cp and cp.get("steps")):
+        result = resume_textual_flow(
+            job_id,
+            pick_output=_pick_output,
+            agent_invoke_with_retry=invoke_agent_with_retry,
+            degrade=admission.level,
+        )
+        return _finish_flow(session_id, payload["user_input"], result)
+    history = _session_history(session_id, _memory_last_n())
+    result = run_textual_flow(
+        user_input=payload["user_input"],
+        session_id=session_id,
+        history=history,
+        pick_output=_pick_output,
+        agent_invoke_with_retry=invoke_agent_with_retry,
+        trace_id=job_id,
+        degrade=admission.level,
+        **_flow_options(),
+    )
+    return _finish_flow(session_id, payload["user_input"], result, history)
+
+job_queue = make_job_queue()
+job_pool = JobWorkerPool(job_queue, _run_job)
+
+def _requeue_orphaned_runs() -> List[str]:
+    """把属主进程已退出、仍处于 running 的运行重新入队续跑（已在队列中的交给队列自身重投）"""
+    requeued = []
+    for item in find_orphaned_runs():
+        tid = item["trace_id"]
+        rec = job_queue.get(tid)
+        if rec and rec.get("status") in ("queued", "running"):
+            continue
+        try:
+            state = load_trace_state(tid)
+            job_queue.enqueue(
+                {"user_input": state.get("user_input", ""), "session_id": state.get("session_id"), "resume": True},
+                job_id=tid,
+            )
+            requeued.append(tid)
+        except QueueFull:
+            logging.warning("orphan sweep stopped: job queue full (%d requeued)", len(requeued))
+            break
+        except Exception as e:
+            logging.warning("orphan sweep failed for %s: %r", tid, e)
+    if requeued:
+        logging.info("orphan sweep requeued %d run(s): %s", len(requeued), requeued)
+    return requeued
+
+@app.on_event("startup")
+def _start_job_workers():
+    job_pool.start()
+    if os.getenv("RESUME_ORPHANED_RUNS", "1") == "1":
+        _requeue_orphaned_runs()
+
+@app.on_event("shutdown")
+def _stop_job_workers():
+    job_pool.stop()
+
+loop_monitor = LoopLagMonitor()
+
+@app.on_event("startup")
+async def _start_loop_monitor():
+    loop_monitor.start()
+
+async def _prune_checkpoints_periodically():
+    while True:
+        try:
+            stats = await run_blocking(prune_checkpoints, agent_checkpointer)
+            logging.info("checkpoint prune: %s", stats)
+        except Exception as e:
+            logging.warning("checkpoint prune failed: %s", e)
+        await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL_S)
+
+@app.on_event("startup")
+async def _start_checkpoint_pruner():
+    if agent_checkpointer is not None and CHECKPOINT_PRUNE_INTERVAL_S > 0:
+        app.state.checkpoint_pruner = asyncio.create_task(_prune_checkpoints_periodically())
+
+@app.on_event("shutdown")
+async def _stop_loop_monitor():
+    await loop_monitor.stop()
+    pruner = getattr(app.state, "checkpoint_pruner", None)
+    if pruner is not None:
+        pruner.cancel()
+    shutdown_blocking_executor()
+    await aclose_async_redis()
+
+@app.post("/jobs", status_code=202)
+def submit_job(
+    q: Question,
+    x_session_id: Optional[str] = Header(default=None),
+    x_tenant_id: Optional[str] = Header(default=None),
+    x_priority: Optional[str] = Header(default=None),
+):
+    session_id = x_session_id or q.session_id or str(uuid.uuid4())
+    trace_id = str(uuid.uuid4())
+    payload = {
+        "user_input": q.user_input,
+        "session_id": session_id,
+        "tenant_id": x_tenant_id,
+        "priority": x_priority or "batch",
     }
+    try:
+        admission.check()
+    except Overloaded as e:
+        raise _overloaded(e)
+    try:
+        job_queue.enqueue(payload, job_id=trace_id)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": os.getenv("JOB_RETRY_AFTER", "30")})
+    return {"trace_id": trace_id, "job_id": trace_id, "session_id": session_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    rec = job_queue.get(job_id)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    rec.pop("payload", None)
+    return rec
 
 @app.post("/debug")
 async def debug_report(
@@ -285,7 +728,7 @@ async def debug_report(
 ):
     """直接调底层 agent，返回 messages 视图（便于排查 tool_calls）"""
     session_id = x_session_id or q.session_id or str(uuid.uuid4())
-    history = load_memory(session_id, last_n=int(os.getenv("MEMORY_LOAD_LAST_N", "8")))
+    history = await run_blocking(_session_history, session_id, _memory_last_n())
     messages: List[Dict[str, str]] = []
     for h in history:
         messages.append(
@@ -293,7 +736,10 @@ async def debug_report(
         )
     messages.append({"role": "user", "content": q.user_input})
 
-    res = agent.invoke({"messages": messages})
+    # 同步 agent 调用放到专用线程池，不阻塞事件循环；启用 checkpointer 时落到会话线程（已有检查点则只发最新一轮）
+    with use_thread(_thread_id(session_id)):
+        messages = await run_blocking(_thread_messages, messages)
+        res = await run_blocking(agent.invoke, {"messages": messages}, config=thread_config())
     msgs = res.get("messages", [])
 
     def view(m):
@@ -313,11 +759,13 @@ async def debug_report(
 async def clear_session_memory(session_id: Optional[str] = Header(default=None)):
     if not session_id:
         raise HTTPException(status_code=400, detail="Missing session_id in header")
-    clear_memory(session_id)
+    await asyncio.to_thread(clear_memory, session_id)
+    if agent_checkpointer is not None:
+        await run_blocking(delete_checkpoint_thread, agent_checkpointer, session_id)
     return {"ok": True, "session_id": session_id}
 
 @app.get("/health")
-def health_check():
+async def health_check():
     ok = True
     try:
         dirs = get_runtime_dirs()
@@ -325,9 +773,22 @@ def health_check():
         os.makedirs(dirs["mem_dir"], exist_ok=True)
     except Exception:
         ok = False
+    try:
+        jobs = await asyncio.to_thread(job_queue.stats)
+    except Exception as e:
+        ok, jobs = False, {"error": str(e)}
+    redis_status = {**await redis_ping(), "pool": redis_pool_stats()}
     return {
         "status": "ok" if ok else "degraded",
         "memory_backend": "file",
+        "redis": redis_status,
+        "jobs": jobs,
+        "scheduler": fair_scheduler.stats(),
+        "admission": admission.stats(),
+        "blocking": blocking_stats(),
+        "loop_lag": loop_monitor.stats(),
+        "graph_cache": graph_cache.stats(),
+        "parse_cache": parse_cache.stats(),
         **get_runtime_dirs(),
     }
 
@@ -339,9 +800,30 @@ def get_state(trace_id: str):
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="trace_id not found")
 
+# 取消运行中的 trace（排队中的任务在开始时即被取消）
+@app.delete("/state/{trace_id}")
+def cancel_state(trace_id: str):
+    """取消运行中或排队中的 trace；已结束（completed / cancelled / failed）的不再登记取消"""
+    try:
+        status = load_trace_state(trace_id).get("status")
+    except FileNotFoundError:
+        rec = job_queue.get(trace_id)
+        if rec is None and trace_id not in cancellation.running():
+            raise HTTPException(status_code=404, detail="trace_id not found")
+        status = {"done": "completed"}.get(rec["status"], rec["status"]) if rec else None
+    if status in ("completed", "cancelled", "failed"):
+        return {"trace_id": trace_id, "cancel_requested": False, "status": status}
+    running = cancellation.cancel(trace_id, "deleted")
+    return {"trace_id": trace_id, "cancel_requested": True, "running": running}
+
 @app.get("/states")
 def list_states(session_id: Optional[str] = Query(None)):
     return {"items": list_trace_states(session_id=session_id)}
 
+@app.get("/metrics")
+def get_metrics():
+    """进程内指标（结构化输出解析失败/修复次数等）"""
+    return metrics.snapshot()
+
 if __name__ == "__main__":
     uvicorn.run(f"{__name__}:app", host="0.0.0.0", port=8002)
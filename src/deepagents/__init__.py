@@ -1,15 +1,49 @@
-from .graph import create_deep_agent
-from .state import DeepAgentState
-from .sub_agent import SubAgent
-from .tools.rag_tools import rag_qa_tool
-
-from .tools.text_parse_tool import parse_resume_text_tool          # name="parse_resume_text"
-from .tools.rewrite_tool import rewrite_text_tool                    # name="rewrite_text"
-from .tools.expand_tool import expand_text_tool                      # name="expand_text"
-from .tools.compress_tool import contract_text_tool                  # name="contract_text"
-from .tools.evaluate_resume_tool import evaluate_resume_tool              # name="evaluate_resume"
-from .tools.generate_statement_tool import generate_statement_tool        # name="generate_statement"
-from .tools.generate_recommend_tool import generate_recommendation_tool  # name="generate_recommendation"
-from .tools.document_name_tool import name_document_tool
-from .redis_utils import rate_limit, get_idempotent, set_idempotent, rds  # rds 用于 /health ping       
-from .simple_file_memory import save_memory, load_memory, clear_memory 
\ No newline at end of file
+# src/deepagents/__init__.py
+# 公开名按需导入（PEP 562）：导入任一子模块（如 pdf_extract 的 spawn 子进程）时不会连带加载
+# langgraph / 工具 / SiliconFlowClient（后者要求 SILICONFLOW_API_KEY）
+from importlib import import_module
+from typing import Any, Dict
+
+_EXPORTS: Dict[str, str] = {
+    "create_deep_agent": ".graph",
+    "invalidate_graphs": ".graph_cache",
+    "DeepAgentState": ".state",
+    "SubAgent": ".sub_agent",
+    "rag_qa_tool": ".tools.rag_tools",
+
+    "parse_resume_text_tool": ".tools.text_parse_tool",              # name="parse_resume_text"
+    "rewrite_text_tool": ".tools.rewrite_tool",                      # name="rewrite_text"
+    "expand_text_tool": ".tools.expand_tool",                        # name="expand_text"
+    "contract_text_tool": ".tools.compress_tool",                    # name="contract_text"
+    "evaluate_resume_tool": ".tools.evaluate_resume_tool",           # name="evaluate_resume"
+    "generate_statement_tool": ".tools.generate_statement_tool",     # name="generate_statement"
+    "generate_recommendation_tool": ".tools.generate_recommend_tool",  # name="generate_recommendation"
+    "name_document_tool": ".tools.document_name_tool",
+
+    "rate_limit": ".redis_utils",
+    "get_idempotent": ".redis_utils",
+    "set_idempotent": ".redis_utils",
+    "claim_idempotent": ".redis_utils",
+    "complete_idempotent": ".redis_utils",
+    "release_idempotent": ".redis_utils",
+    "wait_idempotent": ".redis_utils",
+    "rds": ".redis_utils",                                           # rds 用于 /health ping
+    "register_direct_tool": ".tool_dispatch",
+    "get_direct_tool": ".tool_dispatch",
+    "save_memory": ".simple_file_memory",
+    "load_memory": ".simple_file_memory",
+    "clear_memory": ".simple_file_memory",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,141 @@
+# src/deepagents/admission.py
+"""
+准入控制与降级（过载保护）
+- 跟踪在途运行数与单次运行耗时（EWMA），估算新请求的排队时间：
+      est_wait = max(0, in_flight - capacity + 1) × ewma_latency / capacity
+- 在途数达到 hard_limit，或估算排队时间超过 max_queue_s → 拒绝（Overloaded，服务端转 503 + Retry-After）
+- 降级等级 level()：按负载（在途/容量 与 估算排队/阈值 的较大者）分级，供 run_textual_flow 逐级关闭高成本环节
+      0 正常
+      1 跳过 Planner 总体复评（planner_overall_review）
+      2 + Validator 只做规则校验（不调 LLM）
+      3 + 不重试、规划只尝试一次
+  运行中每次检查时重新取等级（传入 level 方法本身），负载回落后自动恢复
+
+配置（env）：
+- ADMISSION_CAPACITY=8            预期可并行的运行数（一般与 SCHED_MAX_CONCURRENCY 一致）
+- ADMISSION_HARD_LIMIT=32         在途（含排队）上限
+- ADMISSION_MAX_QUEUE_S=60        估算排队时间上限
+- ADMISSION_DEGRADE_AT="0.75,1.0,1.5"  进入等级 1/2/3 的负载比
+- ADMISSION_EWMA_ALPHA=0.2
+"""
+from __future__ import annotations
+import contextlib
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from deepagents import metrics
+
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", os.getenv("SCHED_MAX_CONCURRENCY", "8")))
+ADMISSION_HARD_LIMIT = int(os.getenv("ADMISSION_HARD_LIMIT", "32"))
+ADMISSION_MAX_QUEUE_S = float(os.getenv("ADMISSION_MAX_QUEUE_S", "60"))
+ADMISSION_DEGRADE_AT = [float(x) for x in os.getenv("ADMISSION_DEGRADE_AT", "0.75,1.0,1.5").split(",") if x.strip()]
+ADMISSION_EWMA_ALPHA = float(os.getenv("ADMISSION_EWMA_ALPHA", "0.2"))
+
+class Overloaded(RuntimeError):
+    """超过准入阈值；retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(
+        self,
+        capacity: int = ADMISSION_CAPACITY,
+        hard_limit: int = ADMISSION_HARD_LIMIT,
+        max_queue_s: float = ADMISSION_MAX_QUEUE_S,
+        degrade_at: Optional[List[float]] = None,
+        alpha: float = ADMISSION_EWMA_ALPHA,
+        initial_latency_s: float = 30.0,
+    ) -> None:
+        self.capacity = max(1, capacity)
+        self.hard_limit = max(self.capacity, hard_limit)
+        self.max_queue_s = max_queue_s
+        self.degrade_at = sorted(degrade_at if degrade_at is not None else ADMISSION_DEGRADE_AT)
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._ewma = initial_latency_s
+        self._rejected = 0
+
+    # ---------- 负载估算 ----------
+    def _est_wait(self, in_flight: int) -> float:
+        return max(0, in_flight - self.capacity + 1) * self._ewma / self.capacity
+
+    def load(self) -> float:
+        """负载比：max(在途/容量, 估算排队/排队上限)"""
+        with self._lock:
+            ratio = self._in_flight / self.capacity
+            if self.max_queue_s > 0:
+                ratio = max(ratio, self._est_wait(self._in_flight) / self.max_queue_s)
+            return ratio
+
+    def level(self) -> int:
+        """当前降级等级 0..len(degrade_at)"""
+        ratio = self.load()
+        return sum(1 for t in self.degrade_at if ratio >= t)
+
+    # ---------- 准入 ----------
+    def try_admit(self, force: bool = False) -> float:
+        """
+        准入一次运行（计入在途）；超阈值抛 Overloaded。返回开始时间戳，交给 release()。
+        force=True 只计数不拒绝（已接受的后台任务：入队时已检查过）。
+        """
+        with self._lock:
+            est = self._est_wait(self._in_flight + 1)
+            if force:
+                self._in_flight += 1
+                return time.monotonic()
+            if self._in_flight >= self.hard_limit:
+                reason = f"in-flight runs {self._in_flight} >= {self.hard_limit}"
+            elif self.max_queue_s > 0 and est > self.max_queue_s:
+                reason = f"estimated queue time {est:.1f}s > {self.max_queue_s:.0f}s"
+            else:
+                self._in_flight += 1
+                return time.monotonic()
+            self._rejected += 1
+            retry_after = max(1.0, self._ewma / self.capacity)
+        metrics.incr("admission_rejected")
+        raise Overloaded(reason, retry_after)
+
+    def release(self, started: float, completed: bool = True, observe: bool = True) -> None:
+        """运行结束；completed=True 时把耗时计入 EWMA（异常结束的不计）"""
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if completed:
+                self._ewma = self.alpha * elapsed + (1 - self.alpha) * self._ewma
+        if observe:
+            metrics.observe("run_latency_s", elapsed)
+
+    def check(self) -> None:
+        """只检查不计数（如 /jobs 入队前）；超阈值抛 Overloaded"""
+        self.release(self.try_admit(), completed=False, observe=False)
+
+    @contextlib.contextmanager
+    def admit(self, force: bool = False) -> Iterator["AdmissionController"]:
+        started = self.try_admit(force=force)
+        ok = False
+        try:
+            yield self
+            ok = True
+        finally:
+            self.release(started, completed=ok)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight, ewma, rejected = self._in_flight, self._ewma, self._rejected
+            est = self._est_wait(in_flight + 1)
+        return {
+            "in_flight": in_flight,
+            "capacity": self.capacity,
+            "hard_limit": self.hard_limit,
+            "ewma_latency_s": round(ewma, 3),
+            "est_queue_s": round(est, 3),
+            "rejected": rejected,
+            "degrade_level": self.level(),
+            "retry_after_s": math.ceil(max(1.0, ewma / self.capacity)),
+        }
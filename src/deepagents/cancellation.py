@@ -0,0 +1,220 @@
+# src/deepagents/cancellation.py
+"""
+协作式取消
+- CancelToken:     可跨线程/协程共享的取消令牌（手动 cancel / 超时自动 cancel）；child() 派生随父取消的子令牌
+- Cancelled:       取消后在检查点抛出（BaseException，避免被各处 `except Exception` 吞掉后继续重试）
+- current_token(): 通过 contextvar 取当前运行的令牌（调度器设置；SiliconFlowClient / 工具线程里同样可见）
+- register() / cancel() / unregister(): 按 trace_id 登记，供 DELETE /state/{trace_id} 等外部触发
+- cancel_config(): 生成 LangChain RunnableConfig，让 agent 在每次 LLM / 工具调用前检查令牌
+
+配置（env）：
+- CANCEL_PENDING_TTL_S：未开始运行就被取消的 trace 保留多久等待其登记（默认 3600 秒）
+- CANCEL_PENDING_MAX：此类待生效取消的最大条数（默认 4096，超出丢弃最早的）
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+class Cancelled(BaseException):
+    """运行已被取消（客户端断开 / 显式取消 / 超时）"""
+
+class CancelToken:
+    def __init__(self, timeout_s: Optional[float] = None) -> None:
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+        self._timer: Optional[threading.Timer] = None
+        self._unlink: Optional[Callable[[], None]] = None   # 子令牌：从父令牌注销取消回调
+        if timeout_s:
+            self._timer = threading.Timer(timeout_s, self.cancel, args=("deadline",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if self._timer:
+            self._timer.cancel()
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception:
+                pass
+
+    def on_cancel(self, cb: Callable[[], None]) -> Callable[[], None]:
+        """登记取消回调（已取消则立即执行）；返回注销函数"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(cb)
+                def _remove():
+                    with self._lock:
+                        if cb in self._callbacks:
+                            self._callbacks.remove(cb)
+                return _remove
+        cb()
+        return lambda: None
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise Cancelled(self.reason or "cancelled")
+
+    def child(self, timeout_s: Optional[float] = None) -> "CancelToken":
+        """派生子令牌：父令牌取消时随之取消；子令牌单独取消（如某个子任务超时）不影响父令牌"""
+        tok = CancelToken(timeout_s)
+        tok._unlink = self.on_cancel(lambda: tok.cancel(self.reason or "cancelled"))
+        return tok
+
+    def close(self) -> None:
+        """运行结束：停止超时计时器；子令牌同时从父令牌上注销"""
+        if self._timer:
+            self._timer.cancel()
+        if self._unlink:
+            self._unlink()
+            self._unlink = None
+
+    async def run(self, aw: Awaitable[Any]) -> Any:
+        """等待 aw；期间若被取消则取消该任务（进行中的 httpx 请求随之中止）并抛 Cancelled"""
+        if self._event.is_set():
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise Cancelled(self.reason or "cancelled")
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(aw)
+        fired = loop.create_future()
+        remove = self.on_cancel(lambda: loop.call_soon_threadsafe(
+            lambda: fired.done() or fired.set_result(None)))
+        try:
+            await asyncio.wait({task, fired}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()  # 外层（如预算超时）取消时，连带取消实际调用
+            raise
+        finally:
+            remove()
+        if task.done():
+            fired.cancel()
+            return task.result()
+        task.cancel()
+        raise Cancelled(self.reason or "cancelled")
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        同步阻塞调用的可取消版本：fn 在后台线程执行，调用方在取消时立即返回（抛 Cancelled），
+        被放弃的调用结果丢弃。用于 requests 这类无法从外部中断的同步 HTTP 调用。
+        """
+        self.raise_if_cancelled()
+        done = threading.Event()
+        fut = _pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        fut.add_done_callback(lambda _f: done.set())
+        remove = self.on_cancel(done.set)
+        try:
+            done.wait()
+        finally:
+            remove()
+        if fut.done():
+            return fut.result()
+        raise Cancelled(self.reason or "cancelled")
+
+_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="cancellable-call")
+
+# ========================= 当前令牌（contextvar） =========================
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("deepagents_cancel_token", default=None)
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+def set_current_token(token: Optional[CancelToken]) -> contextvars.Token:
+    return _current.set(token)
+
+def reset_current_token(reset: contextvars.Token) -> None:
+    _current.reset(reset)
+
+def check_cancelled() -> None:
+    """检查点：当前令牌已取消则抛 Cancelled"""
+    tok = _current.get()
+    if tok is not None:
+        tok.raise_if_cancelled()
+
+# ========================= trace_id 登记表 =========================
+_registry: Dict[str, CancelToken] = {}
+# 尚未开始运行（如排队中的任务）就被取消的 trace：trace_id -> (reason, 到期时间)，按写入顺序
+_precancelled: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+_reg_lock = threading.Lock()
+
+CANCEL_PENDING_TTL_S = float(os.getenv("CANCEL_PENDING_TTL_S", "3600"))
+CANCEL_PENDING_MAX = int(os.getenv("CANCEL_PENDING_MAX", "4096"))
+
+def _prune_precancelled(now: float) -> None:
+    # 调用方持有 _reg_lock；TTL 相同，到期顺序即写入顺序
+    while _precancelled and (len(_precancelled) > CANCEL_PENDING_MAX or next(iter(_precancelled.values()))[1] <= now):
+        _precancelled.popitem(last=False)
+
+def register(trace_id: str, token: CancelToken) -> None:
+    with _reg_lock:
+        _registry[trace_id] = token
+        pending = _precancelled.pop(trace_id, None)
+    if pending and pending[1] > time.monotonic():
+        token.cancel(pending[0])
+
+def unregister(trace_id: str) -> None:
+    with _reg_lock:
+        tok = _registry.pop(trace_id, None)
+    if tok:
+        tok.close()
+
+def cancel(trace_id: str, reason: str = "cancelled") -> bool:
+    """取消某个 trace；正在运行返回 True，否则记下待其开始时立即取消并返回 False"""
+    with _reg_lock:
+        tok = _registry.get(trace_id)
+        if tok is None:
+            now = time.monotonic()
+            _precancelled[trace_id] = (reason, now + CANCEL_PENDING_TTL_S)
+            _precancelled.move_to_end(trace_id)
+            _prune_precancelled(now)
+    if tok is None:
+        return False
+    tok.cancel(reason)
+    return True
+
+def running() -> Set[str]:
+    with _reg_lock:
+        return set(_registry)
+
+# ========================= LangChain 集成 =========================
+def cancel_config(token: Optional[CancelToken] = None) -> Dict[str, Any]:
+    """
+    返回可传给 agent.invoke / ainvoke 的 config：
+    每次 LLM / 工具调用开始前检查令牌，已取消则抛 Cancelled 中止整个 agent 运行。
+    """
+    token = token or current_token()
+    if token is None:
+        return {}
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class _CancelHandler(BaseCallbackHandler):
+        raise_error = True
+
+        def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+            token.raise_if_cancelled()
+
+        def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+            token.raise_if_cancelled()
+
+        def on_tool_start(self, *args: Any, **kwargs: Any) -> None:
+            token.raise_if_cancelled()
+
+    return {"callbacks": [_CancelHandler()]}
@@ -0,0 +1,300 @@
+# src/deepagents/checkpointer.py
+"""
+Agent 线程检查点（LangGraph checkpointer）
+- make_checkpointer(backend):  按 AGENT_CHECKPOINTER 构造 saver，交给 create_deep_agent(checkpointer=...)
+    none    不用检查点（默认；保持原行为）
+    memory  进程内（MemorySaver）
+    sqlite  本地 SQLite 文件（langgraph-checkpoint-sqlite；WAL；同步/异步调用均可）
+    redis   Redis（langgraph-checkpoint-redis；按 CHECKPOINT_MAX_IDLE_S 设置 TTL）
+            依赖缺失或 Redis 不可达时回退到本地替身：sqlite → memory（记 warning）
+- use_thread(thread_id) / thread_config():  以 session_id 作为 thread_id（contextvar 传递，阻塞线程池里同样可见）；
+    会话线程是可续接的对话（每轮一问一答），下一轮据 has_thread 决定只追加 latest_turn
+- scoped_thread(*parts):  在当前线程下细分草稿子线程 "<session>:<parts>"（流程按 运行:步骤 细分）：
+    同一运行的不同步骤、同一会话的并发请求各写各的线程，互不混入对方的消息；同一步骤的重试共用一个线程。
+    草稿线程不再续接：运行结束时由调用方 delete_thread(saver, "<session>:<运行>") 删除
+- latest_turn(messages):  线程已有检查点时只需发送最新一轮（开头的 system 消息 + 最后一条 user 及其后的修正提示），
+    历史由检查点提供
+- prune_checkpoints(saver):  每个线程只保留最近 CHECKPOINT_KEEP_LAST 个检查点；超过 CHECKPOINT_MAX_IDLE_S 未活动的线程整体删除
+- delete_thread(saver, thread_id):  清空某会话的检查点，含其下的子线程（/memory 清除时一并调用）
+
+配置（env）：
+- AGENT_CHECKPOINTER=none
+- CHECKPOINT_SQLITE_PATH=<RUN_DIR>/checkpoints.sqlite
+- CHECKPOINT_KEEP_LAST=20
+- CHECKPOINT_MAX_IDLE_S=604800      （7 天；0 表示不按空闲时间清理）
+- CHECKPOINT_PRUNE_INTERVAL_S=3600  （服务端周期清理间隔）
+"""
+from __future__ import annotations
+import contextlib
+import contextvars
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from deepagents.offload import run_blocking
+
+log = logging.getLogger(__name__)
+
+AGENT_CHECKPOINTER = os.getenv("AGENT_CHECKPOINTER", "none").strip().lower()
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "")
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))
+CHECKPOINT_MAX_IDLE_S = float(os.getenv("CHECKPOINT_MAX_IDLE_S", str(7 * 86400)))
+CHECKPOINT_PRUNE_INTERVAL_S = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL_S", "3600"))
+
+# ========================= 构造 =========================
+def _threaded(cls: type) -> type:
+    """
+    给只实现了同步接口的 saver 补上异步接口（在专用阻塞线程池里调用同步方法），
+    使同一个 saver 既能给 agent.invoke（worker 线程）也能给 agent.ainvoke（FastAPI 协程）用
+    """
+    class _Threaded(cls):  # type: ignore[misc, valid-type]
+        async def aget_tuple(self, config):
+            return await run_blocking(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await run_blocking(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await run_blocking(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, *args, **kwargs):
+            return await run_blocking(self.put_writes, config, writes, task_id, *args, **kwargs)
+
+        async def adelete_thread(self, thread_id):
+            return await run_blocking(self.delete_thread, thread_id)
+
+    _Threaded.__name__ = _Threaded.__qualname__ = f"Threaded{cls.__name__}"
+    return _Threaded
+
+def _memory_saver():
+    from langgraph.checkpoint.memory import MemorySaver
+    return MemorySaver()
+
+def _sqlite_saver(path: Optional[str] = None):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    from deepagents.run_state import get_runtime_dirs
+
+    path = path or CHECKPOINT_SQLITE_PATH or os.path.join(get_runtime_dirs()["run_dir"], "checkpoints.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    saver = _threaded(SqliteSaver)(conn)
+    saver.setup()
+    return saver
+
+def _redis_saver(url: Optional[str] = None):
+    from langgraph.checkpoint.redis import RedisSaver
+    from deepagents.redis_utils import REDIS_URL
+
+    ttl = {"default_ttl": CHECKPOINT_MAX_IDLE_S / 60, "refresh_on_read": True} if CHECKPOINT_MAX_IDLE_S > 0 else None
+    saver = _threaded(RedisSaver)(redis_url=url or REDIS_URL, ttl=ttl)
+    saver.setup()
+    return saver
+
+def _local_stand_in():
+    try:
+        return _sqlite_saver()
+    except ImportError:
+        return _memory_saver()
+
+def make_checkpointer(backend: Optional[str] = None):
+    """按名称构造 checkpointer；none 返回 None（create_deep_agent 据此不挂检查点）"""
+    backend = (backend or AGENT_CHECKPOINTER or "none").lower()
+    if backend in ("", "none", "off", "0"):
+        return None
+    if backend == "memory":
+        return _memory_saver()
+    if backend == "sqlite":
+        return _sqlite_saver()
+    if backend == "redis":
+        try:
+            return _redis_saver()
+        except Exception as e:
+            log.warning("redis checkpointer unavailable (%s); using local stand-in", e)
+            return _local_stand_in()
+    raise ValueError(f"unknown AGENT_CHECKPOINTER backend: {backend!r}")
+
+# ========================= 线程（session → thread_id） =========================
+_thread: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("deepagents_thread_id", default=None)
+
+def current_thread() -> Optional[str]:
+    return _thread.get()
+
+@contextlib.contextmanager
+def use_thread(thread_id: Optional[str]) -> Iterator[None]:
+    """在此范围内的 agent 调用都落到同一个检查点线程（None 则不设置）"""
+    reset = _thread.set(thread_id)
+    try:
+        yield
+    finally:
+        _thread.reset(reset)
+
+@contextlib.contextmanager
+def scoped_thread(*parts: str) -> Iterator[None]:
+    """在当前线程下使用子线程 "<当前>:<parts...>"；当前未设置线程（未启用检查点）时不生效"""
+    base = _thread.get()
+    with use_thread(":".join([base, *parts]) if base else None):
+        yield
+
+def thread_config(thread_id: Optional[str] = None) -> Dict[str, Any]:
+    """agent.invoke 的 config 片段：{"configurable": {"thread_id": ...}}；无线程返回 {}"""
+    tid = thread_id or _thread.get()
+    return {"configurable": {"thread_id": tid}} if tid else {}
+
+def _role(m: Any) -> Optional[str]:
+    return m.get("role") if isinstance(m, dict) else getattr(m, "type", None)
+
+def latest_turn(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    开头的 system 消息（如 Executor 带修正点的系统提示）+ 最后一条 user 消息及其后的消息（如追加的修正提示）；
+    没有 user 消息则原样返回
+    """
+    lead = 0
+    while lead < len(messages) and _role(messages[lead]) == "system":
+        lead += 1
+    for i in range(len(messages) - 1, lead - 1, -1):
+        if _role(messages[i]) in ("user", "human"):
+            return list(messages[:lead]) + list(messages[i:])
+    return list(messages)
+
+def has_thread(agent: Any, thread_id: Optional[str] = None) -> bool:
+    """该线程是否已有检查点（有则只需发送 latest_turn）"""
+    cfg = thread_config(thread_id)
+    if not cfg or getattr(agent, "checkpointer", None) is None:
+        return False
+    try:
+        return agent.checkpointer.get_tuple(cfg) is not None
+    except Exception:
+        return False
+
+# ========================= 清理 =========================
+_UUID_EPOCH = 0x01B21DD213814000  # 1582-10-15 → 1970-01-01，单位 100ns
+
+def _checkpoint_ts(checkpoint_id: str) -> Optional[float]:
+    """LangGraph 的 checkpoint_id 是 UUIDv6（时间有序），从中取出 unix 时间戳"""
+    try:
+        u = uuid.UUID(checkpoint_id)
+    except (ValueError, TypeError):
+        return None
+    if u.version != 6:
+        return None
+    n = u.int
+    t = ((n >> 96) << 28) | (((n >> 80) & 0xFFFF) << 12) | ((n >> 64) & 0x0FFF)
+    return (t - _UUID_EPOCH) / 1e7
+
+def _prune_sqlite(saver: Any, keep_last: int, max_idle_s: float, now: float) -> Dict[str, int]:
+    conn: sqlite3.Connection = saver.conn
+    with saver.lock:
+        idle: List[str] = []
+        if max_idle_s > 0:
+            for tid, newest in conn.execute("SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"):
+                ts = _checkpoint_ts(newest)
+                if ts is not None and now - ts > max_idle_s:
+                    idle.append(tid)
+            for tid in idle:
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (tid,))
+                conn.execute("DELETE FROM writes WHERE thread_id = ?", (tid,))
+        trimmed = 0
+        if keep_last > 0:
+            trimmed = conn.execute(
+                """
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS rn FROM checkpoints
+                    ) WHERE rn > ?
+                )
+                """,
+                (keep_last,),
+            ).rowcount
+            conn.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                      AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+        conn.commit()
+    return {"threads_deleted": len(idle), "checkpoints_trimmed": max(trimmed, 0)}
+
+def _prune_memory(saver: Any, keep_last: int, max_idle_s: float, now: float) -> Dict[str, int]:
+    storage = saver.storage
+    idle: List[str] = []
+    trimmed = 0
+    for tid in list(storage):
+        newest = max((cid for ns in storage[tid].values() for cid in ns), default=None)
+        ts = _checkpoint_ts(newest) if newest else None
+        if max_idle_s > 0 and ts is not None and now - ts > max_idle_s:
+            idle.append(tid)
+            continue
+        if keep_last > 0:
+            for ns, cps in storage[tid].items():
+                for cid in sorted(cps, reverse=True)[keep_last:]:
+                    del cps[cid]
+                    saver.writes.pop((tid, ns, cid), None)
+                    trimmed += 1
+    for tid in idle:
+        delete_thread(saver, tid)
+    return {"threads_deleted": len(idle), "checkpoints_trimmed": trimmed}
+
+def prune_checkpoints(saver: Any, keep_last: Optional[int] = None,
+                      max_idle_s: Optional[float] = None) -> Dict[str, Any]:
+    """按策略清理；Redis 由 TTL 负责空闲过期（不按条数裁剪）"""
+    keep_last = CHECKPOINT_KEEP_LAST if keep_last is None else keep_last
+    max_idle_s = CHECKPOINT_MAX_IDLE_S if max_idle_s is None else max_idle_s
+    now = time.time()
+    if saver is None:
+        return {"backend": "none"}
+    if hasattr(saver, "conn") and hasattr(saver, "lock") and isinstance(saver.conn, sqlite3.Connection):
+        return {"backend": "sqlite", **_prune_sqlite(saver, keep_last, max_idle_s, now)}
+    if hasattr(saver, "storage") and hasattr(saver, "writes"):
+        return {"backend": "memory", **_prune_memory(saver, keep_last, max_idle_s, now)}
+    return {"backend": type(saver).__name__, "skipped": "expiry handled by backend TTL"}
+
+def _thread_ids(saver: Any, thread_id: str) -> List[str]:
+    """thread_id 本身及其子线程（scoped_thread 产生的 "<thread_id>:..."）"""
+    prefix = thread_id + ":"
+    storage = getattr(saver, "storage", None)
+    if storage is not None:
+        found = set(storage)
+    else:
+        try:
+            found = {c.config["configurable"]["thread_id"] for c in saver.list(None)}
+        except Exception as e:
+            log.warning("cannot list checkpoint threads (%s); deleting %s only", e, thread_id)
+            found = set()
+    return [thread_id] + sorted(t for t in found if t.startswith(prefix))
+
+def delete_thread(saver: Any, thread_id: str) -> None:
+    if saver is None or not thread_id:
+        return
+    if isinstance(getattr(saver, "conn", None), sqlite3.Connection) and hasattr(saver, "lock"):
+        prefix = thread_id + ":"
+        with saver.lock:
+            for table in ("checkpoints", "writes"):
+                saver.conn.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? OR substr(thread_id, 1, ?) = ?",
+                    (thread_id, len(prefix), prefix),
+                )
+            saver.conn.commit()
+        return
+    for tid in _thread_ids(saver, thread_id):
+        if hasattr(saver, "delete_thread"):
+            saver.delete_thread(tid)
+            continue
+        # 旧版 MemorySaver 无 delete_thread
+        storage = getattr(saver, "storage", None)
+        if storage is not None:
+            storage.pop(tid, None)
+            for k in [k for k in getattr(saver, "writes", {}) if k[0] == tid]:
+                saver.writes.pop(k, None)
@@ -0,0 +1,234 @@
+# src/deepagents/chunking.py
+"""
+长文本分块 map-reduce（rewrite / expand / contract 工具共用）
+- 短文本（≤ CHUNK_MAX_TOKENS）原样单次调用，行为与之前完全一致
+- split_text：先按段落（空行 / 换行）切，再把段落贪心装箱到 CHUNK_MAX_TOKENS；
+  超长段落按句切（中文 。！？；… 及其后的引号括号，英文 .!? + 空白），超长句再按字数硬切
+  token 估算与 deepagents.message_window 一致（中英混合）
+- 每块带上一块末尾约 CHUNK_OVERLAP_TOKENS 的原文作“上文”，只供衔接参考、不要求输出，拼接时无需去重
+- 修正点（fix_guidance）单独传入，写进每一块的 system 提示；拼在原文末尾的话切分后只有最后一块看得到
+- map：线程池并发调用 SiliconFlowClient（CHUNK_PARALLELISM；带上当前 contextvars，取消令牌对每块生效）；
+  任一块失败即取消其余并抛出（工具层返回失败 ToolMessage）
+- reduce：按原顺序拼接（块在段落处断开用空行接，在段内断开直接接），再做一遍不调 LLM 的一致性整理：
+  去掉每块输出前后的客套话 / 代码围栏，去掉块首重复上一块末句的情况，收拢多余空行
+- 指标：chunked_calls{op}、chunks{op}、chunk_map_s{op}
+
+配置（env）：
+- CHUNK_MAX_TOKENS=1500      每块上限（也是是否分块的阈值）
+- CHUNK_OVERLAP_TOKENS=120   每块附带的上文长度
+- CHUNK_PARALLELISM=4        同时处理的块数
+"""
+from __future__ import annotations
+import contextvars
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+
+from deepagents import metrics
+from deepagents.message_window import estimate_tokens
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1500"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "120"))
+CHUNK_PARALLELISM = int(os.getenv("CHUNK_PARALLELISM", "4"))
+
+# (system_prompt, user_text) -> 输出文本
+ChunkCall = Callable[[str, str], str]
+
+@dataclass(frozen=True)
+class Chunk:
+    index: int
+    text: str
+    context: str = ""  # 上一块末尾的原文（只作衔接参考）
+    sep: str = ""      # 与上一块拼接时用的分隔（段落边界 "\n\n"；段内：英文 " "，中文 ""）
+
+# ========================= 切分 =========================
+_PARA = re.compile(r"\n\s*\n|\n")
+# 句末：中文标点（可连用，后随右引号 / 括号）或英文 .!? 后跟空白（空白留在下一句开头，拼回时不丢空格）
+_SENT = re.compile(r"(?<=[。！？；…!?;][”’」』）)\"'])|(?<=[。！？；…])(?![。！？；…”’」』）)\"'])|(?<=[.!?])(?=\s)")
+
+def _sentences(para: str) -> List[str]:
+    return [s for s in _SENT.split(para) if s]
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    out, buf, n = [], [], 0
+    for ch in text:
+        t = 0.25 if ch.isascii() else 1
+        if buf and n + t > max_tokens:
+            out.append("".join(buf))
+            buf, n = [], 0
+        buf.append(ch)
+        n += t
+    if buf:
+        out.append("".join(buf))
+    return out
+
+def _pieces(text: str, max_tokens: int) -> List[tuple]:
+    """切成 (片段, 是否段落开头) 的序列，每个片段不超过 max_tokens"""
+    out: List[tuple] = []
+    for para in (p.strip() for p in _PARA.split(text)):
+        if not para:
+            continue
+        if estimate_tokens(para) <= max_tokens:
+            out.append((para, True))
+            continue
+        first = True
+        for sent in _sentences(para):
+            for part in ([sent] if estimate_tokens(sent) <= max_tokens else _hard_split(sent, max_tokens)):
+                out.append((part, first))
+                first = False
+    return out
+
+def _tail(text: str, max_tokens: int) -> str:
+    """取末尾不超过 max_tokens 的若干整句（一句都放不下时按字截）"""
+    if max_tokens <= 0 or not text:
+        return ""
+    picked: List[str] = []
+    n = 0
+    for sent in reversed(_sentences(text)):
+        t = estimate_tokens(sent)
+        if picked and n + t > max_tokens:
+            break
+        picked.append(sent)
+        n += t
+    tail = "".join(reversed(picked))
+    return tail if estimate_tokens(tail) <= max_tokens else _hard_split(tail, max_tokens)[-1]
+
+def split_text(text: str, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[Chunk]:
+    """按段落 / 句子边界切成不超过 max_tokens 的块；每块附带上一块末尾 overlap_tokens 的原文作上文"""
+    max_tokens = max(1, max_tokens or CHUNK_MAX_TOKENS)
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    groups: List[List[tuple]] = []  # 每块的 (片段, 是否段落开头) 列表
+    cur: List[tuple] = []
+    n = 0
+    for piece, starts_para in _pieces(text, max_tokens):
+        t = estimate_tokens(piece)
+        if cur and n + t > max_tokens:
+            groups.append(cur)
+            cur, n = [], 0
+        cur.append((piece, starts_para))
+        n += t
+    if cur:
+        groups.append(cur)
+
+    chunks: List[Chunk] = []
+    prev = ""
+    for i, group in enumerate(groups):
+        body = ""
+        for j, (piece, starts_para) in enumerate(group):
+            body += ("\n\n" + piece.strip()) if (j and starts_para) else piece
+        head = group[0]
+        sep = "" if i == 0 else ("\n\n" if head[1] else (" " if head[0][:1].isspace() else ""))
+        body = body.strip()
+        chunks.append(Chunk(i, body, _tail(prev, overlap_tokens), sep))
+        prev = body
+    return chunks
+
+# ========================= map =========================
+def _with_fix(prompt: str, fix_guidance: str) -> str:
+    fix = (fix_guidance or "").strip()
+    if not fix:
+        return prompt
+    return f"{prompt}\n\n【必须修正点】{fix}\n（请按上述修正点调整结果，只输出最终结果，不要解释。）"
+
+def _chunk_prompt(prompt: str, chunk: Chunk, total: int, fix_guidance: str = "") -> str:
+    return (
+        f"{_with_fix(prompt, fix_guidance)}\n\n"
+        f"（说明：原文较长，已分为 {total} 段分别处理，当前是第 {chunk.index + 1} 段。"
+        "只处理【本段】内容，保持与上下文一致的语气、人称和术语；"
+        "【上文】仅用于衔接参考，不要输出或改写它；直接输出本段结果，不要加标题、编号或任何解释。）"
+    )
+
+def _chunk_input(chunk: Chunk) -> str:
+    if not chunk.context:
+        return f"【本段】\n{chunk.text}"
+    return f"【上文】\n{chunk.context}\n\n【本段】\n{chunk.text}"
+
+def _map(chunks: List[Chunk], prompt: str, call: ChunkCall, parallelism: int, fix_guidance: str = "") -> List[str]:
+    results: List[str] = [""] * len(chunks)
+
+    def _one(c: Chunk) -> str:
+        return call(_chunk_prompt(prompt, c, len(chunks), fix_guidance), _chunk_input(c))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(chunks))), thread_name_prefix="chunk-map")
+    try:
+        futs = {pool.submit(contextvars.copy_context().run, _one, c): c.index for c in chunks}
+        done, _pending = wait(futs, return_when=FIRST_EXCEPTION)
+        for f in done:
+            if f.exception() is not None:
+                raise f.exception()  # finally 里取消尚未开始的块
+        for f, i in futs.items():
+            results[i] = f.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+# ========================= reduce（一致性整理，不调 LLM） =========================
+_FENCE = re.compile(r"^```[\w-]*\n?|\n?```$")
+_CHATTER_HEAD = re.compile(r"^(好的|当然|以下是|下面是|这是|Sure|Here is|Here's)[^\n]{0,40}[：:]\s*\n+", re.IGNORECASE)
+_CHATTER_TAIL = re.compile(r"\n+(希望|如需|如果需要|如有)[^\n]{0,60}$")
+_LABEL = re.compile(r"^【本段】\s*")
+
+def _clean(out: str) -> str:
+    s = _FENCE.sub("", (out or "").strip()).strip()
+    s = _CHATTER_HEAD.sub("", s)
+    s = _CHATTER_TAIL.sub("", s)
+    return _LABEL.sub("", s).strip()
+
+def _drop_repeated_head(prev: str, cur: str) -> str:
+    """模型有时把上一块的最后一句又写一遍：块首与上一块末句相同则去掉"""
+    last = (_sentences(prev) or [""])[-1].strip()
+    if len(last) >= 6 and cur.startswith(last):
+        return cur[len(last):].lstrip()
+    return cur
+
+def stitch(chunks: List[Chunk], outputs: List[str]) -> str:
+    text = ""
+    for c, out in zip(chunks, outputs):
+        out = _clean(out)
+        if text:
+            out = _drop_repeated_head(text, out)
+        text += (c.sep if text else "") + out
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+# ========================= 入口 =========================
+def map_reduce_text(
+    text: str,
+    prompt: str,
+    call: ChunkCall,
+    *,
+    op: str = "text",
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    parallelism: Optional[int] = None,
+    fix_guidance: str = "",
+) -> str:
+    """
+    短文本：call(prompt, text) 单次调用；长文本：分块并发 call，再拼接整理。
+    call(system_prompt, user_text) -> str 由工具提供（通常包一层 sf_client._call_siliconflow_with_meta）。
+    fix_guidance：Validator 的修正点，并入（每一块的）system 提示。
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    if estimate_tokens(text) <= max_tokens:
+        return call(_with_fix(prompt, fix_guidance), text)
+    chunks = split_text(text, max_tokens, overlap_tokens)
+    if len(chunks) <= 1:
+        return call(_with_fix(prompt, fix_guidance), text)
+    t0 = time.perf_counter()
+    outputs = _map(chunks, prompt, call, parallelism or CHUNK_PARALLELISM, fix_guidance)
+    metrics.incr("chunked_calls", op=op)
+    metrics.incr("chunks", len(chunks), op=op)
+    metrics.observe("chunk_map_s", time.perf_counter() - t0, op=op)
+    return stitch(chunks, outputs)
+
+def content_to_text(content: Any) -> str:
+    """SiliconFlow 返回的 content 统一成字符串（JSON 内容序列化）"""
+    if isinstance(content, str):
+        return content
+    try:
+        return json.dumps(content, ensure_ascii=False)
+    except Exception:
+        return str(content)
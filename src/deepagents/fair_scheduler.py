@@ -0,0 +1,276 @@
+# src/deepagents/fair_scheduler.py
+"""
+多租户公平调度（挡在 run_textual_flow 之前的准入闸门）
+- 优先级类（interactive / batch …）之间按权重做加权公平排队（WFQ，虚拟时间最小者先出）
+- 同一类内各租户（tenant，未给出时用 session_id）之间做赤字轮转（DRR），一个租户批量提交不会饿死其它租户
+- 全局并发上限 max_concurrency；单租户并发上限 tenant_max_concurrency（达上限的租户本轮跳过，不积累赤字）
+- 排队等待时间按类写入 deepagents.metrics（sched_queue_wait_s{priority=...}）
+- 后台 worker 用 slot(..., skip_if_tenant_busy=True)：租户已占满（运行 + 排队 ≥ 单租户上限）时立即抛 TenantBusy，
+  由调用方把任务放回队列、先处理其它租户，而不是占着 worker 线程阻塞等待
+
+用法：
+    async with scheduler.aslot(tenant, "interactive"):   # FastAPI 协程
+        ...
+    with scheduler.slot(tenant, "batch"):                 # worker 线程
+        ...
+
+配置（env）：
+- SCHED_MAX_CONCURRENCY=8
+- SCHED_TENANT_MAX_CONCURRENCY=2
+- SCHED_CLASS_WEIGHTS="interactive:4,batch:1"
+- SCHED_TENANT_WEIGHTS="tenant-a:2,tenant-b:1"（未列出的租户权重为 1）
+- SCHED_QUANTUM=1.0（DRR 每轮给租户的额度 = quantum × 权重；请求成本默认 1）
+"""
+from __future__ import annotations
+import asyncio
+import contextlib
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+from deepagents import metrics
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        name, _, w = part.strip().partition(":")
+        if name:
+            try:
+                out[name] = max(float(w or 1), 0.01)
+            except ValueError:
+                out[name] = 1.0
+    return out
+
+SCHED_MAX_CONCURRENCY = int(os.getenv("SCHED_MAX_CONCURRENCY", "8"))
+SCHED_TENANT_MAX_CONCURRENCY = int(os.getenv("SCHED_TENANT_MAX_CONCURRENCY", "2"))
+SCHED_CLASS_WEIGHTS = _parse_weights(os.getenv("SCHED_CLASS_WEIGHTS", "interactive:4,batch:1"))
+SCHED_TENANT_WEIGHTS = _parse_weights(os.getenv("SCHED_TENANT_WEIGHTS", ""))
+SCHED_QUANTUM = float(os.getenv("SCHED_QUANTUM", "1.0"))
+
+class SchedulerTimeout(RuntimeError):
+    """排队超过 timeout 仍未获得执行槽"""
+
+class TenantBusy(RuntimeError):
+    """租户已占满单租户并发（skip_if_tenant_busy=True 时不排队，直接抛出）"""
+
+@dataclass
+class _Waiter:
+    seq: int
+    tenant: str
+    priority: str
+    cost: float
+    wake: Callable[[], None]
+    enqueued_at: float = field(default_factory=time.monotonic)
+    granted: bool = False
+
+@dataclass
+class _TenantQueue:
+    waiters: Deque[_Waiter] = field(default_factory=deque)
+    deficit: float = 0.0
+
+@dataclass
+class _ClassQueue:
+    weight: float
+    vtime: float = 0.0
+    tenants: Dict[str, _TenantQueue] = field(default_factory=dict)
+    ring: Deque[str] = field(default_factory=deque)   # 有排队请求的租户（DRR 轮转顺序）
+
+    def waiting(self) -> int:
+        return sum(len(t.waiters) for t in self.tenants.values())
+
+class FairScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = SCHED_MAX_CONCURRENCY,
+        tenant_max_concurrency: int = SCHED_TENANT_MAX_CONCURRENCY,
+        class_weights: Optional[Dict[str, float]] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        quantum: float = SCHED_QUANTUM,
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.tenant_max_concurrency = max(1, tenant_max_concurrency)
+        self.class_weights = dict(class_weights if class_weights is not None else SCHED_CLASS_WEIGHTS)
+        self.tenant_weights = dict(tenant_weights if tenant_weights is not None else SCHED_TENANT_WEIGHTS)
+        self.quantum = max(quantum, 1e-3)
+        self._lock = threading.Lock()
+        self._classes: Dict[str, _ClassQueue] = {}
+        self._running = 0
+        self._running_by_tenant: Dict[str, int] = {}
+        self._seq = itertools.count()
+
+    # ---------- 内部：入队 / 出队（均在 _lock 内） ----------
+    def _class(self, priority: str) -> _ClassQueue:
+        cq = self._classes.get(priority)
+        if cq is None:
+            cq = self._classes[priority] = _ClassQueue(weight=self.class_weights.get(priority, 1.0))
+        return cq
+
+    def _push(self, w: _Waiter) -> None:
+        cq = self._class(w.priority)
+        if not cq.ring:
+            # 空闲后重新活跃的类：虚拟时间追平当前最小值，不能靠空闲期“攒”额度
+            active = [c.vtime for c in self._classes.values() if c.ring]
+            if active:
+                cq.vtime = max(cq.vtime, min(active))
+        tq = cq.tenants.setdefault(w.tenant, _TenantQueue())
+        if not tq.waiters:
+            cq.ring.append(w.tenant)
+        tq.waiters.append(w)
+
+    def _remove(self, w: _Waiter) -> None:
+        cq = self._classes.get(w.priority)
+        tq = cq.tenants.get(w.tenant) if cq else None
+        if tq and w in tq.waiters:
+            tq.waiters.remove(w)
+            if not tq.waiters:
+                tq.deficit = 0.0
+                cq.ring.remove(w.tenant)
+
+    def _tenant_full(self, tenant: str) -> bool:
+        return self._running_by_tenant.get(tenant, 0) >= self.tenant_max_concurrency
+
+    def _tenant_load(self, tenant: str) -> int:
+        """运行中 + 排队中（各类合计）"""
+        queued = sum(len(cq.tenants[tenant].waiters) for cq in self._classes.values() if tenant in cq.tenants)
+        return self._running_by_tenant.get(tenant, 0) + queued
+
+    def _pick_from_class(self, cq: _ClassQueue) -> Optional[_Waiter]:
+        """类内 DRR：轮到的租户加 quantum×权重 额度，额度够付队首成本则出队"""
+        eligible = [t for t in cq.ring if not self._tenant_full(t)]
+        if not eligible:
+            return None
+        # 每轮至少有一个合格租户的额度增长，循环必然终止
+        while True:
+            for _ in range(len(cq.ring)):
+                tenant = cq.ring[0]
+                tq = cq.tenants[tenant]
+                if self._tenant_full(tenant):
+                    cq.ring.rotate(-1)
+                    continue
+                head = tq.waiters[0]
+                if tq.deficit >= head.cost:
+                    tq.deficit -= head.cost
+                    tq.waiters.popleft()
+                    if not tq.waiters:
+                        tq.deficit = 0.0
+                        cq.ring.popleft()
+                    else:
+                        cq.ring.rotate(-1)
+                    return head
+                tq.deficit += self.quantum * self.tenant_weights.get(tenant, 1.0)
+                if tq.deficit < head.cost:
+                    cq.ring.rotate(-1)
+
+    def _dispatch(self) -> List[_Waiter]:
+        """空出的执行槽按 类 WFQ → 租户 DRR 分配；返回本次放行的等待者"""
+        granted: List[_Waiter] = []
+        while self._running < self.max_concurrency:
+            picked = None
+            for cq in sorted((c for c in self._classes.values() if c.ring), key=lambda c: c.vtime):
+                picked = self._pick_from_class(cq)
+                if picked:
+                    cq.vtime += picked.cost / cq.weight
+                    break
+            if picked is None:
+                break
+            picked.granted = True
+            self._running += 1
+            self._running_by_tenant[picked.tenant] = self._running_by_tenant.get(picked.tenant, 0) + 1
+            granted.append(picked)
+        return granted
+
+    def _finish_wait(self, w: _Waiter) -> None:
+        metrics.observe("sched_queue_wait_s", time.monotonic() - w.enqueued_at, priority=w.priority)
+
+    # ---------- 公共 API ----------
+    def _submit(self, tenant: str, priority: str, cost: float, wake: Callable[[], None],
+                skip_if_tenant_busy: bool = False) -> _Waiter:
+        w = _Waiter(seq=next(self._seq), tenant=tenant or "anonymous", priority=priority or "interactive",
+                    cost=max(cost, 0.0), wake=wake)
+        with self._lock:
+            if skip_if_tenant_busy and self._tenant_load(w.tenant) >= self.tenant_max_concurrency:
+                metrics.incr("sched_tenant_busy", priority=w.priority)
+                raise TenantBusy(f"tenant {w.tenant!r} already has {self.tenant_max_concurrency} runs in flight")
+            self._push(w)
+            granted = self._dispatch()
+        for g in granted:
+            g.wake()
+        return w
+
+    def _withdraw(self, w: _Waiter) -> bool:
+        """撤回排队（超时 / 协程被取消）；若恰好已被放行返回 False，调用方此时持有执行槽"""
+        with self._lock:
+            if w.granted:
+                return False
+            self._remove(w)
+            return True
+
+    def release(self, w: _Waiter) -> None:
+        with self._lock:
+            self._running -= 1
+            n = self._running_by_tenant.get(w.tenant, 1) - 1
+            if n > 0:
+                self._running_by_tenant[w.tenant] = n
+            else:
+                self._running_by_tenant.pop(w.tenant, None)
+            granted = self._dispatch()
+        for g in granted:
+            g.wake()
+
+    @contextlib.contextmanager
+    def slot(self, tenant: str, priority: str = "batch", cost: float = 1.0,
+             timeout: Optional[float] = None, skip_if_tenant_busy: bool = False) -> Iterator[None]:
+        """
+        同步（线程）获取执行槽。
+        skip_if_tenant_busy：该租户运行 + 排队已达单租户上限时不排队，立即抛 TenantBusy
+        （只受全局上限限制时仍按 WFQ / DRR 排队等待）
+        """
+        ev = threading.Event()
+        w = self._submit(tenant, priority, cost, ev.set, skip_if_tenant_busy)
+        if not ev.wait(timeout) and self._withdraw(w):
+            metrics.incr("sched_timeouts", priority=w.priority)
+            raise SchedulerTimeout(f"waited > {timeout}s for a run slot")
+        self._finish_wait(w)
+        try:
+            yield
+        finally:
+            self.release(w)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, tenant: str, priority: str = "interactive", cost: float = 1.0,
+                    timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """异步获取执行槽（不阻塞事件循环；协程被取消时自动出队）"""
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        w = self._submit(tenant, priority, cost,
+                         lambda: loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None)))
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            if self._withdraw(w):
+                metrics.incr("sched_timeouts", priority=w.priority)
+                raise SchedulerTimeout(f"waited > {timeout}s for a run slot")
+        except BaseException:
+            if not self._withdraw(w):
+                self.release(w)
+            raise
+        self._finish_wait(w)
+        try:
+            yield
+        finally:
+            self.release(w)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "max_concurrency": self.max_concurrency,
+                "tenant_max_concurrency": self.tenant_max_concurrency,
+                "running_by_tenant": dict(self._running_by_tenant),
+                "waiting_by_class": {name: cq.waiting() for name, cq in self._classes.items()},
+                "class_weights": {name: cq.weight for name, cq in self._classes.items()},
+            }
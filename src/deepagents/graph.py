@@ -5,8 +5,10 @@ from langchain_core.tools import BaseTool
 from langchain_core.language_models import LanguageModelLike
 from langgraph.prebuilt import create_react_agent
 
-from deepagents.sub_agent import _create_task_tool, SubAgent
+from deepagents.graph_cache import graph_cache, make_key, model_key, schema_key, tool_key, tool_name
+from deepagents.sub_agent import _create_task_batch_tool, _create_task_tool, prewarm_subagents, SubAgent
 from deepagents.state import DeepAgentState
+from deepagents.message_window import MessageWindow, default_window
 from deepagents.model import get_default_model
 
 StateSchema = TypeVar("StateSchema", bound=DeepAgentState)
@@ -23,6 +25,11 @@ def create_deep_agent(
     state_schema: Optional[StateSchemaType] = None,
     *,
     expose_tools_to_main: bool = False,  # ⭐ 关键：默认不把工具暴露给主 Agent
+    cache: bool = True,
+    prewarm: Optional[Sequence[str]] = None,
+    parallel_tasks: bool = True,
+    checkpointer: Any = None,
+    message_window: Optional[MessageWindow] = None,
 ):
     """
     创建 Deep Agent（主 Agent 只暴露 task）。
@@ -30,26 +37,69 @@ def create_deep_agent(
     - instructions: 主 Agent 系统提示，会与 base_prompt 拼接
     - subagents: 子代理配置（每个子代理声明可以使用哪些工具名）
     - expose_tools_to_main: 若 True，则主 Agent 也能直接看到这些 tools（一般保持 False）
+    - cache: 复用已编译的图（键 = 工具集合 / 提示 / 子代理 / 模型配置 / state_schema；见 deepagents.graph_cache）
+             工具实现或凭据变化时用 deepagents.graph_cache.invalidate_graphs() 显式失效
+    - prewarm: 启动时预编译的子代理名（其余子代理首次派发时才编译；默认取 SUBAGENT_PREWARM）
+    - parallel_tasks: 主 Agent 额外获得 task_batch 工具（多个独立子任务并发执行，见 sub_agent._create_task_batch_tool）
+    - checkpointer: 主 Agent 的 LangGraph checkpointer（见 deepagents.checkpointer.make_checkpointer）；
+             调用时 config 带 thread_id 即按线程持久化 / 续接。子代理为一次性调用，不挂检查点
+    - message_window: 主 Agent 与子代理送模前的 token 窗口（pre_model_hook，只裁剪模型输入、不改 state）；
+             默认按模型上下文上限构造（deepagents.message_window.default_window），MESSAGE_WINDOW=0 关闭
     """
     prompt = (instructions + base_prompt) if base_prompt else instructions
     model = model or get_default_model()
     state_schema = state_schema or DeepAgentState
+    tools = list(tools)
+    window = message_window if message_window is not None else default_window(model)
 
+    def _build():
+        return _build_deep_agent(tools, instructions, prompt, model, subagents or [], state_schema,
+                                 expose_tools_to_main, prewarm, parallel_tasks, checkpointer, window)
+
+    if not cache:
+        return _build()
+    key = make_key(
+        "deep_agent",
+        [tool_key(t) for t in tools],
+        prompt,
+        instructions,
+        [dict(a) for a in (subagents or [])],
+        model_key(model),
+        schema_key(state_schema),
+        expose_tools_to_main,
+        parallel_tasks,
+        None if checkpointer is None else f"{type(checkpointer).__qualname__}@{id(checkpointer):x}",
+        window.key() if window else None,
+    )
+    graph = graph_cache.get_or_build("deep_agent", key, _build, tools=[tool_name(t) for t in tools])
+    if prewarm:
+        # 主图命中缓存时 _build 不会执行：这里保证所需子代理已在缓存中（已编译则只是命中）
+        prewarm_subagents(tools, instructions, subagents or [], model, state_schema, prewarm, window)
+    return graph
+
+def _build_deep_agent(tools, instructions, prompt, model, subagents, state_schema, expose_tools_to_main,
+                      prewarm=None, parallel_tasks=True, checkpointer=None, window=None):
+    """实际编译（缓存未命中时调用）"""
     # 只把工具交给 _create_task_tool（内部再分配给子代理）；主 Agent 不直接接触这些工具
     task_tool = _create_task_tool(
-        list(tools),
+        tools,
         instructions,
-        subagents or [],
+        subagents,
         model,
         state_schema,
+        prewarm=prewarm,
+        window=window,
     )
 
-    # 主 Agent 工具：默认只有 task；如确需暴露工具再设 True
-    all_tools = [task_tool] if not expose_tools_to_main else list(tools) + [task_tool]
+    # 主 Agent 工具：默认只有 task（+ task_batch）；如确需暴露工具再设 True
+    task_tools = [task_tool, _create_task_batch_tool(task_tool)] if parallel_tasks else [task_tool]
+    all_tools = task_tools if not expose_tools_to_main else list(tools) + task_tools
 
     return create_react_agent(
         model,
         prompt=prompt,
         tools=all_tools,
         state_schema=state_schema,
+        checkpointer=checkpointer,
+        pre_model_hook=window.as_pre_model_hook(prompt) if window else None,
     )
@@ -0,0 +1,184 @@
+# src/deepagents/graph_cache.py
+"""
+已编译 agent 图缓存（create_react_agent 的产物在请求 / 线程间共享）
+- 键 = (类别, 工具集合, 提示词, 模型配置, state_schema, …) 的摘要；内容相同即命中，无需显式登记
+    工具：name + description + 参数 schema + 实现函数（模块级函数按 模块.限定名；闭包按对象身份，因其捕获了状态）
+    模型：字符串原样；pydantic 模型按 类名 + 字段（SecretStr 只取摘要，不落明文）；其它对象按身份
+    state_schema：模块.限定名 + 对象身份
+- 同一键并发构建只编译一次（每键一把构建锁），其它线程等待后直接复用
+- LRU 淘汰（GRAPH_CACHE_MAX）；invalidate(kind=…, tool=…) / clear() 显式失效（工具实现热更新、凭据轮换等）
+- 指标：graph_compile_s{kind}（编译耗时）、graph_cache_hits / graph_cache_misses{kind}
+
+配置（env）：
+- GRAPH_CACHE_MAX=256       最多缓存的图数量；0 关闭缓存（每次都重新编译）
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from deepagents import metrics
+
+GRAPH_CACHE_MAX = int(os.getenv("GRAPH_CACHE_MAX", "256"))
+
+# ========================= 键：工具 / 模型 / schema 指纹 =========================
+def _jsonable(v: Any) -> Any:
+    secret = getattr(v, "get_secret_value", None)
+    if callable(secret):
+        return "secret:" + hashlib.sha1(str(secret()).encode("utf-8")).hexdigest()[:12]
+    return f"<{type(v).__module__}.{type(v).__qualname__}>"
+
+def _callable_key(fn: Any) -> str:
+    if fn is None:
+        return ""
+    name = f"{getattr(fn, '__module__', '?')}.{getattr(fn, '__qualname__', type(fn).__qualname__)}"
+    if getattr(fn, "__closure__", None) or "<locals>" in name or "<lambda>" in name:
+        name += f"@{id(fn):x}"
+    return name
+
+def tool_key(tool: Any) -> str:
+    """单个工具的指纹（BaseTool / 普通函数 / OpenAI 风格 dict）"""
+    if isinstance(tool, dict):
+        return "dict:" + json.dumps(tool, ensure_ascii=False, sort_keys=True, default=_jsonable)
+    if callable(tool) and not hasattr(tool, "args_schema"):
+        return "fn:" + _callable_key(tool)
+    schema: Any = None
+    try:
+        schema = tool.tool_call_schema.model_json_schema()
+    except Exception:
+        schema = getattr(tool, "args", None)
+    impl = getattr(tool, "func", None) or getattr(tool, "coroutine", None) or type(tool)
+    return json.dumps(
+        [getattr(tool, "name", ""), getattr(tool, "description", ""), schema, _callable_key(impl)],
+        ensure_ascii=False, sort_keys=True, default=_jsonable,
+    )
+
+def tool_name(tool: Any) -> str:
+    if isinstance(tool, dict):
+        return str(tool.get("name") or (tool.get("function") or {}).get("name") or "")
+    return str(getattr(tool, "name", None) or getattr(tool, "__name__", ""))
+
+def model_key(model: Any) -> str:
+    """模型配置指纹：同配置的两个模型实例视为同一个"""
+    if model is None or isinstance(model, str):
+        return f"str:{model}"
+    dump = getattr(model, "model_dump", None)
+    if callable(dump):
+        try:
+            fields_ = dump(exclude_none=True)
+            return f"{type(model).__module__}.{type(model).__qualname__}:" + json.dumps(
+                fields_, ensure_ascii=False, sort_keys=True, default=_jsonable)
+        except Exception:
+            pass
+    return f"obj:{type(model).__qualname__}@{id(model):x}"
+
+def schema_key(schema: Any) -> str:
+    if schema is None:
+        return ""
+    return f"{getattr(schema, '__module__', '?')}.{getattr(schema, '__qualname__', schema)}@{id(schema):x}"
+
+def make_key(kind: str, *parts: Any) -> str:
+    raw = json.dumps([kind, *parts], ensure_ascii=False, sort_keys=True, default=_jsonable)
+    return f"{kind}:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# ========================= 缓存 =========================
+@dataclass
+class _Entry:
+    graph: Any
+    kind: str
+    tools: FrozenSet[str]
+    compile_s: float
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+class GraphCache:
+    def __init__(self, max_size: int = GRAPH_CACHE_MAX) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._building: Dict[str, threading.Lock] = {}
+        self._generation = 0
+
+    def get_or_build(self, kind: str, key: str, build: Callable[[], Any],
+                     tools: Iterable[str] = ()) -> Any:
+        """命中直接返回；否则（每键只一个线程）调用 build() 编译并缓存"""
+        if self.max_size <= 0:
+            return self._compile(kind, build)[0]
+        while True:
+            with self._lock:
+                e = self._entries.get(key)
+                if e is not None:
+                    self._entries.move_to_end(key)
+                    e.hits += 1
+                    metrics.incr("graph_cache_hits", kind=kind)
+                    return e.graph
+                build_lock = self._building.setdefault(key, threading.Lock())
+                generation = self._generation
+            with build_lock:
+                with self._lock:
+                    if key in self._entries:
+                        continue  # 等锁期间别的线程已编译好
+                metrics.incr("graph_cache_misses", kind=kind)
+                try:
+                    graph, elapsed = self._compile(kind, build)
+                except BaseException:
+                    with self._lock:
+                        self._building.pop(key, None)
+                    raise
+                # 入缓存与移除构建锁在同一临界区：否则两步之间到来的调用方既查不到条目、
+                # 也拿不到正在构建的锁，会重复编译
+                with self._lock:
+                    # 编译期间发生过失效：结果照常返回，但不入缓存（可能基于旧工具实现）
+                    if generation == self._generation:
+                        self._entries[key] = _Entry(graph, kind, frozenset(tools), elapsed)
+                        while len(self._entries) > self.max_size:
+                            self._entries.popitem(last=False)
+                            metrics.incr("graph_cache_evictions")
+                    self._building.pop(key, None)
+                return graph
+
+    @staticmethod
+    def _compile(kind: str, build: Callable[[], Any]) -> Tuple[Any, float]:
+        t0 = time.perf_counter()
+        graph = build()
+        elapsed = time.perf_counter() - t0
+        metrics.observe("graph_compile_s", elapsed, kind=kind)
+        return graph, elapsed
+
+    def invalidate(self, *, kind: Optional[str] = None, tool: Optional[str] = None) -> int:
+        """按类别 / 工具名失效（都不给 = 全部）；返回移除条数"""
+        with self._lock:
+            self._generation += 1
+            doomed = [k for k, e in self._entries.items()
+                      if (kind is None or e.kind == kind) and (tool is None or tool in e.tools)]
+            for k in doomed:
+                del self._entries[k]
+        return len(doomed)
+
+    def clear(self) -> int:
+        return self.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_kind: Dict[str, int] = {}
+            for e in self._entries.values():
+                by_kind[e.kind] = by_kind.get(e.kind, 0) + 1
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "by_kind": by_kind,
+                "hits": sum(e.hits for e in self._entries.values()),
+                "compile_s_total": round(sum(e.compile_s for e in self._entries.values()), 4),
+                "building": len(self._building),
+            }
+
+graph_cache = GraphCache()
+
+def invalidate_graphs(*, kind: Optional[str] = None, tool: Optional[str] = None) -> int:
+    """显式失效已缓存的 agent 图（如某工具实现更新后：invalidate_graphs(tool="rewrite_text")）"""
+    return graph_cache.invalidate(kind=kind, tool=tool)
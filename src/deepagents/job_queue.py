@@ -0,0 +1,483 @@
+# src/deepagents/job_queue.py
+"""
+后台任务队列（/jobs 异步模式）
+- LocalJobQueue:  进程内实现（单进程 / 开发环境；也是 Redis 版的本地替身）
+- RedisJobQueue:  Redis 实现（多 worker / 多实例共享；入队/领取/回收均为单次 Lua 原子操作）
+- JobWorkerPool:  线程池 worker，循环 reserve → handler(payload) → ack / nack
+- make_job_queue(): 按 JOB_QUEUE_BACKEND=local|redis 创建队列
+
+语义：
+- 有界：pending 深度超过 max_depth → enqueue 抛 QueueFull
+- 可见性超时：reserve 后任务进入 in-flight，超过 visibility_timeout 未 ack 则重新入队
+  （worker 存活期间由 pool 定期 touch 续期；进程崩溃则到期后被其它 worker 重新领取）
+- 至少一次投递：任务可能被执行多次，handler 需按 job_id/trace_id 幂等
+- 失败重试：nack 后 attempts < max_attempts 重新入队，否则标记 failed
+- 毒任务：attempts 在 reserve 时计数；可见性到期（worker 崩溃 / 卡死）回收时若已达 max_attempts，
+  不再入队，标记 failed 并放入死信列表（dead_letters()），避免反复占用 worker
+- 暂缓：handler 抛 Deferred（如该租户已占满执行槽）→ defer：任务放回队尾、不计 attempts，
+  worker 稍等 JOB_DEFER_BACKOFF_S 后继续领取其它任务（不阻塞在单个租户上）
+- 结果保留：done / failed（含死信）记录保留 JOB_RESULT_TTL 秒后清除（Redis 版为 key 过期；
+  本地版按结束顺序记录到期时间，在 enqueue / get 时清扫）
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from deepagents.cancellation import Cancelled
+
+log = logging.getLogger(__name__)
+
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "100"))
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))
+JOB_DEFER_BACKOFF_S = float(os.getenv("JOB_DEFER_BACKOFF_S", "0.2"))
+
+class QueueFull(RuntimeError):
+    """pending 队列已达上限"""
+
+class Deferred(Exception):
+    """handler 暂不能执行该任务（不算失败）：放回队尾，不计 attempts"""
+
+def _expired_error(attempts: int, last_error: Optional[str]) -> str:
+    msg = f"visibility timeout expired on attempt {attempts} (worker crashed or hung); giving up"
+    return f"{msg}; last error: {last_error}" if last_error else msg
+
+def _new_record(job_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job_id,
+        "status": "queued",      # queued / running / done / failed
+        "attempts": 0,
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "enqueued_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+# ========================= 进程内实现 =========================
+class LocalJobQueue:
+    def __init__(
+        self,
+        max_depth: int = JOB_QUEUE_MAX_DEPTH,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        result_ttl: int = JOB_RESULT_TTL,
+    ) -> None:
+        self.max_depth = max_depth
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self._cv = threading.Condition()
+        self._pending: Deque[str] = deque()
+        self._inflight: Dict[str, float] = {}   # job_id -> 可见性到期时间
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._dead: Deque[str] = deque()
+        self._finished: "OrderedDict[str, float]" = OrderedDict()   # job_id -> 结果到期时间（按结束顺序）
+
+    def _finish(self, job_id: str, now: float, dead: bool = False) -> None:
+        # 调用方持有 self._cv
+        self._finished[job_id] = now + self.result_ttl
+        self._finished.move_to_end(job_id)
+        if dead:
+            self._dead.append(job_id)
+
+    def _sweep(self, now: float) -> None:
+        """清除已过保留期的结束记录（调用方持有 self._cv）；TTL 相同，到期顺序即结束顺序"""
+        while self._finished:
+            job_id, expire_at = next(iter(self._finished.items()))
+            if expire_at > now:
+                break
+            del self._finished[job_id]
+            self._jobs.pop(job_id, None)
+            if self._dead and self._dead[0] == job_id:
+                self._dead.popleft()
+
+    def enqueue(self, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        with self._cv:
+            self._sweep(time.time())
+            if len(self._pending) >= self.max_depth:
+                raise QueueFull(f"queue depth {len(self._pending)} >= {self.max_depth}")
+            self._finished.pop(job_id, None)   # 同 job_id 重新入队：旧记录的到期时间作废
+            self._jobs[job_id] = _new_record(job_id, payload)
+            self._pending.append(job_id)
+            self._cv.notify()
+        return job_id
+
+    def reserve(self, timeout: float = 1.0) -> Optional[Dict[str, Any]]:
+        """领取一个任务（阻塞至多 timeout 秒）；返回任务记录副本"""
+        with self._cv:
+            if not self._pending:
+                self._cv.wait(timeout)
+            if not self._pending:
+                return None
+            job_id = self._pending.popleft()
+            rec = self._jobs[job_id]
+            rec["status"] = "running"
+            rec["attempts"] += 1
+            rec["started_at"] = time.time()
+            self._inflight[job_id] = time.time() + self.visibility_timeout
+            return dict(rec)
+
+    def touch(self, job_id: str) -> None:
+        with self._cv:
+            if job_id in self._inflight:
+                self._inflight[job_id] = time.time() + self.visibility_timeout
+
+    def ack(self, job_id: str, result: Any) -> None:
+        with self._cv:
+            self._inflight.pop(job_id, None)
+            rec = self._jobs.get(job_id)
+            if rec:
+                now = time.time()
+                rec.update(status="done", result=result, error=None, finished_at=now)
+                self._finish(job_id, now)
+
+    def nack(self, job_id: str, error: str) -> None:
+        with self._cv:
+            self._inflight.pop(job_id, None)
+            rec = self._jobs.get(job_id)
+            if not rec:
+                return
+            rec["error"] = error
+            if rec["attempts"] < self.max_attempts:
+                rec["status"] = "queued"
+                self._pending.append(job_id)
+                self._cv.notify()
+            else:
+                now = time.time()
+                rec.update(status="failed", finished_at=now)
+                self._finish(job_id, now, dead=True)
+
+    def defer(self, job_id: str) -> None:
+        """放回队尾且本次领取不计入 attempts"""
+        with self._cv:
+            self._inflight.pop(job_id, None)
+            rec = self._jobs.get(job_id)
+            if not rec:
+                return
+            rec.update(status="queued", attempts=max(rec["attempts"] - 1, 0), started_at=None)
+            self._pending.append(job_id)
+            self._cv.notify()
+
+    def requeue_expired(self) -> List[str]:
+        """
+        把可见性已到期的 in-flight 任务放回队首（至少一次投递）；返回重新入队的 job_id。
+        已达 max_attempts 的进死信（failed），不再投递。
+        """
+        now = time.time()
+        requeued: List[str] = []
+        with self._cv:
+            expired = [jid for jid, dl in self._inflight.items() if dl <= now]
+            for jid in expired:
+                del self._inflight[jid]
+                rec = self._jobs[jid]
+                if rec["attempts"] >= self.max_attempts:
+                    rec.update(status="failed", finished_at=now,
+                               error=_expired_error(rec["attempts"], rec.get("error")))
+                    self._finish(jid, now, dead=True)
+                    log.warning("job %s dead-lettered after %d attempts", jid, rec["attempts"])
+                    continue
+                rec["status"] = "queued"
+                self._pending.appendleft(jid)
+                requeued.append(jid)
+            if requeued:
+                self._cv.notify_all()
+        return requeued
+
+    def dead_letters(self) -> List[str]:
+        with self._cv:
+            return list(self._dead)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cv:
+            self._sweep(time.time())
+            rec = self._jobs.get(job_id)
+            return dict(rec) if rec else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            return {"backend": "local", "pending": len(self._pending), "inflight": len(self._inflight),
+                    "dead": len(self._dead), "max_depth": self.max_depth}
+
+# ========================= Redis 实现 =========================
+# KEYS[1]=pending list, KEYS[2]=job key；ARGV[1]=max_depth, ARGV[2]=job_id, ARGV[3]=record json, ARGV[4]=ttl
+_LUA_ENQUEUE = """
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[1]) then return 0 end
+redis.call('SET', KEYS[2], ARGV[3], 'EX', tonumber(ARGV[4]))
+redis.call('LPUSH', KEYS[1], ARGV[2])
+return 1
+"""
+# KEYS[1]=pending, KEYS[2]=inflight zset, KEYS[3]=attempts hash；ARGV[1]=visibility deadline
+# 返回 {job_id, 本次是第几次投递}
+_LUA_RESERVE = """
+local jid = redis.call('RPOP', KEYS[1])
+if not jid then return false end
+redis.call('ZADD', KEYS[2], tonumber(ARGV[1]), jid)
+local n = redis.call('HINCRBY', KEYS[3], jid, 1)
+return {jid, n}
+"""
+# KEYS[1]=pending, KEYS[2]=inflight, KEYS[3]=attempts hash, KEYS[4]=dead list；ARGV[1]=now, ARGV[2]=max_attempts
+# 返回 {重新入队的 id 列表, 进死信的 id 列表}
+_LUA_REQUEUE = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local requeued, dead = {}, {}
+for _, jid in ipairs(ids) do
+  redis.call('ZREM', KEYS[2], jid)
+  local n = tonumber(redis.call('HGET', KEYS[3], jid) or '0')
+  if n >= tonumber(ARGV[2]) then
+    redis.call('HDEL', KEYS[3], jid)
+    redis.call('LPUSH', KEYS[4], jid)
+    table.insert(dead, jid)
+  else
+    redis.call('RPUSH', KEYS[1], jid)
+    table.insert(requeued, jid)
+  end
+end
+return {requeued, dead}
+"""
+
+class RedisJobQueue:
+    def __init__(
+        self,
+        rds=None,
+        prefix: str = "jobs",
+        max_depth: int = JOB_QUEUE_MAX_DEPTH,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        result_ttl: int = JOB_RESULT_TTL,
+    ) -> None:
+        if rds is None:
+            from deepagents.redis_utils import rds
+        self.rds = rds
+        self.max_depth = max_depth
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.k_pending = f"{prefix}:pending"
+        self.k_inflight = f"{prefix}:inflight"
+        self.k_attempts = f"{prefix}:attempts"
+        self.k_dead = f"{prefix}:dead"
+        self.k_job = f"{prefix}:job:" + "{}"
+        self._enqueue = rds.register_script(_LUA_ENQUEUE)
+        self._reserve = rds.register_script(_LUA_RESERVE)
+        self._requeue = rds.register_script(_LUA_REQUEUE)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.rds.get(self.k_job.format(job_id))
+        return json.loads(raw) if raw else None
+
+    def _store(self, rec: Dict[str, Any]) -> None:
+        self.rds.set(self.k_job.format(rec["job_id"]), json.dumps(rec, ensure_ascii=False, default=str), ex=self.result_ttl)
+
+    def enqueue(self, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        job_id = job_id or str(uuid.uuid4())
+        rec = json.dumps(_new_record(job_id, payload), ensure_ascii=False, default=str)
+        ok = self._enqueue(keys=[self.k_pending, self.k_job.format(job_id)],
+                           args=[self.max_depth, job_id, rec, self.result_ttl])
+        if not ok:
+            raise QueueFull(f"queue depth >= {self.max_depth}")
+        return job_id
+
+    def reserve(self, timeout: float = 1.0) -> Optional[Dict[str, Any]]:
+        got = self._reserve(keys=[self.k_pending, self.k_inflight, self.k_attempts],
+                            args=[time.time() + self.visibility_timeout])
+        if not got:
+            time.sleep(timeout)  # 空队列时轮询间隔
+            return None
+        jid, attempts = got[0], int(got[1])
+        jid = jid.decode() if isinstance(jid, bytes) else jid
+        rec = self._load(jid)
+        if rec is None:  # 记录已过期：丢弃
+            self._forget(jid)
+            return None
+        rec.update(status="running", attempts=attempts, started_at=time.time())
+        self._store(rec)
+        return rec
+
+    def touch(self, job_id: str) -> None:
+        self.rds.zadd(self.k_inflight, {job_id: time.time() + self.visibility_timeout}, xx=True)
+
+    def ack(self, job_id: str, result: Any) -> None:
+        rec = self._load(job_id) or _new_record(job_id, {})
+        rec.update(status="done", result=result, error=None, finished_at=time.time())
+        self._store(rec)
+        self._forget(job_id)
+
+    def _forget(self, job_id: str) -> None:
+        pipe = self.rds.pipeline()
+        pipe.zrem(self.k_inflight, job_id)
+        pipe.hdel(self.k_attempts, job_id)
+        pipe.execute()
+
+    def nack(self, job_id: str, error: str) -> None:
+        rec = self._load(job_id)
+        if rec is None:
+            self._forget(job_id)
+            return
+        rec["error"] = error
+        if rec["attempts"] < self.max_attempts:
+            rec["status"] = "queued"
+            self._store(rec)
+            pipe = self.rds.pipeline()
+            pipe.zrem(self.k_inflight, job_id)
+            pipe.lpush(self.k_pending, job_id)
+            pipe.execute()
+        else:
+            rec.update(status="failed", finished_at=time.time())
+            self._store(rec)
+            self._forget(job_id)
+            self.rds.lpush(self.k_dead, job_id)
+
+    def defer(self, job_id: str) -> None:
+        """放回队尾（reserve 从 RPOP 端取，队尾即 LPUSH 端）且本次领取不计入 attempts"""
+        rec = self._load(job_id)
+        if rec is None:
+            self._forget(job_id)
+            return
+        rec.update(status="queued", attempts=max(rec["attempts"] - 1, 0), started_at=None)
+        self._store(rec)
+        pipe = self.rds.pipeline()
+        pipe.hincrby(self.k_attempts, job_id, -1)
+        pipe.zrem(self.k_inflight, job_id)
+        pipe.lpush(self.k_pending, job_id)
+        pipe.execute()
+
+    def requeue_expired(self) -> List[str]:
+        """到期任务原子地放回队首或进死信（按 attempts）；返回重新入队的 job_id"""
+        now = time.time()
+        got = self._requeue(keys=[self.k_pending, self.k_inflight, self.k_attempts, self.k_dead],
+                            args=[now, self.max_attempts]) or [[], []]
+        requeued, dead = ([j.decode() if isinstance(j, bytes) else j for j in ids] for ids in got)
+        for jid in requeued:
+            rec = self._load(jid)
+            if rec:
+                rec["status"] = "queued"
+                self._store(rec)
+        for jid in dead:
+            rec = self._load(jid)
+            if rec:
+                rec.update(status="failed", finished_at=now, error=_expired_error(rec["attempts"], rec.get("error")))
+                self._store(rec)
+            log.warning("job %s dead-lettered after %s attempts", jid, rec and rec["attempts"])
+        return requeued
+
+    def dead_letters(self) -> List[str]:
+        return [j.decode() if isinstance(j, bytes) else j for j in self.rds.lrange(self.k_dead, 0, -1)]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._load(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "pending": self.rds.llen(self.k_pending),
+            "inflight": self.rds.zcard(self.k_inflight),
+            "dead": self.rds.llen(self.k_dead),
+            "max_depth": self.max_depth,
+        }
+
+def make_job_queue(backend: Optional[str] = None):
+    backend = (backend or os.getenv("JOB_QUEUE_BACKEND", "local")).lower()
+    if backend == "redis":
+        return RedisJobQueue()
+    return LocalJobQueue()
+
+# ========================= Worker 池 =========================
+class JobWorkerPool:
+    """
+    N 个 worker 线程 + 1 个维护线程：
+    - worker：reserve → handler(job_id, payload) → ack(result)；异常 → nack；Deferred → defer 并稍作退避
+    - 维护线程：定期为本进程正在处理的任务续期可见性，并回收已到期的任务
+    """
+
+    def __init__(
+        self,
+        queue,
+        handler: Callable[[str, Dict[str, Any]], Any],
+        workers: int = int(os.getenv("JOB_WORKERS", "4")),
+        tick: float = 5.0,
+        defer_backoff: float = JOB_DEFER_BACKOFF_S,
+    ) -> None:
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.tick = tick
+        self.defer_backoff = defer_backoff
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._active: Dict[str, str] = {}   # job_id -> worker 名
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._maintain, name="job-maintainer", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+
+    def active(self) -> List[str]:
+        with self._lock:
+            return list(self._active)
+
+    def _work(self) -> None:
+        name = threading.current_thread().name
+        while not self._stop.is_set():
+            try:
+                job = self.queue.reserve(timeout=1.0)
+            except Exception as e:
+                log.warning("job reserve failed: %r", e)
+                self._stop.wait(1.0)
+                continue
+            if not job:
+                continue
+            jid = job["job_id"]
+            with self._lock:
+                self._active[jid] = name
+            deferred = False
+            try:
+                result = self.handler(jid, job.get("payload") or {})
+                self.queue.ack(jid, result)
+            except Deferred as e:
+                log.debug("job %s deferred: %s", jid, e)
+                self.queue.defer(jid)
+                deferred = True
+            except Cancelled as e:
+                # 显式取消不重试：记为完成，结果中标明 cancelled
+                self.queue.ack(jid, {"cancelled": True, "reason": str(e)})
+            except Exception as e:
+                log.exception("job %s failed (attempt %s)", jid, job.get("attempts"))
+                self.queue.nack(jid, repr(e))
+            finally:
+                with self._lock:
+                    self._active.pop(jid, None)
+            if deferred:
+                # 队列里可能只剩忙碌租户的任务：退避一下，避免 reserve / defer 空转
+                self._stop.wait(self.defer_backoff)
+
+    def _maintain(self) -> None:
+        while not self._stop.wait(self.tick):
+            try:
+                for jid in self.active():
+                    self.queue.touch(jid)
+                expired = self.queue.requeue_expired()
+                if expired:
+                    log.warning("requeued %d expired jobs: %s", len(expired), expired)
+            except Exception as e:
+                log.warning("job maintenance failed: %r", e)
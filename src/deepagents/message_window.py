@@ -0,0 +1,296 @@
+# src/deepagents/message_window.py
+"""
+消息窗口（按 token 预算裁剪发给模型的消息）
+- estimate_tokens(text):  快速估算（中英混合）：CJK 每字约 1 token，其余每 4 字符约 1 token；
+                          用 UTF-8 字节数推出 CJK 字数（CJK 3 字节 / ASCII 1 字节），整段在 C 层完成，无逐字符循环
+- context_limit(model):   按模型名（前缀匹配）取上下文上限；MODEL_CONTEXT_LIMITS 可覆盖 / 追加
+- MessageWindow.fit(messages) → WindowResult
+    固定保留：开头的 system 消息 + 最后一条 user 消息及其之后的消息（如 Executor 追加的修正提示）
+    中间部分按“单元”从最旧开始丢弃（assistant 的 tool_calls 与其后的 tool 结果是一个单元，不拆开）
+    丢弃的内容以一条 system 说明代替（给了 summarize 则为其摘要）；仍超出时对最长的固定消息做首尾保留的截断
+- 同时支持 dict 消息（调度器 / agent_invoke_with_retry）与 LangChain BaseMessage（图内 pre_model_hook）
+- 节省的 token 写入 deepagents.metrics（window_tokens_saved{where}）
+
+配置（env）：
+- MESSAGE_WINDOW=1                 置 0 关闭
+- MODEL_CONTEXT_LIMITS="o3:200000,deepseek:64000"
+- WINDOW_MAX_TOKENS=0              额外的输入上限（0 = 只受上下文限制；设小一些可压低长会话时延）
+- WINDOW_RESERVE_TOKENS=4096       为输出预留
+- WINDOW_SUMMARIZE=0               置 1 时用 LLM 摘要被丢弃的中间消息（llm_summarizer）
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from deepagents import metrics
+
+MESSAGE_WINDOW = os.getenv("MESSAGE_WINDOW", "1") != "0"
+WINDOW_MAX_TOKENS = int(os.getenv("WINDOW_MAX_TOKENS", "0"))
+WINDOW_RESERVE_TOKENS = int(os.getenv("WINDOW_RESERVE_TOKENS", "4096"))
+WINDOW_SUMMARIZE = os.getenv("WINDOW_SUMMARIZE", "0") == "1"
+
+_DEFAULT_CONTEXT_LIMITS: Dict[str, int] = {
+    "o3": 200_000,
+    "o4": 200_000,
+    "gpt-4.1": 1_000_000,
+    "gpt-4o": 128_000,
+    "deepseek": 64_000,
+    "qwen": 32_000,
+    "glm": 128_000,
+}
+DEFAULT_CONTEXT_LIMIT = 32_000
+
+def _parse_limits(raw: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in (raw or "").split(","):
+        name, _, n = part.strip().rpartition(":")
+        if name and n.strip().isdigit():
+            out[name.strip().lower()] = int(n)
+    return out
+
+MODEL_CONTEXT_LIMITS = {**_DEFAULT_CONTEXT_LIMITS, **_parse_limits(os.getenv("MODEL_CONTEXT_LIMITS", ""))}
+
+# ========================= token 估算 =========================
+def estimate_tokens(text: Any) -> int:
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False, default=str)
+    n = len(text)
+    wide = (len(text.encode("utf-8")) - n) // 2   # 每个 3 字节字符多出 2 字节
+    return wide + (n - wide) // 4 + 1
+
+def model_name(model: Any) -> str:
+    if model is None or isinstance(model, str):
+        return model or ""
+    return str(getattr(model, "model_name", None) or getattr(model, "model", None) or "")
+
+def context_limit(model: Any) -> int:
+    """按模型名取上下文上限：精确匹配优先，其次最长前缀匹配，都没有用 DEFAULT_CONTEXT_LIMIT"""
+    name = model_name(model).lower()
+    if name in MODEL_CONTEXT_LIMITS:
+        return MODEL_CONTEXT_LIMITS[name]
+    best = max((k for k in MODEL_CONTEXT_LIMITS if name.startswith(k)), key=len, default=None)
+    return MODEL_CONTEXT_LIMITS[best] if best else DEFAULT_CONTEXT_LIMIT
+
+# ========================= 消息访问（dict / BaseMessage） =========================
+_ROLE = {"human": "user", "ai": "assistant"}
+
+def _role(m: Any) -> str:
+    if isinstance(m, dict):
+        return m.get("role") or m.get("type") or ""
+    r = getattr(m, "type", "") or ""
+    return _ROLE.get(r, r)
+
+def _content(m: Any) -> Any:
+    return m.get("content") if isinstance(m, dict) else getattr(m, "content", "")
+
+def _has_tool_calls(m: Any) -> bool:
+    if isinstance(m, dict):
+        return bool(m.get("tool_calls"))
+    return bool(getattr(m, "tool_calls", None) or (getattr(m, "additional_kwargs", None) or {}).get("tool_calls"))
+
+def _with_content(m: Any, text: str) -> Any:
+    if isinstance(m, dict):
+        return {**m, "content": text}
+    return m.model_copy(update={"content": text})
+
+def message_tokens(m: Any) -> int:
+    n = estimate_tokens(_content(m)) + 4   # 角色 / 分隔开销
+    if _has_tool_calls(m):
+        calls = m.get("tool_calls") if isinstance(m, dict) else getattr(m, "tool_calls", None)
+        n += estimate_tokens(calls)
+    return n
+
+def _note(like: Any, text: str) -> Any:
+    if like is None or isinstance(like, dict):
+        return {"role": "system", "content": text}
+    from langchain_core.messages import SystemMessage
+    return SystemMessage(content=text)
+
+def _truncate_text(text: str, max_tokens: int) -> str:
+    """按比例截到约 max_tokens：保留开头 2/3 与结尾 1/3，中间标注省略"""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    keep = max(int(len(text) * max_tokens / total) - 20, 0)
+    head, tail = keep * 2 // 3, keep // 3
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n…（中间省略 {omitted} 字）…\n{text[len(text) - tail:] if tail else ''}"
+
+# ========================= 窗口 =========================
+@dataclass
+class WindowResult:
+    messages: List[Any]
+    tokens_before: int
+    tokens_after: int
+    dropped: int = 0
+    truncated: int = 0
+    summarized: bool = False
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.tokens_before - self.tokens_after, 0)
+
+@dataclass(frozen=True)
+class MessageWindow:
+    max_tokens: int
+    reserve_tokens: int = 0                      # 窗口外另需占用的部分（如图里后加的 system prompt）
+    summarize: Optional[Callable[[List[Any]], str]] = field(default=None, compare=False)
+
+    @classmethod
+    def for_model(cls, model: Any = None, *, max_tokens: Optional[int] = None,
+                  summarize: Optional[Callable[[List[Any]], str]] = None) -> "MessageWindow":
+        budget = context_limit(model) - WINDOW_RESERVE_TOKENS
+        cap = WINDOW_MAX_TOKENS if max_tokens is None else max_tokens
+        if cap > 0:
+            budget = min(budget, cap)
+        return cls(max_tokens=max(budget, 256), summarize=summarize)
+
+    def with_reserve(self, text: str) -> "MessageWindow":
+        return replace(self, reserve_tokens=self.reserve_tokens + estimate_tokens(text))
+
+    def key(self) -> str:
+        """进缓存键用（graph_cache）"""
+        s = self.summarize
+        return f"window:{self.max_tokens}:{self.reserve_tokens}:{f'{id(s):x}' if s else ''}"
+
+    def _units(self, middle: Sequence[Any]) -> List[List[Any]]:
+        units: List[List[Any]] = []
+        for m in middle:
+            if _role(m) == "tool" and units and (_has_tool_calls(units[-1][0]) or _role(units[-1][-1]) == "tool"):
+                units[-1].append(m)
+            else:
+                units.append([m])
+        return units
+
+    def fit(self, messages: Sequence[Any], where: str = "agent") -> WindowResult:
+        msgs = list(messages)
+        sizes = [message_tokens(m) for m in msgs]
+        before = sum(sizes)
+        budget = self.max_tokens - self.reserve_tokens
+        if before <= budget:
+            return WindowResult(msgs, before, before)
+
+        lead = 0
+        while lead < len(msgs) and _role(msgs[lead]) == "system":
+            lead += 1
+        last_user = next((i for i in range(len(msgs) - 1, lead - 1, -1) if _role(msgs[i]) == "user"), len(msgs))
+        head, middle, tail = msgs[:lead], msgs[lead:last_user], msgs[last_user:]
+        fixed = sum(sizes[:lead]) + sum(sizes[last_user:])
+
+        units = self._units(middle)
+        kept: List[List[Any]] = []
+        room = budget - fixed - 24   # 给省略说明留位置
+        for unit in reversed(units):  # 从最新往回保留
+            cost = sum(message_tokens(m) for m in unit)
+            if cost > room:
+                break
+            kept.append(unit)
+            room -= cost
+        kept.reverse()
+        n_dropped_units = len(units) - len(kept)
+        dropped = [m for u in units[:n_dropped_units] for m in u]
+
+        out: List[Any] = list(head)
+        summarized = False
+        if dropped:
+            text = f"[较早的 {len(dropped)} 条消息因上下文长度已省略]"
+            if self.summarize is not None:
+                try:
+                    summary = self.summarize(dropped)
+                    if summary:
+                        text = f"[较早对话摘要]\n{summary}"
+                        summarized = True
+                except Exception:
+                    pass
+            out.append(_note(msgs[0] if msgs else None, text))
+        out.extend(m for u in kept for m in u)
+        out.extend(tail)
+
+        # 固定部分本身就超预算：对最长的字符串消息做首尾保留的截断，直到放得下
+        truncated = 0
+        total = sum(message_tokens(m) for m in out)
+        while total > budget:
+            idx = max(
+                (i for i, m in enumerate(out) if isinstance(_content(m), str) and message_tokens(m) > 64),
+                key=lambda i: message_tokens(out[i]), default=None,
+            )
+            if idx is None:
+                break
+            cur = message_tokens(out[idx])
+            target = max(cur - (total - budget), 64)
+            out[idx] = _with_content(out[idx], _truncate_text(_content(out[idx]), target))
+            truncated += 1
+            new_total = sum(message_tokens(m) for m in out)
+            if new_total >= total:
+                break
+            total = new_total
+
+        res = WindowResult(out, before, total, dropped=len(dropped), truncated=truncated, summarized=summarized)
+        metrics.incr("window_trimmed", where=where)
+        metrics.incr("window_tokens_saved", res.tokens_saved, where=where)
+        return res
+
+    def as_pre_model_hook(self, prompt: str = ""):
+        """create_react_agent(pre_model_hook=...)：只裁剪送给模型的输入，不改动图里的 messages"""
+        window = self.with_reserve(prompt) if prompt else self
+
+        def _hook(state: Dict[str, Any]) -> Dict[str, Any]:
+            return {"llm_input_messages": window.fit(state.get("messages") or [], where="graph").messages}
+
+        return _hook
+
+# ========================= 默认窗口 / 摘要 =========================
+_default_windows: Dict[str, MessageWindow] = {}
+_default_lock = threading.Lock()
+
+def default_window(model: Any = None) -> Optional[MessageWindow]:
+    """按模型取默认窗口（MESSAGE_WINDOW=0 时返回 None）；WINDOW_SUMMARIZE=1 时带上 LLM 摘要"""
+    if not MESSAGE_WINDOW:
+        return None
+    name = model_name(model)
+    with _default_lock:
+        w = _default_windows.get(name)
+        if w is None:
+            summarize = llm_summarizer(model) if (WINDOW_SUMMARIZE and model is not None and not isinstance(model, str)) else None
+            w = _default_windows[name] = MessageWindow.for_model(model, summarize=summarize)
+        return w
+
+def fit_messages(messages: Sequence[Any], model: Any = None, where: str = "scheduler") -> WindowResult:
+    """便捷入口：用默认窗口裁剪；关闭时原样返回"""
+    window = default_window(model)
+    if window is None:
+        msgs = list(messages)
+        n = sum(message_tokens(m) for m in msgs)
+        return WindowResult(msgs, n, n)
+    return window.fit(messages, where=where)
+
+_SUMMARY_PROMPT = "请把以下较早的对话压缩成要点摘要（保留事实、约束、用户偏好与未完成事项，不超过 300 字）："
+
+def llm_summarizer(model: Any, cache_size: int = 256) -> Callable[[List[Any]], str]:
+    """用模型摘要被丢弃的中间消息；同一段内容的摘要做 LRU 缓存（长会话里被丢弃的前缀通常不变）"""
+    cache: "OrderedDict[str, str]" = OrderedDict()
+    lock = threading.Lock()
+
+    def _summarize(dropped: List[Any]) -> str:
+        text = "\n".join(f"{_role(m)}: {_content(m)}" for m in dropped)
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        res = model.invoke([{"role": "system", "content": _SUMMARY_PROMPT}, {"role": "user", "content": text}])
+        summary = str(getattr(res, "content", res) or "")
+        with lock:
+            cache[key] = summary
+            while len(cache) > cache_size:
+                cache.popitem(last=False)
+        return summary
+
+    return _summarize
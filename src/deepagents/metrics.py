@@ -0,0 +1,49 @@
+# src/deepagents/metrics.py
+"""
+进程内轻量指标（计数器 / 观测值），供 /metrics 导出
+- incr(name, n=1, **labels):     计数器累加
+- observe(name, value, **labels):记录一次观测（count / sum / max）
+- snapshot():                    导出当前全部指标（JSON 友好）
+- reset():                       清空（测试 / 重新统计用）
+"""
+import threading
+from typing import Any, Dict, Tuple
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_observations: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Dict[str, float]] = {}
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _label_str(labels: Tuple[Tuple[str, str], ...]) -> str:
+    return ",".join(f"{k}={v}" for k, v in labels) or "_"
+
+def incr(name: str, n: float = 1, **labels: Any) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + n
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    k = _key(name, labels)
+    with _lock:
+        o = _observations.setdefault(k, {"count": 0, "sum": 0.0, "max": 0.0})
+        o["count"] += 1
+        o["sum"] += value
+        o["max"] = max(o["max"], value)
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        counters: Dict[str, Dict[str, float]] = {}
+        for (name, labels), v in _counters.items():
+            counters.setdefault(name, {})[_label_str(labels)] = v
+        obs: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (name, labels), o in _observations.items():
+            avg = o["sum"] / o["count"] if o["count"] else 0.0
+            obs.setdefault(name, {})[_label_str(labels)] = {**o, "avg": round(avg, 6)}
+    return {"counters": counters, "observations": obs}
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _observations.clear()
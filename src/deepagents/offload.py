@@ -0,0 +1,132 @@
+# src/deepagents/offload.py
+"""
+阻塞调用卸载 + 事件循环延迟监控
+- run_blocking(fn, *args):  把同步 agent 调用 / 重试退避等阻塞工作放到专用、定长线程池（不占默认执行器），
+                            并带上当前 contextvars（取消令牌、同步模式标记等在线程里依然可见）
+- blocking_stats():         线程池规模 / 在途 / 排队
+- LoopLagMonitor:           周期性 sleep(interval) 并测量实际唤醒延迟，延迟即事件循环被阻塞的时长；
+                            写入 deepagents.metrics（event_loop_lag_s），超过阈值记 warning
+
+配置（env）：
+- BLOCKING_POOL_SIZE=16       专用线程池大小（同时进行的阻塞 agent 调用上限；超出的排队）
+- LOOP_LAG_INTERVAL_S=0.5     监控采样间隔
+- LOOP_LAG_WARN_S=0.2         单次延迟超过该值记 warning
+"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from deepagents import metrics
+
+log = logging.getLogger(__name__)
+
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "16"))
+LOOP_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_S", "0.5"))
+LOOP_LAG_WARN_S = float(os.getenv("LOOP_LAG_WARN_S", "0.2"))
+
+# ========================= 专用线程池 =========================
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_submitted = 0
+_active = 0
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="agent-blocking")
+    return _pool
+
+def _tracked(fn: Callable[..., Any]) -> Callable[..., Any]:
+    def _run(*args: Any, **kwargs: Any) -> Any:
+        global _active
+        with _stats_lock:
+            _active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _stats_lock:
+                _active -= 1
+    return _run
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """在专用线程池执行阻塞函数并等待结果（loop.run_in_executor；保留 contextvars）"""
+    global _submitted
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, _tracked(fn), *args, **kwargs)
+    with _stats_lock:
+        _submitted += 1
+    try:
+        return await loop.run_in_executor(get_blocking_executor(), call)
+    finally:
+        with _stats_lock:
+            _submitted -= 1
+
+def blocking_stats() -> Dict[str, int]:
+    with _stats_lock:
+        return {
+            "pool_size": BLOCKING_POOL_SIZE,
+            "active": _active,
+            "queued": max(_submitted - _active, 0),
+        }
+
+def shutdown_blocking_executor() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+# ========================= 事件循环延迟 =========================
+class LoopLagMonitor:
+    """在目标事件循环上运行的采样任务；start() 需在循环内调用"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_S, warn_s: float = LOOP_LAG_WARN_S) -> None:
+        self.interval = interval
+        self.warn_s = warn_s
+        self.last = 0.0
+        self.max = 0.0
+        self.samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - t0 - self.interval, 0.0)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.samples += 1
+            metrics.observe("event_loop_lag_s", lag)
+            if lag > self.warn_s:
+                log.warning("event loop lag %.3fs (> %.3fs)", lag, self.warn_s)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "last_s": round(self.last, 4),
+            "max_s": round(self.max, 4),
+            "samples": self.samples,
+            "interval_s": self.interval,
+        }
@@ -0,0 +1,174 @@
+# src/deepagents/parse_cache.py
+"""
+简历解析结果缓存（按内容哈希，跨会话复用）
+- 两级键：
+    1) PDF 字节的 SHA-256                       → 提取出的文本（省掉 PDF 提取）
+    2) 规范化文本的 SHA-256 + 模型 + 提示摘要     → 解析出的 JSON（省掉 _PARSE_RESUME_PROMPT 那次 LLM 调用）
+  规范化：NFKC + 空白折叠 + 去首尾空白；同一份简历重新导出 / 粘贴时的空白差异不影响命中
+  提示词改动后摘要变化，旧结果自然不再命中
+- 存储：本地 SQLite（WAL，多线程共用一个连接 + 锁）；命中时刷新 last_used，写入后按条数 / 字节数上限淘汰最久未用的（LRU）
+- LLM 没返回合法 JSON 时（工具包成 {"result", "meta"} 的兜底结果）不缓存，下次仍会重试
+- 指标：parse_cache_hits / parse_cache_misses{level=pdf|parse}；stats() 给出各级命中率（/health 展示）
+
+配置（env）：
+- PARSE_CACHE=1                   置 0 关闭
+- PARSE_CACHE_PATH=<RUN_DIR>/parse_cache.sqlite
+- PARSE_CACHE_MAX_ENTRIES=5000    每级最多条数
+- PARSE_CACHE_MAX_MB=256          每级最多字节数（文本 / JSON 的 UTF-8 长度）
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, Optional
+
+from deepagents import metrics
+
+PARSE_CACHE = os.getenv("PARSE_CACHE", "1") != "0"
+PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH", "")
+PARSE_CACHE_MAX_ENTRIES = int(os.getenv("PARSE_CACHE_MAX_ENTRIES", "5000"))
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "256"))
+
+_LEVELS = ("pdf", "parse")
+
+# ========================= 键 =========================
+_WS = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    return _WS.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+def sha256_bytes(data: Any) -> str:
+    """bytes / bytearray / memoryview / mmap 的 SHA-256（不复制）；str 视为文件路径，分块读取"""
+    h = hashlib.sha256()
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    else:
+        h.update(memoryview(data))
+    return h.hexdigest()
+
+def text_key(text: str, model: str, prompt: str = "") -> str:
+    norm = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{norm}:{model}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}"
+
+def _is_fallback(result: Any) -> bool:
+    return not isinstance(result, dict) or set(result) == {"result", "meta"}
+
+# ========================= 存储 =========================
+class ParseCache:
+    def __init__(self, path: Optional[str] = None, max_entries: int = PARSE_CACHE_MAX_ENTRIES,
+                 max_mb: float = PARSE_CACHE_MAX_MB) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._hits = {lv: 0 for lv in _LEVELS}
+        self._misses = {lv: 0 for lv in _LEVELS}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            from deepagents.run_state import get_runtime_dirs
+
+            path = self.path or PARSE_CACHE_PATH or os.path.join(get_runtime_dirs()["run_dir"], "parse_cache.sqlite")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (level TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (level, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (level, last_used)")
+            conn.commit()
+            self.path, self._conn = path, conn
+        return self._conn
+
+    def get(self, level: str, key: str) -> Optional[str]:
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT value FROM cache WHERE level = ? AND key = ?", (level, key)).fetchone()
+            if row is not None:
+                db.execute("UPDATE cache SET last_used = ? WHERE level = ? AND key = ?", (time.time(), level, key))
+                db.commit()
+                self._hits[level] += 1
+            else:
+                self._misses[level] += 1
+        metrics.incr("parse_cache_hits" if row is not None else "parse_cache_misses", level=level)
+        return None if row is None else row[0]
+
+    def put(self, level: str, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO cache (level, key, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                       (level, key, value, size, time.time()))
+            self._evict(db, level)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection, level: str) -> None:
+        n, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache WHERE level = ?", (level,)).fetchone()
+        if (not self.max_entries or n <= self.max_entries) and (not self.max_bytes or total <= self.max_bytes):
+            return
+        over_n = max(0, n - self.max_entries) if self.max_entries else 0
+        over_b = max(0, total - self.max_bytes) if self.max_bytes else 0
+        doomed, freed = [], 0
+        for key, size in db.execute("SELECT key, size FROM cache WHERE level = ? ORDER BY last_used", (level,)):
+            if len(doomed) >= over_n and freed >= over_b:
+                break
+            doomed.append((level, key))
+            freed += size
+        db.executemany("DELETE FROM cache WHERE level = ? AND key = ?", doomed)
+        metrics.incr("parse_cache_evictions", len(doomed), level=level)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """各级命中 / 未命中 / 命中率（本进程累计）；存储已打开时附带条数"""
+        with self._lock:
+            out: Dict[str, Any] = {"enabled": PARSE_CACHE, "path": self.path}
+            for lv in _LEVELS:
+                h, m = self._hits[lv], self._misses[lv]
+                out[lv] = {"hits": h, "misses": m, "hit_rate": round(h / (h + m), 4) if h + m else None}
+            if self._conn is not None:
+                out["entries"] = dict(self._conn.execute("SELECT level, COUNT(*) FROM cache GROUP BY level").fetchall())
+            return out
+
+parse_cache = ParseCache()
+
+# ========================= 对外：带缓存的提取 / 解析 =========================
+def cached_pdf_text(pdf: Any, extract: Callable[[Any], str]) -> str:
+    """一级：PDF 字节哈希 → 文本；未命中时调用 extract(pdf) 并写入"""
+    if not PARSE_CACHE:
+        return extract(pdf)
+    key = sha256_bytes(pdf)
+    text = parse_cache.get("pdf", key)
+    if text is None:
+        text = extract(pdf)
+        parse_cache.put("pdf", key, text)
+    return text
+
+def cached_resume_parse(text: str, model: str, parse: Callable[[str, str], Dict[str, Any]],
+                        prompt: str = "") -> Dict[str, Any]:
+    """二级：规范化文本哈希 + 模型 + 提示 → 解析 JSON；未命中时调用 parse(text, model)，兜底结果不写入"""
+    if not PARSE_CACHE:
+        return parse(text, model)
+    key = text_key(text, model, prompt)
+    raw = parse_cache.get("parse", key)
+    if raw is not None:
+        return json.loads(raw)
+    result = parse(text, model)
+    if not _is_fallback(result):
+        parse_cache.put("parse", key, json.dumps(result, ensure_ascii=False))
+    return result
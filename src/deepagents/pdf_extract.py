@@ -0,0 +1,271 @@
+# src/deepagents/pdf_extract.py
+"""
+PDF 文本提取（分页并行 + 流式产出）
+- 输入：文件路径（str / PathLike）、bytes / bytearray / memoryview / mmap；base64 先经 decode_pdf_b64（解码前按长度预估拒绝超限）
+- iter_pdf_text(src) 按页序逐块产出文本（每块 PDF_CHUNK_PAGES 页），调用方可边取边处理，不必等整份提取完
+    页数少：当前进程顺序提取
+    页数多：按块交给常驻进程池（MuPDF 提取持有 GIL，线程池无收益）；在途块数有上限，内存不随页数线性增长
+    内存输入走进程池时先落一个临时文件，子进程按路径打开（MuPDF 按需读页，不整份 pickle 给每个进程）
+- 限制：字节数 > PDF_MAX_BYTES 或页数 > PDF_MAX_PAGES 直接抛 PdfLimitError（在提取任何页之前）
+- extract_pdf_text(src) = 整份拼接；无任何文本抛 ValueError（与原 _parse_pdf_bytes 行为一致）
+- 进程池异常（子进程崩溃等）时剩余页回退到当前进程顺序提取
+- 指标：pdf_extract_s{mode}、pdf_pages{mode}、pdf_pool_broken
+
+配置（env）：
+- PDF_MAX_BYTES=52428800       单个 PDF 字节上限（50MB）；0 不限
+- PDF_MAX_PAGES=500            页数上限；0 不限
+- PDF_CHUNK_PAGES=8            每块页数（进程池任务粒度 / 流式产出粒度）
+- PDF_WORKERS=4                进程池大小（不超过 CPU 数）；0 不用进程池
+- PDF_PARALLEL_MIN_PAGES=24    少于该页数直接顺序提取（进程间往返不划算）
+"""
+from __future__ import annotations
+import base64
+import binascii
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+from deepagents import metrics
+
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+PDF_CHUNK_PAGES = max(1, int(os.getenv("PDF_CHUNK_PAGES", "8")))
+PDF_WORKERS = min(int(os.getenv("PDF_WORKERS", "4")), os.cpu_count() or 1)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+
+PdfSource = Union[str, "os.PathLike[str]", bytes, bytearray, memoryview, mmap.mmap]
+
+class PdfLimitError(ValueError):
+    """PDF 超过字节 / 页数上限"""
+
+# ========================= 输入 =========================
+def decode_pdf_b64(pdf_b64: str, max_bytes: Optional[int] = None) -> bytes:
+    """base64（可带 data:application/pdf;base64, 前缀）→ bytes；按编码长度预估，超限时不解码直接拒绝"""
+    max_bytes = PDF_MAX_BYTES if max_bytes is None else max_bytes
+    s = (pdf_b64 or "").strip()
+    if s.startswith("data:"):
+        s = s.partition(",")[2]
+    if max_bytes and len(s) * 3 // 4 > max_bytes:
+        raise PdfLimitError(f"PDF 大小约 {len(s) * 3 // 4} 字节，超过上限 {max_bytes}")
+    try:
+        return base64.b64decode(s)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"PDF base64 解码失败：{e}") from e
+
+def _is_path(src: Any) -> bool:
+    return isinstance(src, (str, os.PathLike))
+
+def _source_size(src: PdfSource) -> int:
+    if _is_path(src):
+        return os.path.getsize(src)
+    return memoryview(src).nbytes
+
+def _open(src: PdfSource):
+    if _is_path(src):
+        return fitz.open(os.fspath(src))
+    data = src if isinstance(src, bytes) else bytes(memoryview(src))
+    return fitz.open(stream=data, filetype="pdf")
+
+def _check_limits(src: PdfSource, max_bytes: int) -> int:
+    size = _source_size(src)
+    if max_bytes and size > max_bytes:
+        raise PdfLimitError(f"PDF 大小 {size} 字节，超过上限 {max_bytes}")
+    return size
+
+# ========================= 子进程：按页区间提取 =========================
+# 每个子进程缓存最近打开的文档（同一份 PDF 的多个块通常落在同一进程，免去重复打开 / 解析 xref）
+_worker_docs: "OrderedDict[Tuple[str, int, int], Any]" = OrderedDict()
+
+def _worker_doc(path: str):
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)  # 临时文件名可能复用：带上 mtime / size
+    doc = _worker_docs.get(key)
+    if doc is None:
+        doc = _worker_docs[key] = fitz.open(path)
+        while len(_worker_docs) > 2:
+            _worker_docs.popitem(last=False)[1].close()
+    else:
+        _worker_docs.move_to_end(key)
+    return doc
+
+def _extract_range(path: str, start: int, stop: int) -> str:
+    doc = _worker_doc(path)
+    return "".join(doc[i].get_text() for i in range(start, stop))
+
+# ========================= 进程池 =========================
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn：服务进程里有大量线程，fork 子进程可能继承到被持有的锁
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_pdf_pool() -> None:
+    """关闭进程池（服务退出时调用；之后再提取会按需重建）"""
+    _reset_pool()
+
+# ========================= 提取 =========================
+def _ranges(pages: int, chunk: int) -> List[Tuple[int, int]]:
+    return [(s, min(s + chunk, pages)) for s in range(0, pages, chunk)]
+
+def _iter_sequential(doc, ranges: List[Tuple[int, int]]) -> Iterator[str]:
+    for start, stop in ranges:
+        yield "".join(doc[i].get_text() for i in range(start, stop))
+
+def _iter_parallel(path: str, ranges: List[Tuple[int, int]], workers: int, doc_src: PdfSource) -> Iterator[str]:
+    pool = _get_pool(workers)
+    todo = deque(ranges)
+    inflight: deque = deque()
+    try:
+        while todo and len(inflight) < workers * 2:
+            r = todo.popleft()
+            inflight.append((r, pool.submit(_extract_range, path, *r)))
+        while inflight:
+            r, fut = inflight.popleft()
+            try:
+                text = fut.result()
+            except BrokenProcessPool:
+                # 子进程异常退出：剩余块（含当前块）回退本进程顺序提取
+                metrics.incr("pdf_pool_broken")
+                _reset_pool()
+                rest = [r] + [x for x, f in inflight] + list(todo)
+                for f in (f for _, f in inflight):
+                    f.cancel()
+                inflight.clear()
+                todo.clear()
+                doc = _open(doc_src)
+                try:
+                    yield from _iter_sequential(doc, rest)
+                finally:
+                    doc.close()
+                return
+            if todo:
+                nxt = todo.popleft()
+                inflight.append((nxt, pool.submit(_extract_range, path, *nxt)))
+            yield text
+    finally:
+        for _, f in inflight:
+            f.cancel()
+
+def iter_pdf_text(
+    src: PdfSource,
+    *,
+    max_pages: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    chunk_pages: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    按页序逐块产出 PDF 文本（每块 chunk_pages 页的 get_text() 拼接）。
+    超限在产出任何内容前抛 PdfLimitError；提前停止迭代会取消尚未开始的块。
+    """
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    max_bytes = PDF_MAX_BYTES if max_bytes is None else max_bytes
+    chunk = max(1, chunk_pages or PDF_CHUNK_PAGES)
+    workers = PDF_WORKERS if workers is None else workers
+    _check_limits(src, max_bytes)
+
+    t0 = time.perf_counter()
+    doc = _open(src)
+    tmp_path: Optional[str] = None
+    mode, pages = "sequential", 0
+    try:
+        if max_pages and doc.page_count > max_pages:
+            raise PdfLimitError(f"PDF 共 {doc.page_count} 页，超过上限 {max_pages}")
+        pages = doc.page_count
+        ranges = _ranges(pages, chunk)
+        if workers <= 0 or pages < max(PDF_PARALLEL_MIN_PAGES, chunk * 2):
+            yield from _iter_sequential(doc, ranges)
+            return
+        mode = "parallel"
+        doc.close()  # 子进程各自按路径打开；本进程不再持有整份文档
+        if _is_path(src):
+            path = os.fspath(src)
+        else:
+            fd, tmp_path = tempfile.mkstemp(suffix=".pdf", prefix="pdf_extract_")
+            with os.fdopen(fd, "wb") as f:
+                f.write(memoryview(src))
+            path = tmp_path
+        yield from _iter_parallel(path, ranges, workers, src)
+    finally:
+        if not doc.is_closed:
+            doc.close()
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        metrics.observe("pdf_extract_s", time.perf_counter() - t0, mode=mode)
+        metrics.incr("pdf_pages", pages, mode=mode)
+
+def extract_pdf_text(src: PdfSource, **kwargs: Any) -> str:
+    """整份提取（iter_pdf_text 的拼接）；无任何文本抛 ValueError"""
+    text = "".join(iter_pdf_text(src, **kwargs))
+    if not text.strip():
+        raise ValueError("无法从PDF中提取任何文本。")
+    return text
+
+# ========================= 基准 =========================
+def _synthetic_pdf(pages: int, lines: int = 40) -> bytes:
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        for i in range(lines):
+            page.insert_text((50, 50 + i * 18), f"Page {p} line {i}: research experience, publications and awards.")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def benchmark(pages: int = 200, workers: int = PDF_WORKERS or 2, repeat: int = 3) -> Dict[str, Any]:
+    """合成多页 PDF，对比 顺序 / 进程池 的吞吐（页/秒）与首块延迟；进程池预热一次不计入"""
+    data = _synthetic_pdf(pages)
+
+    def _run(w: int) -> Tuple[float, float]:
+        best, first = float("inf"), float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            it = iter_pdf_text(data, workers=w, max_pages=0, max_bytes=0)
+            next(it)
+            t1 = time.perf_counter()
+            for _chunk in it:
+                pass
+            best, first = min(best, time.perf_counter() - t0), min(first, t1 - t0)
+        return best, first
+
+    seq, seq_first = _run(0)
+    if workers > 0:
+        "".join(iter_pdf_text(data, workers=workers, max_pages=0, max_bytes=0))  # 预热进程池
+    par, par_first = _run(workers) if workers > 0 else (seq, seq_first)
+    shutdown_pdf_pool()
+    return {
+        "pages": pages,
+        "bytes": len(data),
+        "workers": workers,
+        "sequential_pages_s": round(pages / seq, 1),
+        "parallel_pages_s": round(pages / par, 1),
+        "sequential_first_chunk_ms": round(seq_first * 1000, 2),
+        "parallel_first_chunk_ms": round(par_first * 1000, 2),
+    }
+
+if __name__ == "__main__":
+    print(benchmark())
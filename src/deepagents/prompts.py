@@ -255,6 +255,13 @@ Since the user is greeting, use the greeting-responder agent to respond with a f
 </commentary>
 assistant: "I'm going to use the Task tool to launch with the greeting-responder agent"
 </example>"""
+TASK_BATCH_DESCRIPTION_SUFFIX = """Launch several independent sub-agent jobs at once and wait for all of them.
+
+Pass `jobs` as a list of objects, each with a `description` and a `subagent_type` (same meaning as in the `task` tool).
+Jobs run concurrently and must not depend on each other's output. If one job needs another job's result, use separate `task` calls instead.
+The tool returns one result per job in the order given. A job that fails or times out is reported with "ok": false, and the other jobs still complete.
+Prefer this tool over several consecutive `task` calls when the jobs are independent (e.g. evaluate a resume, draft a statement and name the document)."""
+
 EDIT_DESCRIPTION = """Performs exact string replacements in files. 
 
 Usage:
@@ -0,0 +1,317 @@
+# src/deepagents/rate_limit.py
+"""
+限流子系统
+- 算法：token_bucket（令牌桶，允许 burst 内突发，平均速率 rate/s）、sliding_log（滑动日志，任意 window 内至多 limit 次）
+- Redis 实现：每次判定为单个 Lua 脚本、一次往返、原子执行（时间取 Redis TIME，多实例无时钟偏差）
+- 进程内实现：Redis 不可用时自动回退（仅本进程内生效），恢复后自动切回
+- RateLimitMiddleware：FastAPI / Starlette ASGI 中间件；超限返回 429 + Retry-After / X-RateLimit-* 头
+
+规则（RATE_LIMIT_RULES，JSON；按路径前缀最长匹配，"default" 兜底）：
+    {"default":   {"algorithm": "token_bucket", "rate": 2, "burst": 10},
+     "/generate": {"algorithm": "sliding_log", "limit": 30, "window": 60},
+     "GET /jobs/": {"algorithm": "token_bucket", "rate": 10, "burst": 60}}
+- 规则名可带 "METHOD " 前缀，只匹配该方法的请求；同等长度下带方法的规则优先
+- 内置默认：default 为 token_bucket 2/s、burst 20；轮询类只读接口（GET /jobs/{id}、GET /state/{trace_id}、
+  GET /states）另用一条宽松规则 token_bucket 10/s、burst 60，且各自单独计桶，
+  客户端轮询任务进度不会耗尽提交任务（POST /jobs、/generate）的配额；配置为 null 可移除任一内置规则
+限流主体：X-Tenant-Id → X-Session-Id → 客户端 IP。
+"""
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import redis
+
+from deepagents import metrics
+
+log = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class RateRule:
+    algorithm: str = "token_bucket"   # token_bucket | sliding_log
+    rate: float = 1.0                 # token_bucket：每秒补充令牌数
+    burst: int = 10                   # token_bucket：桶容量
+    limit: int = 60                   # sliding_log：窗口内最多请求数
+    window: float = 60.0              # sliding_log：窗口（秒）
+
+    @property
+    def capacity(self) -> int:
+        return self.burst if self.algorithm == "token_bucket" else self.limit
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float               # 秒；allowed 时为 0
+    backend: str = "redis"
+
+# ========================= Redis Lua =========================
+# KEYS[1]=bucket hash；ARGV[1]=rate/s, ARGV[2]=capacity, ARGV[3]=cost
+# 返回 {allowed, remaining(floor), retry_after_ms}
+_LUA_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local cap = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1])
+local ts = tonumber(b[2])
+if tokens == nil then
+  tokens = cap
+  ts = now
+end
+tokens = math.min(cap, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(cap * 1000 / rate) + 1000)
+return {allowed, math.floor(tokens), retry}
+"""
+
+# KEYS[1]=log zset；ARGV[1]=limit, ARGV[2]=window_ms, ARGV[3]=member（唯一）
+_LUA_SLIDING_LOG = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local n = redis.call('ZCARD', KEYS[1])
+if n < limit then
+  redis.call('ZADD', KEYS[1], now, ARGV[3])
+  redis.call('PEXPIRE', KEYS[1], window)
+  return {1, limit - n - 1, 0}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+local retry = window
+if oldest[2] then retry = tonumber(oldest[2]) + window - now end
+return {0, 0, math.max(retry, 1)}
+"""
+
+# ========================= 进程内回退 =========================
+class _LocalLimiter:
+    def __init__(self, max_keys: int = 10000) -> None:
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._logs: Dict[str, Deque[float]] = {}
+        self._max_keys = max_keys
+
+    def _evict(self, store: Dict[str, Any]) -> None:
+        if len(store) > self._max_keys:
+            for k in list(store)[: len(store) - self._max_keys]:
+                del store[k]
+
+    def check(self, key: str, rule: RateRule, cost: float = 1.0) -> Decision:
+        now = time.monotonic()
+        with self._lock:
+            if rule.algorithm == "sliding_log":
+                q = self._logs.setdefault(key, deque())
+                while q and q[0] <= now - rule.window:
+                    q.popleft()
+                if len(q) < rule.limit:
+                    q.append(now)
+                    self._evict(self._logs)
+                    return Decision(True, rule.limit, rule.limit - len(q), 0.0, "local")
+                return Decision(False, rule.limit, 0, max(q[0] + rule.window - now, 0.001), "local")
+            tokens, ts = self._buckets.get(key, (float(rule.burst), now))
+            tokens = min(rule.burst, tokens + (now - ts) * rule.rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                self._evict(self._buckets)
+                return Decision(True, rule.burst, int(tokens - cost), 0.0, "local")
+            self._buckets[key] = (tokens, now)
+            return Decision(False, rule.burst, int(tokens), (cost - tokens) / rule.rate, "local")
+
+# ========================= 限流器 =========================
+class RateLimiter:
+    def __init__(
+        self,
+        rds=None,
+        prefix: str = "rl",
+        retry_redis_after_s: float = 5.0,
+        async_client: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        if rds is None:
+            from deepagents.redis_utils import rds
+        if async_client is None:
+            from deepagents.redis_utils import get_async_redis as async_client
+        self.rds = rds
+        self.async_client = async_client
+        self._async_scripts: "weakref.WeakKeyDictionary[Any, Tuple[Any, Any]]" = weakref.WeakKeyDictionary()
+        self.prefix = prefix
+        self.local = _LocalLimiter()
+        self._token_bucket = rds.register_script(_LUA_TOKEN_BUCKET)
+        self._sliding_log = rds.register_script(_LUA_SLIDING_LOG)
+        self._retry_redis_after_s = retry_redis_after_s
+        self._redis_down_until = 0.0
+
+    def _script_call(self, key: str, rule: RateRule, cost: float) -> Tuple[str, List[str], List[Any]]:
+        if rule.algorithm == "sliding_log":
+            return "sliding_log", [f"{self.prefix}:log:{key}"], [rule.limit, int(rule.window * 1000), uuid.uuid4().hex]
+        return "token_bucket", [f"{self.prefix}:tb:{key}"], [rule.rate, rule.burst, cost]
+
+    def _redis_check(self, key: str, rule: RateRule, cost: float) -> Decision:
+        which, keys, args = self._script_call(key, rule, cost)
+        script = self._sliding_log if which == "sliding_log" else self._token_bucket
+        allowed, remaining, retry_ms = script(keys=keys, args=args)
+        return Decision(bool(allowed), rule.capacity, int(remaining), int(retry_ms) / 1000.0)
+
+    async def _aredis_check(self, key: str, rule: RateRule, cost: float) -> Decision:
+        client = self.async_client()
+        scripts = self._async_scripts.get(client)
+        if scripts is None:
+            scripts = (client.register_script(_LUA_TOKEN_BUCKET), client.register_script(_LUA_SLIDING_LOG))
+            self._async_scripts[client] = scripts
+        which, keys, args = self._script_call(key, rule, cost)
+        script = scripts[1] if which == "sliding_log" else scripts[0]
+        allowed, remaining, retry_ms = await script(keys=keys, args=args)
+        return Decision(bool(allowed), rule.capacity, int(remaining), int(retry_ms) / 1000.0)
+
+    def check(self, key: str, rule: RateRule, cost: float = 1.0) -> Decision:
+        """判定一次请求；Redis 异常时回退到进程内限流（retry_redis_after_s 后再尝试 Redis）"""
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                return self._redis_check(key, rule, cost)
+            except redis.RedisError as e:
+                self._redis_down_until = time.monotonic() + self._retry_redis_after_s
+                metrics.incr("rate_limit_fallbacks")
+                log.warning("rate limiter falling back to in-process buckets: %r", e)
+        return self.local.check(key, rule, cost)
+
+    async def acheck(self, key: str, rule: RateRule, cost: float = 1.0) -> Decision:
+        """check 的异步版本（redis.asyncio 连接池，不阻塞事件循环）"""
+        if time.monotonic() >= self._redis_down_until:
+            try:
+                return await self._aredis_check(key, rule, cost)
+            except redis.RedisError as e:
+                self._redis_down_until = time.monotonic() + self._retry_redis_after_s
+                metrics.incr("rate_limit_fallbacks")
+                log.warning("rate limiter falling back to in-process buckets: %r", e)
+        return self.local.check(key, rule, cost)
+
+# ========================= 规则 =========================
+def _rule_from(d: Dict[str, Any]) -> RateRule:
+    return RateRule(**{k: d[k] for k in ("algorithm", "rate", "burst", "limit", "window") if k in d})
+
+_POLL_RULE = RateRule(algorithm="token_bucket", rate=10.0, burst=60)
+
+def load_rules(raw: Optional[str] = None) -> Dict[str, RateRule]:
+    raw = raw if raw is not None else os.getenv("RATE_LIMIT_RULES", "")
+    rules = {
+        "default": RateRule(algorithm="token_bucket", rate=2.0, burst=20),
+        # 轮询进度 / 状态的只读接口：单独计桶、更宽松
+        "GET /jobs/": _POLL_RULE,
+        "GET /state": _POLL_RULE,
+    }
+    for k, v in (json.loads(raw) if raw else {}).items():
+        if v is None:
+            rules.pop(k, None)   # {"default": null} → 未匹配路径不限流
+        else:
+            rules[k] = _rule_from(v)
+    return rules
+
+def match_rule(rules: Dict[str, RateRule], path: str, method: Optional[str] = None) -> Tuple[str, Optional[RateRule]]:
+    """按路径前缀最长匹配（"METHOD /prefix" 仅匹配该方法，同长度优先）；都不匹配用 default（未配置 default 则不限流）"""
+    best, best_rank = "", (0, False)
+    for name in rules:
+        if name == "default":
+            continue
+        rule_method, _, prefix = name.rpartition(" ")
+        if rule_method and rule_method.upper() != (method or "").upper():
+            continue
+        rank = (len(prefix), bool(rule_method))
+        if path.startswith(prefix) and rank > best_rank:
+            best, best_rank = name, rank
+    if best:
+        return best, rules[best]
+    return "default", rules.get("default")
+
+def _default_identity(scope: Dict[str, Any]) -> str:
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers") or []}
+    if headers.get("x-tenant-id"):
+        return f"t:{headers['x-tenant-id']}"
+    if headers.get("x-session-id"):
+        return f"s:{headers['x-session-id']}"
+    client = scope.get("client") or ("unknown", 0)
+    return f"ip:{client[0]}"
+
+# ========================= ASGI 中间件 =========================
+class RateLimitMiddleware:
+    """
+    app.add_middleware(RateLimitMiddleware, limiter=RateLimiter(), rules=load_rules())
+    exempt：不限流的路径前缀（健康检查 / 指标等）
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: Optional[RateLimiter] = None,
+        rules: Optional[Dict[str, RateRule]] = None,
+        identity: Callable[[Dict[str, Any]], str] = _default_identity,
+        exempt: Tuple[str, ...] = ("/health", "/metrics"),
+    ) -> None:
+        self.app = app
+        self.limiter = limiter or get_rate_limiter()
+        self.rules = rules if rules is not None else load_rules()
+        self.identity = identity
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt) or scope.get("method") == "OPTIONS":
+            return await self.app(scope, receive, send)
+        name, rule = match_rule(self.rules, scope["path"], scope.get("method"))
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        key = f"{name}:{self.identity(scope)}"
+        d = await self.limiter.acheck(key, rule)
+        headers = [
+            (b"x-ratelimit-limit", str(d.limit).encode()),
+            (b"x-ratelimit-remaining", str(max(d.remaining, 0)).encode()),
+        ]
+        if not d.allowed:
+            metrics.incr("rate_limited", rule=name)
+            retry_after = str(max(1, math.ceil(d.retry_after))).encode()
+            body = json.dumps({"detail": "Rate limit exceeded", "retry_after": d.retry_after}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"retry-after", retry_after),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers") or []) + headers}
+            await send(message)
+        await self.app(scope, receive, _send)
+
+_limiter: Optional[RateLimiter] = None
+
+def get_rate_limiter() -> RateLimiter:
+    """进程级共享限流器（redis_utils.rate_limit 与中间件共用）"""
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
@@ -1,18 +1,70 @@
-import os, time, json, redis
-from typing import Any
+import os, time, json, redis, asyncio, weakref
+import redis.asyncio as aioredis
+from typing import Any, Dict
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-rds = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+# 连接池：显式上限 + 空闲连接健康检查（同步 / 异步客户端各自一个池，参数一致）
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+
+def _pool_kwargs() -> Dict[str, Any]:
+    return dict(
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        retry_on_timeout=True,
+    )
+
+# 同步客户端：worker 线程 / 同步代码使用
+rds = redis.Redis(connection_pool=redis.ConnectionPool.from_url(REDIS_URL, **_pool_kwargs()))
+
+# 异步客户端：async 请求处理使用（连接绑定事件循环，故按循环各建一个池）
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis]" = weakref.WeakKeyDictionary()
+
+def get_async_redis() -> aioredis.Redis:
+    """当前事件循环的 redis.asyncio 客户端（连接池化，首次调用时创建）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.Redis(connection_pool=aioredis.ConnectionPool.from_url(REDIS_URL, **_pool_kwargs()))
+        _async_clients[loop] = client
+    return client
+
+async def aclose_async_redis() -> None:
+    """关闭当前事件循环的异步连接池（应用 shutdown 时调用）"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def pool_stats() -> Dict[str, Any]:
+    pool = rds.connection_pool
+    return {
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "sync_in_use": len(getattr(pool, "_in_use_connections", ()) or ()),
+        "sync_idle": len(getattr(pool, "_available_connections", ()) or ()),
+        "async_pools": len(_async_clients),
+    }
+
+async def aping() -> Dict[str, Any]:
+    """健康检查：异步 PING 并测量往返延迟"""
+    t0 = time.perf_counter()
+    try:
+        await get_async_redis().ping()
+        return {"ok": True, "latency_ms": round((time.perf_counter() - t0) * 1000, 2)}
+    except redis.RedisError as e:
+        return {"ok": False, "error": repr(e)}
 
 def rate_limit(bucket_key: str, limit_per_min: int = 60):
-    now_min = int(time.time() // 60)
-    key = f"rl:{bucket_key}:{now_min}"
-    cnt = rds.incr(key)
-    if cnt == 1:
-        rds.expire(key, 65)
-    if cnt > limit_per_min:
+    """任意 60 秒窗口内至多 limit_per_min 次（滑动日志，单次 Lua 原子判定；见 deepagents.rate_limit）"""
+    from deepagents.rate_limit import RateRule, get_rate_limiter
+    d = get_rate_limiter().check(bucket_key, RateRule(algorithm="sliding_log", limit=limit_per_min, window=60))
+    if not d.allowed:
         from fastapi import HTTPException
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+        raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                            headers={"Retry-After": str(max(1, int(d.retry_after + 0.999)))})
 
 def get_idempotent(key: str):
     v = rds.get(f"idemp:{key}")
@@ -20,3 +72,82 @@ def get_idempotent(key: str):
 
 def set_idempotent(key: str, value: Any, ttl_seconds: int = 600):
     rds.setex(f"idemp:{key}", ttl_seconds, json.dumps(value, ensure_ascii=False))
+
+# ------------ 幂等键：原子认领 + 进行中去重 ------------
+IDEMPOTENCY_PENDING_TTL = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "900"))   # 认领后未完成的最长占用（进程崩溃兜底）
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))                 # 完成结果的保留时长
+
+# KEYS[1]=idemp key；ARGV[1]=owner：仅当仍是本 owner 的 pending 记录时删除（失败释放，不误删他人/已完成结果）
+_LUA_RELEASE = """
+local v = redis.call('GET', KEYS[1])
+if not v then return 0 end
+local ok, rec = pcall(cjson.decode, v)
+if ok and rec['status'] == 'pending' and rec['owner'] == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_release_script = rds.register_script(_LUA_RELEASE)
+
+def claim_idempotent(key: str, fingerprint: str, owner: str, ttl_seconds: int = IDEMPOTENCY_PENDING_TTL):
+    """
+    SET NX 原子认领幂等键：成功返回 (True, None)；已被认领返回 (False, 现有记录)。
+    记录：{"status": "pending"|"done", "owner", "fingerprint", "result"?}
+    """
+    rec = {"status": "pending", "owner": owner, "fingerprint": fingerprint, "ts": time.time()}
+    if rds.set(f"idemp:{key}", json.dumps(rec, ensure_ascii=False), nx=True, ex=ttl_seconds):
+        return True, None
+    return False, get_idempotent(key)
+
+def complete_idempotent(key: str, fingerprint: str, result: Any, ttl_seconds: int = IDEMPOTENCY_TTL):
+    """写入完成结果（覆盖 pending 标记），TTL 内重复请求直接返回该结果"""
+    set_idempotent(key, {"status": "done", "fingerprint": fingerprint, "result": result, "ts": time.time()}, ttl_seconds)
+
+def release_idempotent(key: str, owner: str) -> bool:
+    """运行失败/取消：释放本 owner 的 pending 认领，允许客户端重试"""
+    return bool(_release_script(keys=[f"idemp:{key}"], args=[owner]))
+
+def wait_idempotent(key: str, timeout: float, poll_interval: float = 0.5):
+    """轮询等待其它请求完成同一幂等键；返回完成记录，超时 / 认领被释放返回 None"""
+    deadline = time.monotonic() + timeout
+    while True:
+        rec = get_idempotent(key)
+        if rec is None or rec.get("status") == "done":
+            return rec
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll_interval)
+
+# ------------ 异步版本（redis.asyncio；不阻塞事件循环） ------------
+async def aget_idempotent(key: str):
+    v = await get_async_redis().get(f"idemp:{key}")
+    return json.loads(v) if v else None
+
+async def aclaim_idempotent(key: str, fingerprint: str, owner: str, ttl_seconds: int = IDEMPOTENCY_PENDING_TTL):
+    """claim_idempotent 的异步版本：SET NX 与读取现有记录在同一 pipeline 中一次往返"""
+    rec = {"status": "pending", "owner": owner, "fingerprint": fingerprint, "ts": time.time()}
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        pipe.set(f"idemp:{key}", json.dumps(rec, ensure_ascii=False), nx=True, ex=ttl_seconds)
+        pipe.get(f"idemp:{key}")
+        claimed, current = await pipe.execute()
+    if claimed:
+        return True, None
+    return False, (json.loads(current) if current else None)
+
+async def acomplete_idempotent(key: str, fingerprint: str, result: Any, ttl_seconds: int = IDEMPOTENCY_TTL):
+    value = {"status": "done", "fingerprint": fingerprint, "result": result, "ts": time.time()}
+    await get_async_redis().setex(f"idemp:{key}", ttl_seconds, json.dumps(value, ensure_ascii=False, default=str))
+
+async def arelease_idempotent(key: str, owner: str) -> bool:
+    return bool(await get_async_redis().eval(_LUA_RELEASE, 1, f"idemp:{key}", owner))
+
+async def await_idempotent(key: str, timeout: float, poll_interval: float = 0.5):
+    """wait_idempotent 的异步版本（asyncio.sleep 轮询）"""
+    deadline = time.monotonic() + timeout
+    while True:
+        rec = await aget_idempotent(key)
+        if rec is None or rec.get("status") == "done":
+            return rec
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(poll_interval)
@@ -6,17 +6,29 @@
 - set_todo_status():  更新 ToDo 某一步的状态
 - validate_output():  结果校验（只返回最终结果、JSON 合法性、长度）
 - set_validation():   保存校验结论
+- set_run_status():   更新运行状态（running / completed / cancelled）
+- save_checkpoint() / load_checkpoint(): 续跑检查点（计划、各步产出/尝试次数/反馈、重规划次数）
+- find_orphaned_runs() / claim_run():    找出属主进程已退出的 running 运行，并由当前进程接管
 - load_state():       读取某次运行的完整状态
 - list_states():      列出最近运行摘要
 - configure_runtime():配置并确保 run_dir / mem_dir 存在
 - get_runtime_dirs(): 返回当前目录（健康检查用）
+- acreate_run_state() / aappend_step() / aset_todo_status() / aset_validation() / aset_run_status() / asave_checkpoint():
+                      上述写盘操作的 async 版本（在线程中落盘，不阻塞事件循环）
 """
+import asyncio
 import os
 import json
+import socket
+import tempfile
+import threading
 import uuid
 import time
+import weakref
 from typing import Any, Dict, List, Optional, Tuple
 
+from deepagents.intent import classify
+
 # ------------ 目录配置 ------------
 RUN_DIR = os.getenv("RUN_DIR", "./run_store")
 MEM_DIR = os.getenv("MEMORY_DIR", "./mem_store")
@@ -34,6 +46,10 @@ def configure_runtime(run_dir: Optional[str] = None, mem_dir: Optional[str] = No
 # 确保目录存在
 configure_runtime(RUN_DIR, MEM_DIR)
 
+# running 状态超过该时长未写盘，视为属主已失联（跨主机时的兜底判定）
+RUN_ORPHAN_AFTER_S = float(os.getenv("RUN_ORPHAN_AFTER_S", "600"))
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
 # ------------ 内部工具 ------------
 def _now_iso() -> str:
     return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
@@ -41,9 +57,32 @@ def _now_iso() -> str:
 def _run_path(trace_id: str) -> str:
     return os.path.join(RUN_DIR, f"{trace_id}.json")
 
+# 同一 trace 的读-改-写串行化（进程内）；无人持有时锁随之回收
+_state_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+_state_locks_guard = threading.Lock()
+
+def _state_lock(trace_id: str) -> threading.Lock:
+    with _state_locks_guard:
+        lock = _state_locks.get(trace_id)
+        if lock is None:
+            lock = _state_locks[trace_id] = threading.Lock()
+        return lock
+
 def _save_state(state: Dict[str, Any]) -> None:
-    with open(_run_path(state["trace_id"]), "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2, default=str)
+    # 先写唯一命名的临时文件再原子替换：进程中途崩溃不会留下半截 JSON，并发写者也不会互相覆盖临时文件
+    state["updated_ts"] = time.time()
+    path = _run_path(state["trace_id"])
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{state['trace_id']}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
 
 def _load_state(trace_id: str) -> Dict[str, Any]:
     p = _run_path(trace_id)
@@ -54,33 +93,34 @@ def _load_state(trace_id: str) -> Dict[str, Any]:
 
 # ------------ 动作猜测 ------------
 def _guess_action(user_input: str) -> str:
-    text = user_input.lower()
-    if ("推荐" in user_input) or ("推荐信" in user_input):
-        return "generate_recommendation"
-    if ("陈述" in user_input) or ("ps" in text) or ("statement" in text):
-        return "generate_statement"
-    if ("解析" in user_input and "简历" in user_input) or ("parse" in text and "resume" in text):
-        return "parse_resume_text"
-    if ("精简" in user_input) or ("压缩" in user_input) or ("contract" in text):
-        return "contract"
-    if ("扩写" in user_input) or ("expand" in text):
-        return "expand"
-    if ("命名" in user_input) or ("标题" in user_input):
-        return "name_document"
-    return "rewrite_letter"
+    return classify(user_input).action
 
 # ------------ 公共 API ------------
-def create_run_state(session_id: str, user_input: str) -> Dict[str, Any]:
-    """创建一次运行状态并落盘；返回 state（含 trace_id / todo / action_guess）"""
-    trace_id = str(uuid.uuid4())
-    action = _guess_action(user_input)
+def create_run_state(session_id: str, user_input: str, trace_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    创建一次运行状态并落盘；返回 state（含 trace_id / todo / action_guess）
+    trace_id 可由调用方预先分配（如 /jobs 入队时即返回）；若该 trace 已存在（任务被重新投递），直接沿用。
+    """
+    trace_id = trace_id or str(uuid.uuid4())
+    with _state_lock(trace_id):
+        if os.path.exists(_run_path(trace_id)):
+            return _load_state(trace_id)
+        return _create_run_state(trace_id, session_id, user_input)
+
+def _create_run_state(trace_id: str, session_id: str, user_input: str) -> Dict[str, Any]:
+    intent = classify(user_input)
+    action = intent.action
     state = {
         "trace_id": trace_id,
         "session_id": session_id,
+        "user_input": user_input,
         "created_at": _now_iso(),
+        "owner": _OWNER,
         # 关键：不再预置固定 ToDo，交由三角色调度器动态写入（plan / step-i / step-i-validate）
         "todo": [],
         "action_guess": action,
+        "action_confidence": intent.confidence,
+        "status": "running",
         "steps": [],
         "validation": None,
     }
@@ -89,28 +129,30 @@ def create_run_state(session_id: str, user_input: str) -> Dict[str, Any]:
 
 def append_step(trace_id: str, name: str, status: str = "started", details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """追加 steps 记录并保存；返回最新 state。"""
-    state = _load_state(trace_id)
-    entry = {"ts": _now_iso(), "name": name, "status": status, "details": details or {}}
-    state.setdefault("steps", []).append(entry)
-    _save_state(state)
-    return state
+    with _state_lock(trace_id):
+        state = _load_state(trace_id)
+        entry = {"ts": _now_iso(), "name": name, "status": status, "details": details or {}}
+        state.setdefault("steps", []).append(entry)
+        _save_state(state)
+        return state
 
 def set_todo_status(trace_id: str, step: str, status: str) -> Dict[str, Any]:
     """更新 ToDo 某一步的状态：pending | in_progress | completed | failed"""
-    state = _load_state(trace_id)
-    todo = state.get("todo") or []
-    found = False
-    for item in todo:
-        if item.get("step") == step:
-            item["status"] = status
-            found = True
-            break
-    if not found:
-        # 如果没有该 step，自动追加一条（防御性容错）
-        todo.append({"step": step, "desc": "", "status": status})
-    state["todo"] = todo
-    _save_state(state)
-    return state
+    with _state_lock(trace_id):
+        state = _load_state(trace_id)
+        todo = state.get("todo") or []
+        found = False
+        for item in todo:
+            if item.get("step") == step:
+                item["status"] = status
+                found = True
+                break
+        if not found:
+            # 如果没有该 step，自动追加一条（防御性容错）
+            todo.append({"step": step, "desc": "", "status": status})
+        state["todo"] = todo
+        _save_state(state)
+        return state
 
 def validate_output(action: str, output: str) -> Tuple[bool, List[str]]:
     """基础校验：只返回最终结果；必要时 JSON 合法；长度限制。"""
@@ -141,10 +183,94 @@ def validate_output(action: str, output: str) -> Tuple[bool, List[str]]:
 
 def set_validation(trace_id: str, ok: bool, issues: List[str]) -> Dict[str, Any]:
     """保存校验结果并落盘；返回最新 state。"""
-    state = _load_state(trace_id)
-    state["validation"] = {"ok": ok, "issues": issues, "ts": _now_iso()}
-    _save_state(state)
-    return state
+    with _state_lock(trace_id):
+        state = _load_state(trace_id)
+        state["validation"] = {"ok": ok, "issues": issues, "ts": _now_iso()}
+        _save_state(state)
+        return state
+
+def set_run_status(trace_id: str, status: str, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """更新运行状态：running | completed | cancelled | failed；details 记入 status_details"""
+    with _state_lock(trace_id):
+        state = _load_state(trace_id)
+        state["status"] = status
+        state["status_details"] = {"ts": _now_iso(), **(details or {})}
+        _save_state(state)
+        return state
+
+def save_checkpoint(trace_id: str, checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    保存续跑检查点（整体覆盖）：messages / options / plan_rationale / steps（含 outputs、attempts、status）/
+    replan_times / final_text / last_failed_feedback。resume_textual_flow 据此从最后完成的步骤继续。
+    """
+    with _state_lock(trace_id):
+        state = _load_state(trace_id)
+        state["checkpoint"] = {**checkpoint, "ts": _now_iso()}
+        _save_state(state)
+        return state
+
+def load_checkpoint(trace_id: str) -> Optional[Dict[str, Any]]:
+    """读取检查点；trace 不存在或尚未写过检查点返回 None"""
+    try:
+        return _load_state(trace_id).get("checkpoint")
+    except FileNotFoundError:
+        return None
+
+def _owner_alive(owner: Optional[str]) -> Optional[bool]:
+    """属主是否仍存活：同主机按 pid 判定；其它主机无法判定返回 None"""
+    if not owner or ":" not in owner:
+        return None
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return None
+    if owner == _OWNER:
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+def find_orphaned_runs(stale_after_s: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    status=running 但属主已不在的运行（进程崩溃/重启遗留）：
+    - 同主机：属主 pid 已退出
+    - 其它主机：超过 stale_after_s（默认 RUN_ORPHAN_AFTER_S）未写盘
+    """
+    stale_after_s = RUN_ORPHAN_AFTER_S if stale_after_s is None else stale_after_s
+    now = time.time()
+    items: List[Dict[str, Any]] = []
+    for fn in os.listdir(RUN_DIR):
+        if not fn.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(RUN_DIR, fn), "r", encoding="utf-8") as f:
+                s = json.load(f)
+        except Exception:
+            continue
+        if s.get("status") != "running":
+            continue
+        alive = _owner_alive(s.get("owner"))
+        if alive is False or (alive is None and now - float(s.get("updated_ts") or 0) > stale_after_s):
+            items.append({
+                "trace_id": s.get("trace_id"),
+                "session_id": s.get("session_id"),
+                "owner": s.get("owner"),
+                "has_checkpoint": bool(s.get("checkpoint")),
+            })
+    return items
+
+def claim_run(trace_id: str) -> Dict[str, Any]:
+    """由当前进程接管某次运行（续跑前调用）"""
+    with _state_lock(trace_id):
+        state = _load_state(trace_id)
+        state["owner"] = _OWNER
+        state["status"] = "running"
+        state.setdefault("resumes", []).append(_now_iso())
+        _save_state(state)
+        return state
 
 def load_state(trace_id: str) -> Dict[str, Any]:
     """读取某次运行的完整状态"""
@@ -166,6 +292,7 @@ def list_states(session_id: Optional[str] = None) -> List[Dict[str, Any]]:
                     "session_id": s.get("session_id"),
                     "created_at": s.get("created_at"),
                     "action_guess": s.get("action_guess"),
+                    "status": s.get("status"),
                     "validation": s.get("validation", {}),
                 })
         except Exception:
@@ -173,6 +300,28 @@ def list_states(session_id: Optional[str] = None) -> List[Dict[str, Any]]:
     items.sort(key=lambda x: x.get("created_at") or "", reverse=True)
     return items
 
+# ------------ async 版本（文件 IO 放到线程，供 arun_textual_flow 使用） ------------
+async def acreate_run_state(session_id: str, user_input: str, trace_id: Optional[str] = None) -> Dict[str, Any]:
+    return await asyncio.to_thread(create_run_state, session_id, user_input, trace_id)
+
+async def aappend_step(trace_id: str, name: str, status: str = "started", details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return await asyncio.to_thread(append_step, trace_id, name, status, details)
+
+async def aset_todo_status(trace_id: str, step: str, status: str) -> Dict[str, Any]:
+    return await asyncio.to_thread(set_todo_status, trace_id, step, status)
+
+async def aset_validation(trace_id: str, ok: bool, issues: List[str]) -> Dict[str, Any]:
+    return await asyncio.to_thread(set_validation, trace_id, ok, issues)
+
+async def asave_checkpoint(trace_id: str, checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+    return await asyncio.to_thread(save_checkpoint, trace_id, checkpoint)
+
+async def aclaim_run(trace_id: str) -> Dict[str, Any]:
+    return await asyncio.to_thread(claim_run, trace_id)
+
+async def aset_run_status(trace_id: str, status: str, details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return await asyncio.to_thread(set_run_status, trace_id, status, details)
+
 def get_runtime_dirs() -> Dict[str, str]:
     """返回当前运行目录（健康检查用）"""
     return {"run_dir": RUN_DIR, "mem_dir": MEM_DIR}
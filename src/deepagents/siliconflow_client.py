@@ -8,6 +8,8 @@ import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from deepagents.cancellation import current_token
+
 # 可选：.env 支持
 try:
     from dotenv import load_dotenv
@@ -124,7 +126,12 @@ class SiliconFlowClient(_Prompts):
             # 允许外部透传一些参数，例如 max_tokens / top_p 等
             payload.update(extra_payload)
 
-        resp = self.session.post(self.api_url, json=payload, timeout=self.timeout)
+        token = current_token()
+        if token is not None:
+            # 运行已取消则不再发起；进行中的请求在取消时被放弃（requests 无法从外部中断连接）
+            resp = token.call(self.session.post, self.api_url, json=payload, timeout=self.timeout)
+        else:
+            resp = self.session.post(self.api_url, json=payload, timeout=self.timeout)
         # 非 2xx 会在这里 raise
         resp.raise_for_status()
 
@@ -1,5 +1,6 @@
 # src/deepagents/state.py
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, get_args, get_type_hints
 from typing import Annotated
 from typing_extensions import TypedDict, NotRequired
 from typing import Literal
@@ -10,6 +11,8 @@ class Todo(TypedDict):
     status: Literal["pending", "in_progress", "completed"]
 
 # --- reducers ---
+# 总是返回新容器、不改入参：LangGraph 发出的 state 快照（stream_mode="values"、检查点）与
+# 上一步共享这些对象，原地修改会改写已发出的历史。开销控制在“每次只归并增量”（见 state_delta）。
 def file_reducer(l: Optional[Dict[str, str]], r: Optional[Dict[str, str]]):
     """合并字典：右侧覆盖左侧"""
     if l is None: return r
@@ -56,10 +59,108 @@ class DeepAgentState(AgentState):
     contracted_texts: Annotated[NotRequired[List[str]], list_extend]
     resume_parses: Annotated[NotRequired[List[Dict[str, Any]]], list_extend]
 
+# --- 父子 state 之间的增量 ---
+_MISSING = object()
+
+def _reducer_of(hint: Any) -> Any:
+    meta = getattr(hint, "__metadata__", None)
+    if meta:
+        return next((m for m in meta if callable(m)), None)
+    # NotRequired[Annotated[...]] 等包装：逐层往里找
+    for arg in get_args(hint):
+        fn = _reducer_of(arg)
+        if fn is not None:
+            return fn
+    return None
+
+@lru_cache(maxsize=None)
+def _reducers(schema: Any) -> Dict[str, Any]:
+    """schema 中各字段的 reducer（Annotated 元数据里的可调用对象）"""
+    try:
+        hints = get_type_hints(schema, include_extras=True)
+    except Exception:
+        return {}
+    return {k: fn for k, hint in hints.items() if (fn := _reducer_of(hint)) is not None}
+
+def project_state(state: Dict[str, Any], keys: Any) -> Dict[str, Any]:
+    """
+    取出要交给子代理的键（keys 为 "*" 表示全部，messages 除外）。
+    容器直接共享、不复制：reducer 从不原地修改，子代理的写入只会产生新容器。
+    """
+    picked = state.keys() if keys == "*" else keys
+    return {k: state[k] for k in picked if k != "messages" and k in state}
+
+def state_delta(schema: Any, sent: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    子代理返回的 state 相对发出时的增量（messages 除外），可直接作为父图的 update：
+    - list_extend 字段：只取新追加的尾部（否则父 state 的 reducer 会把已有元素再追加一遍）
+    - file_reducer 字段：只取新增 / 变化的条目
+    - 其它字段：值有变化才返回
+    """
+    reducers = _reducers(schema)
+    delta: Dict[str, Any] = {}
+    for k, v in result.items():
+        if k == "messages":
+            continue
+        old = sent.get(k, _MISSING)
+        if old is _MISSING:
+            if v is not None:
+                delta[k] = v
+            continue
+        if v is old:
+            continue
+        fn = reducers.get(k)
+        if fn is list_extend and isinstance(old, list) and isinstance(v, list):
+            if len(v) > len(old):
+                delta[k] = v[len(old):]
+        elif fn is file_reducer and isinstance(old, dict) and isinstance(v, dict):
+            changed = {fk: fv for fk, fv in v.items() if old.get(fk, _MISSING) != fv}
+            if changed:
+                delta[k] = changed
+        elif v != old:
+            delta[k] = v
+    return delta
+
+def merge_deltas(schema: Any, deltas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    把多个子代理的增量按给定顺序合成一份 update（结果与依次逐个应用相同，与完成先后无关）：
+    有 reducer 的字段依次归并（列表按顺序拼接、字典按顺序覆盖），其余字段后者覆盖前者
+    """
+    reducers = _reducers(schema)
+    merged: Dict[str, Any] = {}
+    for delta in deltas:
+        for k, v in delta.items():
+            fn = reducers.get(k)
+            merged[k] = fn(merged[k], v) if (fn is not None and k in merged) else v
+    return merged
+
 __all__ = [
     "Todo",
     "DeepAgentState",
     "file_reducer",
     "last_write",
     "list_extend",
+    "project_state",
+    "state_delta",
+    "merge_deltas",
 ]
+
+def benchmark(history: int = 5000, repeat: int = 100) -> Dict[str, Any]:
+    """一次 task 往返（投影 → 子代理追加 → 取增量 → 父 reducer 归并）的耗时；父 state 已有 history 条"""
+    import time
+
+    parent = {"rewritten_texts": [f"t{i}" for i in range(history)], "files": {f"f{i}": "p" for i in range(history)}}
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        sent = project_state(parent, ["rewritten_texts", "files"])
+        result = {"rewritten_texts": list_extend(sent["rewritten_texts"], ["new"]),
+                  "files": file_reducer(sent["files"], {"new": "p"})}
+        delta = state_delta(DeepAgentState, sent, result)
+        merged = {k: _reducers(DeepAgentState)[k](parent[k], v) for k, v in delta.items()}
+    elapsed = time.perf_counter() - t0
+    assert delta == {"rewritten_texts": ["new"], "files": {"new": "p"}}
+    assert len(merged["rewritten_texts"]) == history + 1 and len(parent["rewritten_texts"]) == history
+    return {"history": history, "task_roundtrip_ms": round(elapsed / repeat * 1000, 3)}
+
+if __name__ == "__main__":
+    print(benchmark())
@@ -0,0 +1,251 @@
+# src/deepagents/structured_output.py
+"""
+结构化输出引擎（Planner / Validator / Reviewer 的 JSON 输出）
+- IncrementalJSONParser: 增量容错 JSON 解析（可逐块 feed；识别字符串内括号、截断自动补全、尾逗号、代码块围栏）
+- parse_json_lenient():  一次性解析文本中的第一个 JSON 值
+- PlanSpec / VerdictSpec / ReviewSpec: 类型化 schema（pydantic）
+- ainvoke_structured():  请求 response_format → 容错解析 → schema 校验 → 失败时定向修复一次（而非整轮重规划）
+解析失败 / 修复次数写入 deepagents.metrics（structured_* 计数器）。
+"""
+from __future__ import annotations
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+from deepagents import metrics
+
+# ========================= 容错增量解析 =========================
+_FENCE_RE = re.compile(r"```(?:json)?", re.I)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+class IncrementalJSONParser:
+    """
+    逐字符扫描第一个顶层 JSON 值（对象/数组）：
+    - 跟踪字符串与转义，字符串内的括号不影响配对
+    - feed() 可多次调用（流式输出），完整值出现后 done 为 True
+    - finish() 在输入结束仍未闭合时（被截断）补齐引号与括号
+    """
+
+    def __init__(self) -> None:
+        self._buf: List[str] = []
+        self._stack: List[str] = []
+        self._in_str = False
+        self._escape = False
+        self._started = False
+        self._done = False
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: str) -> bool:
+        """喂入一段文本；返回是否已得到完整的顶层值"""
+        for ch in chunk:
+            if self._done:
+                break
+            if not self._started:
+                if ch in "{[":
+                    self._started = True
+                    self._stack.append(ch)
+                    self._buf.append(ch)
+                continue
+            self._buf.append(ch)
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch in "}]":
+                if self._stack and _CLOSERS[self._stack[-1]] == ch:
+                    self._stack.pop()
+                else:
+                    self._buf.pop()  # 错配的右括号直接丢弃
+                if not self._stack:
+                    self._done = True
+        return self._done
+
+    def finish(self) -> str:
+        """返回当前（必要时补全后的）JSON 文本；未见到任何 { / [ 时返回空串"""
+        if not self._started:
+            return ""
+        text = "".join(self._buf)
+        if self._done:
+            return text
+        if self._in_str:
+            text += '"'
+        text = re.sub(r"[,:\s]+$", "", text)
+        # 截断在 key 处（"k" 之后无值）时补 null
+        if re.search(r'[{,]\s*"[^"]*"$', text):
+            text += ": null"
+        return text + "".join(_CLOSERS[c] for c in reversed(self._stack))
+
+def _loads_lenient(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", text)
+    fixed = fixed.replace("“", '"').replace("”", '"')
+    return json.loads(fixed)
+
+def parse_json_lenient(text: Any) -> Any:
+    """从模型输出中解析第一个 JSON 值；失败抛 ValueError"""
+    if isinstance(text, (dict, list)):
+        return text
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("empty output")
+    parser = IncrementalJSONParser()
+    parser.feed(_FENCE_RE.sub("", text))
+    candidate = parser.finish()
+    if not candidate:
+        raise ValueError("no JSON object found")
+    return _loads_lenient(candidate)
+
+# ========================= 类型化 schema =========================
+def _as_list(v: Any) -> Any:
+    if v is None:
+        return []
+    return [v] if isinstance(v, str) else v
+
+class StepSpec(BaseModel):
+    title: str = "执行主要动作"
+    accept_criteria: List[str] = []
+    need_validation: bool = True
+    tool_hint: Optional[str] = None
+    input_from: Optional[int] = None
+
+    @field_validator("accept_criteria", mode="before")
+    @classmethod
+    def _criteria_list(cls, v: Any) -> Any:
+        return _as_list(v)
+
+    @field_validator("input_from", mode="before")
+    @classmethod
+    def _int_or_none(cls, v: Any) -> Any:
+        try:
+            return int(v) if v not in (None, "") else None
+        except (TypeError, ValueError):
+            return None
+
+class PlanSpec(BaseModel):
+    feasible: bool
+    rationale: str = ""
+    steps: List[StepSpec] = []
+
+class VerdictSpec(BaseModel):
+    passed: bool
+    score: float = 0.0
+    must_fix: List[str] = []
+    feedback: str = ""
+
+    @field_validator("must_fix", mode="before")
+    @classmethod
+    def _must_fix_list(cls, v: Any) -> Any:
+        return _as_list(v)
+
+    @field_validator("score", mode="after")
+    @classmethod
+    def _clamp(cls, v: float) -> float:
+        return min(1.0, max(0.0, v))
+
+class ReviewSpec(BaseModel):
+    overall_ok: bool
+    rationale: str = ""
+    revised_steps: List[StepSpec] = []
+
+    @field_validator("revised_steps", mode="before")
+    @classmethod
+    def _steps_list(cls, v: Any) -> Any:
+        return v or []
+
+T = TypeVar("T", bound=BaseModel)
+
+# ========================= response_format =========================
+# STRUCTURED_OUTPUT_MODE: json_schema | json_object | off
+STRUCTURED_OUTPUT_MODE = os.getenv("STRUCTURED_OUTPUT_MODE", "json_object")
+_rf_supported = True  # 后端拒绝 response_format 后置 False，之后不再请求
+
+def response_format_for(schema: Type[BaseModel]) -> Optional[Dict[str, Any]]:
+    if not _rf_supported or STRUCTURED_OUTPUT_MODE == "off":
+        return None
+    if STRUCTURED_OUTPUT_MODE == "json_schema":
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema()},
+        }
+    return {"type": "json_object"}
+
+def mark_response_format_unsupported() -> None:
+    global _rf_supported
+    _rf_supported = False
+
+def is_response_format_error(e: Exception) -> bool:
+    return "response_format" in str(e)
+
+# ========================= 解析 + 校验 + 定向修复 =========================
+def parse_structured(text: Any, schema: Type[T]) -> T:
+    """解析并按 schema 校验；失败抛 ValueError（含可读错误，供修复提示使用）"""
+    try:
+        data = parse_json_lenient(text)
+    except ValueError as e:
+        raise ValueError(f"不是合法 JSON：{e}")
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        raise ValueError(f"不符合 schema：{e.errors(include_url=False)}")
+
+def _repair_messages(raw: Any, err: str, schema: Type[BaseModel]) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "你是 JSON 修复器。只输出修正后的 JSON，不要任何解释。"},
+        {"role": "user", "content": (
+            f"【错误】{err}\n"
+            f"【目标 schema】{json.dumps(schema.model_json_schema(), ensure_ascii=False)}\n"
+            f"【原始输出】<<<BEGIN>>>\n{str(raw)[:6000]}\n<<<END>>>"
+        )},
+    ]
+
+InvokeFn = Callable[[List[Dict[str, str]], Optional[Dict[str, Any]]], Awaitable[Any]]
+
+async def ainvoke_structured(
+    invoke: InvokeFn,
+    messages: List[Dict[str, str]],
+    schema: Type[T],
+    *,
+    kind: str,
+    max_repairs: int = 1,
+) -> Optional[T]:
+    """
+    invoke(messages, response_format) → 模型原始文本。
+    解析/校验失败时，把错误与原输出交给模型做一次（≤max_repairs）定向修复；仍失败返回 None。
+    """
+    raw = await invoke(messages, response_format_for(schema))
+    try:
+        out = parse_structured(raw, schema)
+        metrics.incr("structured_parse_ok", kind=kind)
+        return out
+    except ValueError as e:
+        err = str(e)
+        metrics.incr("structured_parse_failures", kind=kind)
+
+    for _ in range(max_repairs):
+        metrics.incr("structured_repairs", kind=kind)
+        raw = await invoke(_repair_messages(raw, err, schema), response_format_for(schema))
+        try:
+            out = parse_structured(raw, schema)
+            metrics.incr("structured_repair_ok", kind=kind)
+            return out
+        except ValueError as e:
+            err = str(e)
+    metrics.incr("structured_repair_failures", kind=kind)
+    return None
@@ -1,37 +1,119 @@
 # src/deepagents/sub_agent.py
 from __future__ import annotations
-from typing import TypedDict, NotRequired, Annotated, Any, Dict
+from typing import TypedDict, NotRequired, Annotated, Any, Dict, Iterable, List, Optional, Tuple
+import contextvars
 import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing_extensions import TypedDict as _SchemaTypedDict
 
 from langgraph.prebuilt import create_react_agent, InjectedState
 from langgraph.types import Command
 from langchain_core.tools import BaseTool, tool, InjectedToolCallId
 from langchain_core.messages import ToolMessage
 
-from deepagents.prompts import TASK_DESCRIPTION_PREFIX, TASK_DESCRIPTION_SUFFIX
-from deepagents.state import DeepAgentState
+from deepagents.cancellation import CancelToken, cancel_config, current_token, reset_current_token, set_current_token
+from deepagents.graph_cache import graph_cache, make_key, model_key, schema_key, tool_key
+from deepagents.message_window import MessageWindow
+from deepagents.prompts import TASK_BATCH_DESCRIPTION_SUFFIX, TASK_DESCRIPTION_PREFIX, TASK_DESCRIPTION_SUFFIX
+from deepagents.state import DeepAgentState, merge_deltas, project_state, state_delta
+
+class TaskJob(_SchemaTypedDict):  # 出现在工具参数里，pydantic 在 3.11 上要求 typing_extensions 版本
+    description: Any
+    subagent_type: str
 
 class SubAgent(TypedDict):
     name: str
     description: str
     prompt: str
     tools: NotRequired[list[str]]  # 工具名字符串，需与 @tool(name="...") 一致
+    state_keys: NotRequired[list[str]]  # 需要从父 state 带入的键（不声明则只给任务描述；"*" 表示全部）
 
-def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, state_schema):
+def _compiled_agent(model, prompt: str, tools: list, state_schema, kind: str = "subagent",
+                    window: Optional[MessageWindow] = None):
     """
-    生成一个名为 `task` 的工具：
-    - 接受 description(可为 dict/list/str) + subagent_type
-    - 将任务路由给目标子代理
-    - 合并子代理返回的 state（除 messages 外）
-    - 回传一条 ToolMessage 作为汇报
+    create_react_agent 的缓存版本：同模型配置 / 提示 / 工具 / schema / 消息窗口的图只编译一次（见 deepagents.graph_cache）
+    window 非空时挂 pre_model_hook，按 token 预算裁剪送给模型的消息（见 deepagents.message_window）
     """
+    key = make_key(kind, model_key(model), prompt, [tool_key(t) for t in tools], schema_key(state_schema),
+                   window.key() if window else None)
+    hook = window.as_pre_model_hook(prompt) if window else None
+    return graph_cache.get_or_build(
+        kind, key,
+        lambda: create_react_agent(model, prompt=prompt, tools=tools, state_schema=state_schema,
+                                   pre_model_hook=hook),
+        tools=[t.name for t in tools],
+    )
+
+# 子代理按需编译：首次派发时才 create_react_agent（SUBAGENT_LAZY=0 恢复启动时全部编译）
+SUBAGENT_LAZY = os.getenv("SUBAGENT_LAZY", "1") != "0"
+# task_batch：同时运行的子代理任务数上限 / 单个任务超时（秒，0 表示不限）
+TASK_BATCH_CONCURRENCY = int(os.getenv("TASK_BATCH_CONCURRENCY", "4"))
+TASK_BATCH_TIMEOUT_S = float(os.getenv("TASK_BATCH_TIMEOUT_S", "180"))
+# 启动时预热的子代理名（逗号分隔），如 "doc-writer"
+SUBAGENT_PREWARM = [n.strip() for n in os.getenv("SUBAGENT_PREWARM", "").split(",") if n.strip()]
+
+class _LazyAgents:
+    """子代理名 → 图；首次 get() 时编译，每个名字只编译一次（并发首访只有一个线程编译，其余等待复用）"""
+
+    def __init__(self, model, state_schema, window: Optional[MessageWindow] = None) -> None:
+        self._model = model
+        self._state_schema = state_schema
+        self._window = window
+        self._specs: Dict[str, tuple] = {}
+        self._graphs: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, prompt: str, tools: list, state_keys: Any = ()) -> None:
+        self._specs[name] = (prompt, tools, state_keys)
+        self._locks[name] = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def names(self) -> list[str]:
+        return list(self._specs)
+
+    def state_keys(self, name: str) -> Any:
+        return self._specs[name][2]
+
+    @property
+    def state_schema(self):
+        return self._state_schema or DeepAgentState
+
+    def get(self, name: str):
+        graph = self._graphs.get(name)
+        if graph is not None:
+            return graph
+        with self._locks[name]:
+            graph = self._graphs.get(name)
+            if graph is None:
+                prompt, tools, _keys = self._specs[name]
+                graph = _compiled_agent(self._model, prompt, tools, self._state_schema, window=self._window)
+                with self._lock:
+                    self._graphs[name] = graph
+        return graph
+
+    def warm(self, names: Optional[Iterable[str]] = None) -> list[str]:
+        """预编译指定子代理（None = 全部）；未声明的名字忽略，返回实际预热的名字"""
+        picked = [n for n in (self.names() if names is None else names) if n in self._specs]
+        for n in picked:
+            self.get(n)
+        return picked
 
+    def compiled(self) -> list[str]:
+        with self._lock:
+            return list(self._graphs)
+
+def _subagent_registry(tools, instructions, subagents: list[SubAgent], model, state_schema,
+                       window: Optional[MessageWindow] = None) -> _LazyAgents:
+    """登记 general-purpose + 各子代理（只记录提示与工具，不编译）"""
     # 1) 可选的“通用子代理”：不给任何工具，避免乱调（如不需要可删除此项）
-    agents = {
-        "general-purpose": create_react_agent(
-            model, prompt=instructions, tools=[], state_schema=state_schema
-        )
-    }
+    agents = _LazyAgents(model, state_schema, window)
+    agents.add("general-purpose", instructions, [])
 
     # 2) 建立 工具名 -> 工具对象 的映射
     tools_by_name = {}
@@ -48,9 +130,76 @@ def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, sta
             _tools = [tools_by_name[t] for t in _agent["tools"] if t in tools_by_name]
         else:
             _tools = []  # 不声明则不给工具，确保一切可控
-        agents[_agent["name"]] = create_react_agent(
-            model, prompt=_agent["prompt"], tools=_tools, state_schema=state_schema
-        )
+        agents.add(_agent["name"], _agent["prompt"], _tools, _agent.get("state_keys", ()))
+    return agents
+
+def prewarm_subagents(tools, instructions, subagents: list[SubAgent], model, state_schema,
+                      names: Optional[Iterable[str]] = None,
+                      window: Optional[MessageWindow] = None) -> list[str]:
+    """
+    预编译指定子代理并放入 graph_cache（None = 全部）：之后任何 task 工具首次派发这些子代理都直接命中缓存。
+    缓存关闭（GRAPH_CACHE_MAX=0）时无处保存，直接返回空列表。
+    """
+    if graph_cache.max_size <= 0:
+        return []
+    return _subagent_registry(tools, instructions, subagents, model, state_schema, window).warm(names)
+
+def _dispatch(agents: _LazyAgents, state: Dict[str, Any], description: Any,
+              subagent_type: str) -> Tuple[Dict[str, Any], str, bool]:
+    """
+    把一个任务交给子代理执行；返回 (state 增量（不含 messages）, 汇报文本, 是否成功)。
+    task / task_batch 共用。
+    """
+    # 5) 选择子代理
+    if subagent_type not in agents:
+        allowed = ", ".join(f"`{k}`" for k in agents.names())
+        return {}, f"Error: invoked agent type `{subagent_type}` not found. Allowed: {allowed}", False
+
+    sub_agent = agents.get(subagent_type)
+
+    # 6) description 允许运行时传 dict/list，转 JSON 字符串
+    if isinstance(description, (dict, list)):
+        try:
+            description = json.dumps(description, ensure_ascii=False)
+        except Exception:
+            description = str(description)
+
+    # 7) 以 description 作为用户消息调用子代理（不带入历史，避免污染）
+    # 只带入子代理声明的键（共享引用：reducer 从不原地修改），不再整份复制父 state
+    sent = project_state(state, agents.state_keys(subagent_type))
+    new_state = {**sent, "messages": [{"role": "user", "content": description}]}
+    try:
+        # 当前取消令牌（task_batch 中为各任务的子令牌）在子代理每次 LLM / 工具调用前检查
+        result: Dict[str, Any] = sub_agent.invoke(new_state, config=cancel_config())
+    except Exception as e:
+        return {}, f"Subagent `{subagent_type}` failed: {e}", False
+
+    # 8) 只合并子代理实际改动的键（列表字段只取新追加部分，避免父 reducer 重复累加）
+    update = state_delta(agents.state_schema, sent, result)
+
+    # 9) 取子代理最后一条消息作为汇报
+    try:
+        last_msg = result["messages"][-1].content
+    except Exception:
+        last_msg = "[Subagent finished with no final message]"
+    return update, last_msg, True
+
+def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, state_schema,
+                      *, lazy: Optional[bool] = None, prewarm: Optional[Iterable[str]] = None,
+                      window: Optional[MessageWindow] = None):
+    """
+    生成一个名为 `task` 的工具：
+    - 接受 description(可为 dict/list/str) + subagent_type
+    - 将任务路由给目标子代理
+    - 合并子代理返回的 state（除 messages 外）
+    - 回传一条 ToolMessage 作为汇报
+    子代理默认在首次派发时编译（lazy）；prewarm 给出的名字（默认取 SUBAGENT_PREWARM）在这里预先编译。
+    编译状态挂在 task.metadata["subagents"]（_LazyAgents），可在启动后继续 warm()。
+    window：子代理送模前的消息窗口（None = 不裁剪）。
+    """
+    lazy = SUBAGENT_LAZY if lazy is None else lazy
+    agents = _subagent_registry(tools, instructions, subagents, model, state_schema, window)
+    agents.warm(None if not lazy else (SUBAGENT_PREWARM if prewarm is None else prewarm))
 
     # 4) 生成描述字符串展示有哪些子代理
     other_agents_lines = [f"- {_agent['name']}: {_agent['description']}" for _agent in subagents]
@@ -63,47 +212,160 @@ def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, sta
         state: Annotated[DeepAgentState, InjectedState],
         tool_call_id: Annotated[str, InjectedToolCallId],
     ) -> Command:
-        # 5) 选择子代理
-        if subagent_type not in agents:
-            allowed = ", ".join(f"`{k}`" for k in agents.keys())
-            return Command(update={"messages": [ToolMessage(
-                f"Error: invoked agent type `{subagent_type}` not found. Allowed: {allowed}",
-                tool_call_id=tool_call_id
-            )]})
-
-        sub_agent = agents[subagent_type]
-
-        # 6) description 允许运行时传 dict/list，转 JSON 字符串
-        if isinstance(description, (dict, list)):
-            try:
-                description = json.dumps(description, ensure_ascii=False)
-            except Exception:
-                description = str(description)
-
-        # 7) 以 description 作为用户消息调用子代理（不带入历史，避免污染）
-        new_state = dict(state)
-        new_state["messages"] = [{"role": "user", "content": description}]
-        try:
-            result: Dict[str, Any] = sub_agent.invoke(new_state)
-        except Exception as e:
-            return Command(update={"messages": [ToolMessage(
-                f"Subagent `{subagent_type}` failed: {e}", tool_call_id=tool_call_id
-            )]})
-
-        # 8) 合并子代理返回（除 messages）
-        update: Dict[str, Any] = {}
-        for k, v in result.items():
-            if k != "messages":
-                update[k] = v
-
-        # 9) 取子代理最后一条消息作为汇报
+        update, report, _ok = _dispatch(agents, state, description, subagent_type)
+        update["messages"] = [ToolMessage(report, tool_call_id=tool_call_id)]
+        return Command(update=update)
+
+    task.metadata = {**(task.metadata or {}), "subagents": agents}
+    return task
+
+def _run_jobs(agents: _LazyAgents, state: Dict[str, Any], jobs: List[Any], max_concurrency: int,
+              timeout_s: float) -> List[Tuple[Dict[str, Any], str, bool]]:
+    """
+    并发执行一批任务（线程池，带上当前 contextvars）；结果按 jobs 原顺序返回。
+    每个任务在当前取消令牌的子令牌下运行：整体取消时全部随之取消；单个任务超时只取消它自己
+    （子代理在下一次 LLM / 工具调用前停下），不再在后台继续跑。
+    """
+    results: List[Optional[Tuple[Dict[str, Any], str, bool]]] = [None] * len(jobs)
+    started: Dict[int, float] = {}
+    limit = timeout_s if timeout_s and timeout_s > 0 else None
+    parent = current_token()
+    tokens = [parent.child() if parent else CancelToken() for _ in jobs]
+
+    def _one(i: int, job: Any):
+        started[i] = time.monotonic()
+        reset = set_current_token(tokens[i])
         try:
-            last_msg = result["messages"][-1].content
-        except Exception:
-            last_msg = "[Subagent finished with no final message]"
+            tokens[i].raise_if_cancelled()
+            if not isinstance(job, dict):
+                return {}, f"Error: job #{i} must be an object with description and subagent_type", False
+            return _dispatch(agents, state, job.get("description", ""), str(job.get("subagent_type", "")))
+        finally:
+            reset_current_token(reset)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(jobs))), thread_name_prefix="task-batch")
+    futs: Dict[Any, int] = {}
+    try:
+        futs = {pool.submit(contextvars.copy_context().run, _one, i, job): i for i, job in enumerate(jobs)}
+        pending = set(futs)
+        while pending:
+            wait_s = None
+            if limit is not None:
+                now = time.monotonic()
+                deadlines = [started[futs[f]] + limit for f in pending if futs[f] in started]
+                wait_s = max(min(deadlines) - now, 0.01) if deadlines else limit
+            done, pending = wait(pending, timeout=wait_s, return_when=FIRST_COMPLETED)
+            for f in done:
+                i = futs[f]
+                try:
+                    results[i] = f.result()
+                except Exception as e:
+                    results[i] = ({}, f"Subagent job #{i} failed: {e}", False)
+            if limit is None:
+                continue
+            now = time.monotonic()
+            for f in list(pending):
+                i = futs[f]
+                if i in started and now - started[i] >= limit:
+                    # 线程无法强杀：取消该任务的令牌，放弃等待并丢弃其结果
+                    tokens[i].cancel("timeout")
+                    pending.discard(f)
+                    name = jobs[i].get("subagent_type") if isinstance(jobs[i], dict) else "?"
+                    results[i] = ({}, f"Subagent `{name}` timed out after {limit:.0f}s", False)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        for f, i in futs.items():
+            if not f.done():
+                tokens[i].cancel("abandoned")  # 异常退出时仍在跑的任务
+        for tok in tokens:
+            tok.close()
+    return results  # type: ignore[return-value]
+
+def _create_task_batch_tool(task_tool, *, max_concurrency: Optional[int] = None,
+                            timeout_s: Optional[float] = None):
+    """
+    生成 `task_batch` 工具：一次提交多个 {description, subagent_type}，并发执行（上限 max_concurrency，
+    单任务超时 timeout_s），各任务的 state 增量按提交顺序合并（与完成先后无关），汇报为按序的 JSON 列表。
+    与 task 工具共用同一组（惰性编译的）子代理。
+    """
+    agents: _LazyAgents = task_tool.metadata["subagents"]
+    cap = max_concurrency or TASK_BATCH_CONCURRENCY
+    limit = TASK_BATCH_TIMEOUT_S if timeout_s is None else timeout_s
+    names = ", ".join(f"`{n}`" for n in agents.names())
 
-        update.setdefault("messages", [])
-        update["messages"].append(ToolMessage(last_msg, tool_call_id=tool_call_id))
+    @tool(description=TASK_BATCH_DESCRIPTION_SUFFIX + f"\n\nAvailable subagent_type values: {names}")
+    def task_batch(
+        jobs: List[TaskJob],
+        state: Annotated[DeepAgentState, InjectedState],
+        tool_call_id: Annotated[str, InjectedToolCallId],
+    ) -> Command:
+        if not jobs:
+            return Command(update={"messages": [ToolMessage("Error: `jobs` is empty.", tool_call_id=tool_call_id)]})
+        results = _run_jobs(agents, state, list(jobs), cap, limit)
+        update = merge_deltas(agents.state_schema, [delta for delta, _report, ok in results if ok])
+        report = [
+            {
+                "index": i,
+                "subagent_type": job.get("subagent_type") if isinstance(job, dict) else None,
+                "ok": ok,
+                "result": text,
+            }
+            for i, (job, (_delta, text, ok)) in enumerate(zip(jobs, results))
+        ]
+        update["messages"] = [ToolMessage(json.dumps(report, ensure_ascii=False), tool_call_id=tool_call_id)]
         return Command(update=update)
 
-    return task
\ No newline at end of file
+    return task_batch
+
+# ========================= 启动开销对比（lazy vs eager） =========================
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _startup_probe(lazy: bool, n_subagents: int) -> Dict[str, Any]:
+    """在当前进程里构建一次 task 工具（n 个子代理），返回耗时与 RSS 增量"""
+    import time
+    from deepagents.model import get_default_model
+
+    model = get_default_model()
+    subagents = [
+        {"name": f"agent-{i}", "description": f"sub-agent #{i}", "prompt": f"You are sub-agent #{i}.", "tools": []}
+        for i in range(n_subagents)
+    ]
+    graph_cache.clear()
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    task = _create_task_tool([], "You are a general-purpose agent.", subagents, model, None,
+                             lazy=lazy, prewarm=[])
+    elapsed = time.perf_counter() - t0
+    return {
+        "lazy": lazy,
+        "startup_ms": round(elapsed * 1000, 2),
+        "rss_delta_mb": round(_rss_mb() - rss0, 2),
+        "compiled": len(task.metadata["subagents"].compiled()),
+    }
+
+def benchmark(n_subagents: int = 30) -> Dict[str, Any]:
+    """各在独立子进程里测一次（RSS 互不影响）：eager 编译全部子代理 vs lazy 只登记"""
+    import subprocess
+    import sys
+
+    out: Dict[str, Any] = {"n_subagents": n_subagents}
+    for lazy in (False, True):
+        code = (
+            "import json; from deepagents.sub_agent import _startup_probe; "
+            f"print(json.dumps(_startup_probe({lazy}, {n_subagents})))"
+        )
+        res = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        out["lazy" if lazy else "eager"] = json.loads(res.stdout.strip().splitlines()[-1])
+    return out
+
+if __name__ == "__main__":
+    print(json.dumps(benchmark(), ensure_ascii=False, indent=2))
@@ -0,0 +1,98 @@
+# src/deepagents/tool_dispatch.py
+"""
+工具直连派发（跳过 main agent → task → doc-writer 子代理 两次 LLM 决策）
+- Executor 的步骤带 tool_hint 时，输入（text / model / 修正点）已完全确定，
+  让 agent 再花两轮 LLM 去“决定调用哪个工具”是纯开销；这里按动作名直接调用工具背后的 LLM 函数
+- 注册表：动作名（tool_hint）→ "模块:函数"，函数签名统一为 fn(text, model) -> str | dict
+  按需导入（pdf 解析等依赖较重的模块只有用到时才加载）
+- call_direct_tool()：函数接受 fix_guidance 关键字（rewrite / expand / contract，会对长文本分块）时修正点单独传入，
+  随每一块的提示下发；其余函数仍把修正点拼在输入文本后（with_fix_guidance）
+- register_direct_tool(name, fn) 可覆盖/新增；未登记的动作返回 None，调用方回退到 agent 路径
+
+配置（env）：
+- DIRECT_TOOL_DISPATCH=1     置 0 关闭，所有步骤都走 agent
+"""
+from __future__ import annotations
+import importlib
+import inspect
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Union
+
+DIRECT_TOOL_DISPATCH = os.getenv("DIRECT_TOOL_DISPATCH", "1") != "0"
+
+DirectToolFn = Callable[[str, str], Any]
+
+# 动作名 → 工具模块里的 LLM 调用函数（与 @tool 包装内部调用的是同一个函数）
+_DEFAULT_TOOLS: Dict[str, str] = {
+    "rewrite_text": "deepagents.tools.rewrite_tool:_llm_rewrite_text",
+    "expand_text": "deepagents.tools.expand_tool:_llm_expand_text",
+    "contract_text": "deepagents.tools.compress_tool:_llm_contract_text",
+    "parse_resume_text": "deepagents.tools.text_parse_tool:_llm_parse_resume_from_text",
+    "evaluate_resume": "deepagents.tools.evaluate_resume_tool:_llm_evaluate_resume",
+    "generate_statement": "deepagents.tools.generate_statement_tool:_llm_generate_statement",
+    "generate_recommendation": "deepagents.tools.generate_recommend_tool:_llm_generate_recommendation",
+    "name_document": "deepagents.tools.document_name_tool:_llm_name_document",
+}
+
+_registry: Dict[str, Union[str, DirectToolFn]] = dict(_DEFAULT_TOOLS)
+_lock = threading.Lock()
+
+def register_direct_tool(name: str, fn: Union[str, DirectToolFn]) -> None:
+    """登记（或覆盖）一个直连工具；fn 可为可调用对象或 "模块:函数" 字符串"""
+    with _lock:
+        _registry[name] = fn
+
+def unregister_direct_tool(name: str) -> None:
+    with _lock:
+        _registry.pop(name, None)
+
+def _resolve(ref: str) -> DirectToolFn:
+    mod, _, attr = ref.partition(":")
+    return getattr(importlib.import_module(mod), attr)
+
+def get_direct_tool(name: Optional[str]) -> Optional[DirectToolFn]:
+    """按动作名取直连函数；关闭 / 未登记 / 导入失败时返回 None（调用方回退 agent）"""
+    if not DIRECT_TOOL_DISPATCH or not name:
+        return None
+    with _lock:
+        ref = _registry.get(name)
+    if ref is None or callable(ref):
+        return ref
+    try:
+        fn = _resolve(ref)
+    except (ImportError, AttributeError):
+        return None
+    with _lock:
+        if _registry.get(name) == ref:
+            _registry[name] = fn
+    return fn
+
+def direct_tools() -> Dict[str, str]:
+    """当前注册表（名称 → 来源），供 /health 等展示"""
+    with _lock:
+        return {
+            name: ref if isinstance(ref, str) else f"{getattr(ref, '__module__', '?')}:{getattr(ref, '__name__', '?')}"
+            for name, ref in _registry.items()
+        }
+
+def _accepts_fix_guidance(fn: DirectToolFn) -> bool:
+    try:
+        params = inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+    return "fix_guidance" in params or any(p.kind is p.VAR_KEYWORD for p in params.values())
+
+def call_direct_tool(fn: DirectToolFn, text: str, model: str, fix: str = "") -> Any:
+    """调用直连函数并带上修正点（见模块说明）"""
+    fix = (fix or "").strip()
+    if fix and _accepts_fix_guidance(fn):
+        return fn(text, model, fix_guidance=fix)
+    return fn(with_fix_guidance(text, fix), model)
+
+def with_fix_guidance(text: str, fix: str) -> str:
+    """把 Validator 的修正点并入工具输入（agent 路径里它在 system 提示中，这里工具只收一段文本）"""
+    fix = (fix or "").strip()
+    if not fix:
+        return text
+    return f"{text}\n\n【必须修正点】{fix}\n（请按上述修正点调整结果，只输出最终结果，不要解释。）"
@@ -10,26 +10,28 @@ from langgraph.prebuilt import InjectedState
 # 你已有的 SiliconFlow 客户端（同步）
 # 需提供: _call_siliconflow_with_meta(prompt, text, model, return_meta: bool)
 from deepagents.siliconflow_client import sf_client
+from deepagents.chunking import content_to_text, map_reduce_text
 
 
-def _llm_contract_text(text: str, model: str) -> str:
+def _llm_contract_text(text: str, model: str, fix_guidance: str = "") -> str:
     """
     调用 LLM（SiliconFlow）对文本进行精简/压缩。
-    返回字符串；若得到其他类型，尽量转成字符串。
+    长文本按段落 / 句子分块并发处理后拼接（见 deepagents.chunking）；短文本单次调用。
+    fix_guidance（Validator 修正点）随每一块的提示下发。
     """
-    content, _meta = sf_client._call_siliconflow_with_meta(
-        sf_client._CONTRACT_TEXT_PROMPT,
+    return map_reduce_text(
         text,
-        model,
-        False,  # 与原路由一致：不需要额外 meta
+        sf_client._CONTRACT_TEXT_PROMPT,
+        lambda prompt, user_text: _call_llm(prompt, user_text, model),
+        op="contract",
+        fix_guidance=fix_guidance,
     )
-    if isinstance(content, str):
-        return content
-    try:
-        import json
-        return json.dumps(content, ensure_ascii=False)
-    except Exception:
-        return str(content)
+
+
+def _call_llm(prompt: str, text: str, model: str) -> str:
+    """单次调用；返回字符串（content 为 dict 等时转成字符串）"""
+    content, _meta = sf_client._call_siliconflow_with_meta(prompt, text, model, False)
+    return content_to_text(content)
 
 
 TOOL_DESC = """精简一段文本（压缩表达、保留要点）。
@@ -1,27 +1,28 @@
 # app/tools/parse_resume_tool.py
 from __future__ import annotations
-import base64
 import json
 from typing import Annotated, Dict, Any
-import fitz  # PyMuPDF
 from langchain_core.tools import tool, InjectedToolCallId
 from langgraph.types import Command
 from langchain_core.messages import ToolMessage
 from langgraph.prebuilt import InjectedState
 from deepagents.siliconflow_client import sf_client
-def _parse_pdf_bytes(pdf_bytes: bytes) -> str:
-    """把 PDF 字节提取为纯文本（简单拼接每页文本）"""
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    extracted = []
-    for page in doc:
-        extracted.append(page.get_text())
-    text = "".join(extracted)
-    if not text.strip():
-        raise ValueError("无法从PDF中提取任何文本。")
-    return text
+from deepagents.pdf_extract import decode_pdf_b64, extract_pdf_text, PdfSource
+from deepagents.parse_cache import cached_pdf_text, cached_resume_parse
+def _parse_pdf_bytes(pdf_bytes: PdfSource) -> str:
+    """
+    把 PDF（字节 / 路径 / mmap）提取为纯文本；页数多时分块并行，超出页数 / 大小上限抛 PdfLimitError（见 deepagents.pdf_extract）
+    同一份 PDF（字节哈希相同）直接取缓存的文本（见 deepagents.parse_cache）
+    """
+    return cached_pdf_text(pdf_bytes, extract_pdf_text)
 
 
 def _llm_parse_resume(text: str, model: str) -> Dict[str, Any]:
+    """解析简历文本；同一内容（规范化后）+ 模型的结果走本地缓存"""
+    return cached_resume_parse(text, model, _call_parse_resume, prompt=sf_client._PARSE_RESUME_PROMPT)
+
+
+def _call_parse_resume(text: str, model: str) -> Dict[str, Any]:
     """
     调用 LLM（SiliconFlow）解析简历文本，返回 JSON 结果（dict）。
     这里假设 sf_client 返回 (content, meta)，content 为 dict 或 str。
@@ -62,7 +63,7 @@ def parse_resume_tool(
     不做用户校验、数据库写入。
     """
     try:
-        pdf_bytes = base64.b64decode(pdf_b64)
+        pdf_bytes = decode_pdf_b64(pdf_b64)
         text = _parse_pdf_bytes(pdf_bytes)
         result = _llm_parse_resume(text, model)
 
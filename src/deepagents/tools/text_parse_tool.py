@@ -11,9 +11,17 @@ from langgraph.prebuilt import InjectedState
 # 你已有的 SiliconFlow 客户端（同步调用）
 # 需要提供 _call_siliconflow_with_meta(prompt, text, model, return_meta=True)
 from deepagents.siliconflow_client import sf_client
+from deepagents.parse_cache import cached_resume_parse
 
 
 def _llm_parse_resume_from_text(text: str, model: str) -> Dict[str, Any]:
+    """
+    解析简历文本；同一内容（规范化后）+ 模型的结果走本地缓存（见 deepagents.parse_cache）。
+    """
+    return cached_resume_parse(text, model, _call_parse_resume, prompt=sf_client._PARSE_RESUME_PROMPT)
+
+
+def _call_parse_resume(text: str, model: str) -> Dict[str, Any]:
     """
     调用 LLM（SiliconFlow）解析简历文本，统一返回 dict。
     """
@@ -1,16 +1,47 @@
 from __future__ import annotations
-import json, re, time, uuid, os
-from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional, Tuple, Callable
+import asyncio, contextvars, inspect, json, logging, re, time, uuid, os, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Awaitable, Dict, List, Optional, Tuple, Callable, Union
 
+from deepagents.cancellation import (
+    Cancelled,
+    CancelToken,
+    current_token,
+    register,
+    reset_current_token,
+    set_current_token,
+    unregister,
+)
+from deepagents import metrics
+from deepagents.checkpointer import scoped_thread
+from deepagents.intent import classify
+from deepagents.message_window import estimate_tokens, fit_messages
+from deepagents.offload import run_blocking
+from deepagents.tool_dispatch import call_direct_tool, get_direct_tool, with_fix_guidance
+from deepagents.structured_output import (
+    PlanSpec,
+    ReviewSpec,
+    StepSpec,
+    VerdictSpec,
+    ainvoke_structured,
+    is_response_format_error,
+    mark_response_format_unsupported,
+)
 from deepagents.run_state import (
-    create_run_state,
-    append_step,
-    set_todo_status,
-    set_validation,
+    acreate_run_state,
+    aappend_step,
+    aclaim_run,
+    asave_checkpoint,
+    aset_todo_status,
+    aset_validation,
+    aset_run_status,
+    load_state,
     validate_output,
 )
 
+log = logging.getLogger(__name__)
+
 # ============ 裸 LLM（供 Planner / Validator 使用，避免被 main agent 提示干扰） ============
 from deepagents.model import get_default_model
 _raw_llm = get_default_model()
@@ -20,6 +51,67 @@ def llm_invoke_json(messages: List[Dict[str, str]]) -> Dict[str, Any]:
     content = getattr(res, "content", None) or str(res)
     return {"rewritten_text": content}
 
+# 同步 API（run_textual_flow 等）会在临时事件循环里跑 async 核心；
+# LangChain 的 async HTTP 客户端跨事件循环复用会出错，所以此模式下走同步 invoke。
+_SYNC_MODE: contextvars.ContextVar[bool] = contextvars.ContextVar("tri_role_sync_mode", default=False)
+
+async def allm_invoke_json(
+    messages: List[Dict[str, str]],
+    budget: Optional["RunBudget"] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    budget 非空时：调用受剩余时间约束，并按返回 usage（或估算）扣减 token。
+    response_format 非空时请求 JSON 模式；后端不支持则记下并退回普通调用。
+    """
+    async def _invoke(rf):
+        llm = _raw_llm.bind(response_format=rf) if rf else _raw_llm
+        if _SYNC_MODE.get():
+            return await run_blocking(llm.invoke, messages)
+        return await llm.ainvoke(messages)
+
+    async def _invoke_with_fallback():
+        if not response_format:
+            return await _invoke(None)
+        try:
+            return await _invoke(response_format)
+        except Exception as e:
+            if not is_response_format_error(e):
+                raise
+            mark_response_format_unsupported()
+            return await _invoke(None)
+
+    aw = _invoke_with_fallback()
+    tok = current_token()
+    if tok is not None:
+        aw = tok.run(aw)
+    res = await (budget.run(aw) if budget else aw)
+    content = getattr(res, "content", None) or str(res)
+    if budget:
+        budget.charge(_usage_tokens(res) or _estimate_tokens(messages, content))
+    return {"rewritten_text": content}
+
+async def _call(fn: Callable[..., Any], *args: Any) -> Any:
+    """统一调用同步/异步回调：协程直接 await；同步函数放到专用阻塞线程池执行（不阻塞事件循环）"""
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args)
+    res = await run_blocking(fn, *args)
+    if inspect.isawaitable(res):
+        res = await res
+    return res
+
+def _run_sync(coro: Awaitable[Any]) -> Any:
+    """以同步方式跑完协程；若当前线程已有运行中的事件循环，则换一个线程跑"""
+    async def _main():
+        _SYNC_MODE.set(True)
+        return await coro
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_main())
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(contextvars.copy_context().run, asyncio.run, _main()).result()
+
 # ========================= 数据结构 =========================
 @dataclass
 class TodoStep:
@@ -32,6 +124,9 @@ class TodoStep:
     max_attempts: int = 2
     outputs: Dict[str, Any] = field(default_factory=dict)
     tool_hint: Optional[str] = None  # 如：rewrite_text / expand_text / ...
+    input_sig: Optional[str] = None  # 执行时的输入指纹（重规划复用判定）
+    reused_from: Optional[str] = None  # 若复用了旧清单中某步的产物，记录其 id
+    input_from: Optional[int] = None   # 链式：以第几步（1-based）的产出作为本步输入；None→用户原始输入
 
 @dataclass
 class PlanResult:
@@ -39,56 +134,230 @@ class PlanResult:
     rationale: str
     steps: List[TodoStep]
 
+class BudgetExceeded(RuntimeError):
+    """单次请求的时间/ token 预算已用尽"""
+
+@dataclass
+class RunBudget:
+    """
+    单次请求的预算：墙钟时限（deadline_s，秒）+ token 上限（max_tokens）。
+    - exhausted():        任一维度用尽 → 不再发起新的 LLM 调用
+    - nearly_exhausted(): 剩余不足 reserve_ratio → 跳过重试与总体复评
+    通过 ctx["budget"] 传入 Planner / Executor / Validator / 总体复评。
+    """
+    deadline_s: Optional[float] = None
+    max_tokens: Optional[int] = None
+    reserve_ratio: float = 0.15
+    started_at: float = field(default_factory=time.monotonic)
+    used_tokens: int = 0
+    llm_calls: int = 0
+    skipped: List[str] = field(default_factory=list)
+
+    def remaining_seconds(self) -> Optional[float]:
+        if self.deadline_s is None:
+            return None
+        return self.deadline_s - (time.monotonic() - self.started_at)
+
+    def remaining_tokens(self) -> Optional[int]:
+        if self.max_tokens is None:
+            return None
+        return self.max_tokens - self.used_tokens
+
+    def exhausted(self) -> bool:
+        rs, rt = self.remaining_seconds(), self.remaining_tokens()
+        return (rs is not None and rs <= 0) or (rt is not None and rt <= 0)
+
+    def nearly_exhausted(self) -> bool:
+        rs, rt = self.remaining_seconds(), self.remaining_tokens()
+        if rs is not None and rs <= self.deadline_s * self.reserve_ratio:
+            return True
+        if rt is not None and rt <= self.max_tokens * self.reserve_ratio:
+            return True
+        return False
+
+    def charge(self, tokens: int) -> None:
+        self.llm_calls += 1
+        self.used_tokens += max(0, int(tokens or 0))
+
+    def skip(self, what: str) -> None:
+        self.skipped.append(what)
+
+    async def run(self, aw: Awaitable[Any]) -> Any:
+        """在剩余时限内等待 aw；超时或已耗尽则抛 BudgetExceeded"""
+        if self.exhausted():
+            if inspect.iscoroutine(aw):
+                aw.close()
+            raise BudgetExceeded("budget exhausted")
+        rs = self.remaining_seconds()
+        if rs is None:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, rs)
+        except asyncio.TimeoutError:
+            raise BudgetExceeded(f"deadline {self.deadline_s}s reached")
+
+    def snapshot(self) -> Dict[str, Any]:
+        rs = self.remaining_seconds()
+        return {
+            "deadline_s": self.deadline_s,
+            "elapsed_s": round(time.monotonic() - self.started_at, 3),
+            "remaining_s": None if rs is None else round(rs, 3),
+            "max_tokens": self.max_tokens,
+            "used_tokens": self.used_tokens,
+            "llm_calls": self.llm_calls,
+            "exhausted": self.exhausted(),
+            "skipped": list(self.skipped),
+        }
+
+def _estimate_tokens(*parts: Any) -> int:
+    """粗略估算 token：CJK 字符按 1 个计，其余按 4 字符 1 个计（见 deepagents.message_window）"""
+    return sum(estimate_tokens(p) for p in parts)
+
+def _windowed(ctx: Dict[str, Any], msgs: List[Dict[str, str]], where: str) -> List[Dict[str, str]]:
+    """按模型上下文裁剪消息（固定 system 与最新 user，裁中间）；节省的 token 累计到 ctx"""
+    res = fit_messages(msgs, _raw_llm, where=where)
+    if res.tokens_saved:
+        ctx["window_tokens_saved"] = ctx.get("window_tokens_saved", 0) + res.tokens_saved
+    return res.messages
+
+def _usage_tokens(res: Any) -> int:
+    """从 LangChain 消息（或 agent 返回的 state）中取真实用量；取不到返回 0"""
+    if isinstance(res, dict):
+        return sum(_usage_tokens(m) for m in (res.get("messages") or []))
+    usage = getattr(res, "usage_metadata", None) or {}
+    if usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    meta = (getattr(res, "response_metadata", None) or {}).get("token_usage") or {}
+    return int(meta.get("total_tokens") or 0)
+
+def _step_source_text(ctx: Dict[str, Any], step: TodoStep) -> str:
+    """链式步骤取上游步骤的产出；上游缺失/未完成时退回用户原始输入"""
+    if step.input_from:
+        steps: List[TodoStep] = ctx.get("steps") or []
+        if step.input_from <= len(steps):
+            src = steps[step.input_from - 1]
+            text = src.outputs.get("final") or src.outputs.get("text")
+            if src.status == "completed" and isinstance(text, str) and text.strip():
+                return text
+    return ctx.get("user_input", "")
+
+async def _budgeted(ctx: Dict[str, Any], aw: Awaitable[Any]) -> Any:
+    """外部调用统一入口：受预算时限约束，且可被当前取消令牌中止"""
+    tok = current_token()
+    if tok is not None:
+        aw = tok.run(aw)
+    budget: Optional[RunBudget] = ctx.get("budget")
+    return await (budget.run(aw) if budget else aw)
+
+def _charge(ctx: Dict[str, Any], res: Any, msgs: Any, out: Any) -> None:
+    budget: Optional[RunBudget] = ctx.get("budget")
+    if budget:
+        budget.charge(_usage_tokens(res) or _estimate_tokens(msgs, out))
+
 # 类型别名
 PlannerFn   = Callable[[Dict[str, Any]], PlanResult]
 ExecutorFn  = Callable[[Dict[str, Any], TodoStep], Dict[str, Any]]
 ValidatorFn = Callable[[Dict[str, Any], TodoStep, List[TodoStep]], Tuple[bool, str]]
 
-# ========================= 小工具 =========================
-def _json_extract(text: str) -> str:
-    if not isinstance(text, str):
-        return ""
-    stack, start = [], -1
-    for i, ch in enumerate(text):
-        if ch in "{[":
-            if not stack: start = i
-            stack.append(ch)
-        elif ch in "}]":
-            if not stack: continue
-            left = stack.pop()
-            if (left == "{" and ch != "}") or (left == "[" and ch != "]"):
-                continue
-            if not stack and start != -1:
-                return text[start:i+1]
-    m = re.search(r'(\{.*\}|\[.*\])', text, flags=re.S)
-    return m.group(1) if m else ""
+# async 版本（arun_textual_flow 使用）
+AsyncPlannerFn   = Callable[[Dict[str, Any]], Awaitable[PlanResult]]
+AsyncExecutorFn  = Callable[[Dict[str, Any], TodoStep], Awaitable[Dict[str, Any]]]
+AsyncValidatorFn = Callable[[Dict[str, Any], TodoStep, List[TodoStep]], Awaitable[Tuple[bool, str]]]
+
+# ========================= 过载降级 =========================
+# 等级由调用方给出（常量，或每次调用返回当前等级的函数，如 AdmissionController.level）
+DEGRADE_NONE, DEGRADE_NO_REVIEW, DEGRADE_RULE_VALIDATION, DEGRADE_NO_RETRY = 0, 1, 2, 3
+DegradeSpec = Union[int, Callable[[], int], None]
 
-def _jloads(s: str, default):
+def _degrade_level(ctx: Dict[str, Any]) -> int:
+    d = ctx.get("degrade")
     try:
-        return json.loads(s)
+        return int(d() if callable(d) else (d or 0))
     except Exception:
-        return default
+        return DEGRADE_NONE
+
+def _note_degraded(ctx: Dict[str, Any], what: str) -> None:
+    ctx.setdefault("degraded", set()).add(what)
+    metrics.incr("degraded_skips", what=what)
 
+# ========================= 小工具 =========================
 def _now():
     return time.strftime("%H:%M:%S")
 
-def _log(trace_id: str, msg: str):
-    append_step(trace_id, "log", "info", {"t": _now(), "msg": msg})
+async def _log(trace_id: str, msg: str):
+    await aappend_step(trace_id, "log", "info", {"t": _now(), "msg": msg})
 
 def _steps_outline(steps: List[TodoStep]) -> List[Dict[str, Any]]:
-    return [{"idx": i+1, "title": s.title, "need_validation": s.need_validation, "tool_hint": s.tool_hint} for i, s in enumerate(steps)]
-
-# ========================= 路由表（标题/关键词 → 工具名） =========================
-ROUTES = [
-    (["解析简历","parse","简历"],       "parse_resume_text"),
-    (["重写","rewrite","改写"],         "rewrite_text"),
-    (["扩写","expand","丰富"],          "expand_text"),
-    (["精简","压缩","contract"],        "contract_text"),
-    (["评估","打分","evaluate"],        "evaluate_resume"),
-    (["个人陈述","statement","SOP"],    "generate_statement"),
-    (["推荐信","recommendation"],       "generate_recommendation"),
-    (["命名","标题","name"],            "name_document"),
-]
+    return [{"idx": i+1, "title": s.title, "need_validation": s.need_validation, "tool_hint": s.tool_hint, "input_from": s.input_from} for i, s in enumerate(steps)]
+
+def _todo_from_spec(spec: StepSpec, idx: int) -> TodoStep:
+    """schema 校验后的步骤 → TodoStep；input_from 只接受指向更早步骤的 1-based 序号"""
+    src = spec.input_from
+    return TodoStep(
+        id=str(uuid.uuid4()),
+        title=spec.title or "执行主要动作",
+        accept_criteria=list(spec.accept_criteria),
+        need_validation=spec.need_validation,
+        tool_hint=spec.tool_hint or _guess_tool_by_title(spec.title or ""),
+        input_from=src if (src is not None and 1 <= src < idx) else None,
+    )
+
+async def _astructured(ctx: Dict[str, Any], messages: List[Dict[str, str]], schema, kind: str):
+    """结构化调用：JSON 模式 + 容错解析 + schema 校验 + 定向修复；彻底失败返回 None"""
+    async def _invoke(msgs, rf):
+        res = await allm_invoke_json(_windowed(ctx, msgs, kind), budget=ctx.get("budget"), response_format=rf)
+        return res.get("rewritten_text") or ""
+    return await ainvoke_structured(_invoke, messages, schema, kind=kind)
+
+# ========================= 增量重规划：新旧清单比对 =========================
+def _norm_title(title: str) -> str:
+    """标题归一化：去空白/标点、转小写，用于新旧清单比对"""
+    return re.sub(r"[\s\W_]+", "", (title or "").lower())
+
+def _step_key(step: TodoStep) -> Tuple[str, str]:
+    return (_norm_title(step.title), step.tool_hint or "")
+
+def _step_input_sig(ctx: Dict[str, Any], step: TodoStep) -> str:
+    """步骤输入指纹：用户输入 + 工具提示 + 验收标准 + 链式来源；任一变化即视为需重跑"""
+    raw = json.dumps(
+        [ctx.get("user_input", ""), step.tool_hint or "", list(step.accept_criteria or []), step.need_validation, step.input_from],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def reuse_completed_steps(
+    ctx: Dict[str, Any],
+    old_steps: List[TodoStep],
+    new_steps: List[TodoStep],
+) -> Tuple[List[str], List[str]]:
+    """
+    把修订清单与已执行清单按（归一化标题, tool_hint）比对：
+    - 旧步已完成且输入指纹未变 → 新步直接复用其产物（status=completed, reused_from=旧 id）
+    - 链式步骤（input_from）仅当其上游也被复用时才复用，否则上游产出可能变化
+    - 其余 → 保持 pending，等待执行
+    返回：(reused_titles, rerun_titles)
+    """
+    done_by_key: Dict[Tuple[str, str], TodoStep] = {}
+    for st in old_steps:
+        if st.status == "completed" and st.input_sig:
+            done_by_key.setdefault(_step_key(st), st)
+
+    reused, rerun = [], []
+    for ns in new_steps:
+        upstream_ok = (ns.input_from is None) or bool(new_steps[ns.input_from - 1].reused_from)
+        old = done_by_key.pop(_step_key(ns), None)
+        if upstream_ok and old is not None and old.input_sig == _step_input_sig(ctx, ns):
+            ns.outputs = dict(old.outputs)
+            ns.status = "completed"
+            ns.attempts = old.attempts
+            ns.input_sig = old.input_sig
+            ns.reused_from = old.reused_from or old.id
+            reused.append(ns.title)
+        else:
+            rerun.append(ns.title)
+    return reused, rerun
+
+# ========================= 路由（标题/关键词 → 工具名，见 deepagents.intent） =========================
 FINAL_TOOL_BY_ACTION = {
     "expand": "expand_text",
     "contract": "contract_text",
@@ -100,20 +369,14 @@ FINAL_TOOL_BY_ACTION = {
 }
 FINAL_TOOLS = set(FINAL_TOOL_BY_ACTION.values())
 
-ANALYSIS_KEYWORDS = ["分析","确定","设计","制定","规划","标准","流程","框架","方案","criterion","criteria","plan","design","spec","质量监控","验证标准"]
 def is_analysis_step(title: str) -> bool:
-    t = title.lower()
-    return any(k.lower() in t for k in ANALYSIS_KEYWORDS)
+    return classify(title).is_analysis
 
 def _guess_tool_by_title(title: str) -> Optional[str]:
-    t = title.lower()
-    for kws, tool in ROUTES:
-        if any(k.lower() in t for k in kws):
-            return tool
-    return None
+    return classify(title).tool_hint
 
 # ========================= Planner：产出子任务 + 可行性评估（≤N次） =========================
-def make_llm_planner(max_loops: int = 3) -> PlannerFn:
+def make_async_llm_planner(max_loops: int = 3) -> AsyncPlannerFn:
     def _history_brief(msgs: List[Dict[str,str]], n: int = 6, max_chars: int = 800) -> str:
         parts = []
         for h in msgs[-n:]:
@@ -122,7 +385,7 @@ def make_llm_planner(max_loops: int = 3) -> PlannerFn:
             parts.append(f"{role}: {content}")
         return "\n".join(parts)[:max_chars]
 
-    def _ask_for_plan(ctx: Dict[str, Any], feedback: str = "") -> PlanResult:
+    async def _ask_for_plan(ctx: Dict[str, Any], feedback: str = "") -> PlanResult:
         user_input = ctx.get("user_input","")
         action     = ctx.get("action","rewrite_letter")
         msgs       = ctx.get("messages", [])
@@ -131,7 +394,9 @@ def make_llm_planner(max_loops: int = 3) -> PlannerFn:
         sys = (
             "你是一名 Planner。请先分解用户任务为 2~8 个可执行子任务（steps），"
             "再做一次可行性评估（feasible=true/false，若 false 在 rationale 中说明阻碍与需要的信息）。"
-            "每个子任务包含：title、accept_criteria[]、need_validation、tool_hint（可选）。"
+            "每个子任务包含：title、accept_criteria[]、need_validation、tool_hint（可选）、"
+            "input_from（可选：若本步应加工前面某步的产出而非用户原文，填该步序号 idx，从 1 开始）。"
+            "不要对同一输入重复安排相同工具的步骤。"
             "严格只输出 JSON。"
         )
         usr = f"""
@@ -149,33 +414,20 @@ def make_llm_planner(max_loops: int = 3) -> PlannerFn:
       "title": "动词开头",
       "accept_criteria": ["可测标准1","标准2"],
       "need_validation": true,
-      "tool_hint": "rewrite_text / expand_text / parse_resume_text / ..."
+      "tool_hint": "rewrite_text / expand_text / parse_resume_text / ...",
+      "input_from": null
     }}
   ]
 }}
 """
-        res = llm_invoke_json([
+        plan = await _astructured(ctx, [
             {"role":"system","content":sys},
             {"role":"user","content":usr}
-        ])
-        text = res.get("rewritten_text") or str(res)
-        data = _jloads(_json_extract(text), {})
-        feasible = bool(data.get("feasible", False))
-        steps_raw = data.get("steps", [])
-        steps: List[TodoStep] = []
-        for s in steps_raw:
-            title = s.get("title") or "执行主要动作"
-            ac    = s.get("accept_criteria") or []
-            if isinstance(ac, str): ac = [ac]
-            nv    = bool(s.get("need_validation", True))
-            hint  = s.get("tool_hint") or _guess_tool_by_title(title)
-            steps.append(TodoStep(
-                id=str(uuid.uuid4()),
-                title=title,
-                accept_criteria=ac,
-                need_validation=nv,
-                tool_hint=hint,
-            ))
+        ], PlanSpec, "plan")
+        if plan is None:
+            return PlanResult(can_plan=False, rationale="规划输出无法解析为合法 JSON", steps=[])
+        feasible = plan.feasible
+        steps: List[TodoStep] = [_todo_from_spec(sp, i) for i, sp in enumerate(plan.steps, 1)]
 
         # 分析类步骤默认不校验，避免被卡在“元任务”
         for st in steps:
@@ -193,13 +445,22 @@ def make_llm_planner(max_loops: int = 3) -> PlannerFn:
                 tool_hint=tool,
             ))
 
-        rationale = data.get("rationale") or ""
+        rationale = plan.rationale
         return PlanResult(can_plan=feasible and (2 <= len(steps) <= 8), rationale=rationale, steps=steps)
 
-    def _planner(ctx: Dict[str, Any]) -> PlanResult:
+    async def _planner(ctx: Dict[str, Any]) -> PlanResult:
         fb = ctx.get("last_failed_feedback","")
-        for _ in range(max_loops):
-            pr = _ask_for_plan(ctx, feedback=fb)
+        budget: Optional[RunBudget] = ctx.get("budget")
+        for i in range(max_loops):
+            # 预算将尽：不再追加规划轮次，直接走 fallback
+            if budget and i > 0 and budget.nearly_exhausted():
+                budget.skip("planner_loop")
+                break
+            try:
+                pr = await _ask_for_plan(ctx, feedback=fb)
+            except BudgetExceeded as e:
+                fb = fb or str(e)
+                break
             if pr.can_plan:
                 return pr
             fb = (pr.rationale or "信息不足").strip()
@@ -220,18 +481,36 @@ def make_llm_planner(max_loops: int = 3) -> PlannerFn:
         return PlanResult(can_plan=False, rationale=fb or "多次尝试仍无法规划", steps=[])
     return _planner
 
+def make_llm_planner(max_loops: int = 3) -> PlannerFn:
+    aplanner = make_async_llm_planner(max_loops=max_loops)
+    return lambda ctx: _run_sync(aplanner(ctx))
+
 # ========================= Executor（按清单逐一执行） =========================
-def make_executor(
+def _memo_hold(ctx: Dict[str, Any], step: TodoStep, memo_key: str, out: Dict[str, Any]) -> None:
+    """执行产物先挂起，校验有结论后由 _memo_settle 决定是否写入本次运行的 memo"""
+    ctx.setdefault("exec_pending", {})[step.id] = (memo_key, out)
+
+def _memo_settle(ctx: Dict[str, Any], step: TodoStep, passed: bool) -> None:
+    """通过校验（或无需校验）才入 memo；被驳回的产物丢弃，不供后续步骤 / 重试复用"""
+    held = ctx.get("exec_pending", {}).pop(step.id, None)
+    if held and passed:
+        ctx.setdefault("exec_cache", {})[held[0]] = held[1]
+
+def make_async_executor(
     *,
-    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Dict[str, Any]],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Any],
     pick_output: Callable[[Any], str],
-) -> ExecutorFn:
-    def _exec(ctx: Dict[str, Any], step: TodoStep) -> Dict[str, Any]:
+) -> AsyncExecutorFn:
+    """
+    agent_invoke_with_retry 可为同步函数或协程函数（如基于 agent.ainvoke）
+    带 tool_hint 且在 deepagents.tool_dispatch 中登记过的步骤直接调用工具；其余交给 agent
+    """
+    async def _exec(ctx: Dict[str, Any], step: TodoStep) -> Dict[str, Any]:
         # 元步骤：直接返回分析信息
-        if any(k in step.title for k in ["解析任务", "分析需求", "检查格式"]):
+        if classify(step.title).is_meta_step:
             return {"analysis": {"step": step.title, "preview": (ctx.get("user_input","")[:200])}}
 
-        user_text = ctx.get("user_input", "")
+        user_text = _step_source_text(ctx, step)
         fix = (ctx.get("last_failed_feedback") or "").strip()
 
         if step.tool_hint:
@@ -242,6 +521,26 @@ def make_executor(
             }
             if fix:
                 payload["inputs"]["fix_guidance"] = fix
+
+            # 同一次运行内：相同（工具, 输入, 修正点）直接复用已通过校验的产物，不再重复调用
+            # 重试（attempts > 1）不查 memo：规则校验 / 降级时修正点可能与上次相同，命中只会原样返回被驳回的结果
+            cache: Dict[str, Dict[str, Any]] = ctx.setdefault("exec_cache", {})
+            memo_key = hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+            if step.attempts <= 1 and memo_key in cache:
+                return {**cache[memo_key], "memo_hit": True}
+
+            # 已登记的工具：进程内直接调用，省掉 main agent 选 task、子代理选工具的两轮 LLM
+            direct = get_direct_tool(step.tool_hint)
+            if direct is not None:
+                txt = await _budgeted(ctx, run_blocking(call_direct_tool, direct, user_text, payload["model"], fix))
+                if isinstance(txt, (dict, list)):
+                    txt = json.dumps(txt, ensure_ascii=False, indent=2)
+                _charge(ctx, None, with_fix_guidance(user_text, fix), txt)
+                metrics.incr("executor_direct_dispatch", tool=step.tool_hint)
+                out = {"text": txt, "used_tool": step.tool_hint, "dispatch": "direct"}
+                _memo_hold(ctx, step, memo_key, out)
+                return dict(out)
+
             sys_prompt = "你是 doc-writer 子代理的调度前端，只输出工具产物。"
             if fix:
                 sys_prompt += f" 必须按以下修正点调整结果：{fix}"
@@ -249,28 +548,41 @@ def make_executor(
                 {"role":"system","content": sys_prompt},
                 {"role":"user","content": json.dumps(payload, ensure_ascii=False)}
             ]
-            res = agent_invoke_with_retry(msgs)
+            res = await _budgeted(ctx, _call(agent_invoke_with_retry, msgs))
             txt = pick_output(res)
             if isinstance(txt, (dict, list)):
                 txt = json.dumps(txt, ensure_ascii=False, indent=2)
-            return {"text": txt, "used_tool": step.tool_hint}
+            _charge(ctx, res, msgs, txt)
+            out = {"text": txt, "used_tool": step.tool_hint}
+            _memo_hold(ctx, step, memo_key, out)
+            return dict(out)
 
         # 无 hint：交给 main agent 自选工具，同时注入修正点
         msgs = list(ctx.get("messages", []))
         if fix:
             msgs.append({"role":"system","content": f"请严格依据以下必须修正点修改输出：{fix}。只输出最终结果，不要解释。"})
-        res  = agent_invoke_with_retry(msgs)
+        msgs = _windowed(ctx, msgs, "executor")
+        res  = await _budgeted(ctx, _call(agent_invoke_with_retry, msgs))
         txt  = pick_output(res)
         if isinstance(txt, (dict, list)):
             txt = json.dumps(txt, ensure_ascii=False, indent=2)
+        _charge(ctx, res, msgs, txt)
         return {"text": txt}
     return _exec
 
+def make_executor(
+    *,
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Dict[str, Any]],
+    pick_output: Callable[[Any], str],
+) -> ExecutorFn:
+    aexec = make_async_executor(agent_invoke_with_retry=agent_invoke_with_retry, pick_output=pick_output)
+    return lambda ctx, step: _run_sync(aexec(ctx, step))
+
 # ========================= Validator（逐步验收；拿到“任务清单+该步结果”） =========================
-def make_llm_validator(
+def make_async_llm_validator(
     *, pass_threshold: float = 0.75
-) -> ValidatorFn:
-    def _validator(ctx: Dict[str, Any], step: TodoStep, all_steps: List[TodoStep]) -> Tuple[bool, str]:
+) -> AsyncValidatorFn:
+    async def _validator(ctx: Dict[str, Any], step: TodoStep, all_steps: List[TodoStep]) -> Tuple[bool, str]:
         if not step.need_validation:
             return True, "无需校验"
 
@@ -280,6 +592,12 @@ def make_llm_validator(
         if not candidate:
             return False, "未产生可评审输出"
 
+        # 过载降级：只做规则校验，不调用 LLM
+        if _degrade_level(ctx) >= DEGRADE_RULE_VALIDATION:
+            _note_degraded(ctx, "llm_validator")
+            ok_rule, issues = validate_output(ctx.get("action", "rewrite_letter"), candidate)
+            return ok_rule, ("降级：仅规则校验" if ok_rule else "规则失败: " + "; ".join(issues or []))
+
         sys = "你是严格的 Validator。仅输出 JSON。"
         usr = f"""
 【当前子任务】{step.title}
@@ -297,18 +615,17 @@ def make_llm_validator(
   "feedback": "一句话结论"
 }}
 """
-        res  = llm_invoke_json([
+        verdict = await _astructured(ctx, [
             {"role":"system","content":sys},
             {"role":"user","content":usr}
-        ])
-        data = _jloads(_json_extract(res.get("rewritten_text") or str(res)), {})
-        llm_pass  = bool(data.get("passed", False))
-        llm_score = float(data.get("score", 0.0))
-        fb        = data.get("feedback") or ""
-        must_fix  = data.get("must_fix") or []
+        ], VerdictSpec, "verdict") or VerdictSpec(passed=False, feedback="校验输出无法解析")
+        llm_pass  = verdict.passed
+        llm_score = verdict.score
+        fb        = verdict.feedback
+        must_fix  = verdict.must_fix
 
         # 规则硬校验（执行类严格）
-        if any(k in step.title for k in ["执行","生成","重写","扩写","精简","推荐","陈述","命名","解析","评估"]) or (step.tool_hint in FINAL_TOOLS):
+        if classify(step.title).is_execution_step or (step.tool_hint in FINAL_TOOLS):
             action = ctx.get("action","rewrite_letter")
             ok_rule, issues = validate_output(action, candidate)
             if not ok_rule:
@@ -321,8 +638,14 @@ def make_llm_validator(
         return passed, fb or ("分数不足" if not passed else "OK")
     return _validator
 
+def make_llm_validator(
+    *, pass_threshold: float = 0.75
+) -> ValidatorFn:
+    avalidator = make_async_llm_validator(pass_threshold=pass_threshold)
+    return lambda ctx, step, all_steps: _run_sync(avalidator(ctx, step, all_steps))
+
 # ========================= Planner 总体复评 & 可能的重规划 =========================
-def planner_overall_review(
+async def aplanner_overall_review(
     ctx: Dict[str, Any],
     steps: List[TodoStep],
     outputs: Dict[str, Any],
@@ -361,26 +684,21 @@ def planner_overall_review(
       "title": "动词开头",
       "accept_criteria": ["可测标准1","标准2"],
       "need_validation": true,
-      "tool_hint": "可选"
+      "tool_hint": "可选",
+      "input_from": "可选：以第几步的产出作为输入"
     }}
   ]
 }}
 """
-    res = llm_invoke_json([
+    review = await _astructured(ctx, [
         {"role":"system","content":sys},
         {"role":"user","content":usr}
-    ])
-    data = _jloads(_json_extract(res.get("rewritten_text") or str(res)), {})
-    overall_ok = bool(data.get("overall_ok", False))
-    rationale  = data.get("rationale") or ""
+    ], ReviewSpec, "review") or ReviewSpec(overall_ok=False, rationale="复评输出无法解析")
+    overall_ok = review.overall_ok
+    rationale  = review.rationale
     new_steps: List[TodoStep] = []
-    for s in data.get("revised_steps", []) or []:
-        title = s.get("title") or "执行主要动作"
-        ac    = s.get("accept_criteria") or []
-        if isinstance(ac, str): ac = [ac]
-        nv    = bool(s.get("need_validation", True))
-        hint  = s.get("tool_hint") or _guess_tool_by_title(title)
-        ns = TodoStep(id=str(uuid.uuid4()), title=title, accept_criteria=ac, need_validation=nv, tool_hint=hint)
+    for i, sp in enumerate(review.revised_steps, 1):
+        ns = _todo_from_spec(sp, i)
         if is_analysis_step(ns.title): ns.need_validation = False
         new_steps.append(ns)
 
@@ -396,18 +714,33 @@ def planner_overall_review(
         ))
     return overall_ok, rationale, new_steps
 
+def planner_overall_review(
+    ctx: Dict[str, Any],
+    steps: List[TodoStep],
+    outputs: Dict[str, Any],
+) -> Tuple[bool, str, List[TodoStep]]:
+    """
+    返回：overall_ok, rationale, new_steps
+    """
+    return _run_sync(aplanner_overall_review(ctx, steps, outputs))
+
 # ========================= 主调度：按你的新流程 =========================
-def run_textual_flow(
+async def arun_textual_flow(
     *,
     user_input: str,
     session_id: Optional[str],
     history: List[Dict[str, str]],
     pick_output: Callable[[Any], str],
-    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Dict[str, Any]],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Any],
     plan_max_loops: int = 3,
     step_max_attempts: int = 2,
     pass_threshold: float = 0.75,
     overall_replan_max: Optional[int] = None,   # None→从环境变量读取
+    deadline_s: Optional[float] = None,          # 墙钟时限（秒）；None→RUN_DEADLINE_S，未设则不限
+    token_budget: Optional[int] = None,          # token 上限；None→RUN_TOKEN_BUDGET，未设则不限
+    trace_id: Optional[str] = None,              # 预分配的 trace_id（如后台任务）；None→新建
+    cancel_token: Optional[CancelToken] = None,  # 取消令牌（客户端断开 / DELETE /state / 超时）；None→内部新建
+    degrade: DegradeSpec = None,                 # 降级等级或返回等级的函数（过载保护，见 DEGRADE_*）；None→不降级
 ) -> Dict[str, Any]:
     """
     流程：
@@ -417,131 +750,486 @@ def run_textual_flow(
        - 达上限仍不过 → 记为 failed，继续后续步（不在此处重规划）
     3) 全部执行后 → 把整体结果给 Planner 做总体复评
        - 若不合理 → 修订子任务清单并重跑执行（≤ overall_replan_max 次）
+       - 重跑时与已执行清单比对：标题/tool_hint/输入未变且已完成的步骤直接复用产物
     4) 返回最终结果
+
+    预算（deadline_s / token_budget）：贯穿所有 LLM 调用；将尽时跳过剩余重试与总体复评，
+    耗尽后不再执行新步骤，返回目前为止通过校验的最佳结果，消耗情况写入轨迹与返回值的 budget 字段。
+
+    检查点：计划、各步产出/尝试次数/状态、反馈与重规划次数随执行写入 run_state，
+    进程中途退出后可用 resume_textual_flow(trace_id) 从最后完成的步骤继续。
+
+    降级（degrade，运行中每个检查点重新取值）：≥1 跳过总体复评；≥2 Validator 只做规则校验；
+    ≥3 不再重试、规划只尝试一次。跳过的环节记入轨迹（degrade 步骤）。
+
+    取消：令牌按 trace_id 登记（cancellation.cancel(trace_id) 可从外部触发），并经 contextvar
+    传到 executor / agent 调用 / SiliconFlowClient；取消后进行中的调用被中止，trace 标记为 cancelled。
+
+    原生 asyncio 实现：LLM 走 ainvoke，轨迹写盘在线程中完成；
+    agent_invoke_with_retry 可以是协程函数（推荐，基于 agent.ainvoke）或同步函数（自动放到线程）。
     """
     if overall_replan_max is None:
         overall_replan_max = int(os.getenv("OVERALL_REPLAN_MAX", "1"))
+    if deadline_s is None and os.getenv("RUN_DEADLINE_S"):
+        deadline_s = float(os.getenv("RUN_DEADLINE_S"))
+    if token_budget is None and os.getenv("RUN_TOKEN_BUDGET"):
+        token_budget = int(os.getenv("RUN_TOKEN_BUDGET"))
 
     # 入口与上下文
-    run_state = create_run_state(session_id, user_input)
-    trace_id  = run_state["trace_id"]
-    action    = run_state.get("action_guess", "rewrite_letter")
+    run_state = await acreate_run_state(session_id, user_input, trace_id)
+    messages = [{"role": h.get("role","user"), "content": h.get("content","")} for h in history] + [
+        {"role":"user","content": user_input}
+    ]
+    options = dict(
+        plan_max_loops=plan_max_loops,
+        step_max_attempts=step_max_attempts,
+        pass_threshold=pass_threshold,
+        overall_replan_max=overall_replan_max,
+        deadline_s=deadline_s,
+        token_budget=token_budget,
+    )
+    # 检查点骨架：续跑所需的输入与参数先落盘，计划/步骤进度随执行写入
+    checkpoint: Dict[str, Any] = {
+        "messages": messages,
+        "options": options,
+        "plan_rationale": None,
+        "steps": [],
+        "replan_times": 0,
+        "final_text": "",
+        "last_failed_feedback": "",
+    }
+    return await _drive_flow(
+        run_state, user_input, checkpoint,
+        pick_output=pick_output,
+        agent_invoke_with_retry=agent_invoke_with_retry,
+        cancel_token=cancel_token,
+        degrade=degrade,
+        resume=False,
+    )
+
+async def aresume_textual_flow(
+    trace_id: str,
+    *,
+    pick_output: Callable[[Any], str],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Any],
+    cancel_token: Optional[CancelToken] = None,
+    degrade: DegradeSpec = None,
+) -> Dict[str, Any]:
+    """
+    从检查点续跑某次运行（进程崩溃 / 重启后由 sweeper 或 /jobs 重新投递触发）：
+    - 已完成的步骤直接沿用产物，失败且用尽重试的步骤保持 failed，其余从上次的尝试次数继续
+    - 尚未产出计划则重新规划；已进入重规划的，沿用已计的重规划次数
+    - 运行已 completed 时不再调用任何模型，直接返回检查点中的结果
+    预算按原参数重新计时（deadline_s 从续跑开始算）。trace 不存在抛 FileNotFoundError。
+    """
+    state = await asyncio.to_thread(load_state, trace_id)
+    checkpoint = dict(state.get("checkpoint") or {})
+    if state.get("status") == "completed" and checkpoint.get("result"):
+        return {
+            "trace_id": trace_id,
+            "session_id": state.get("session_id"),
+            **checkpoint["result"],
+            "checklist": checkpoint.get("steps", []),
+            "resumed": False,
+        }
+
+    run_state = await aclaim_run(trace_id)
+    user_input = run_state.get("user_input") or ""
+    checkpoint.setdefault("messages", [{"role": "user", "content": user_input}])
+    checkpoint.setdefault("options", {})
+    checkpoint.setdefault("steps", [])
+    checkpoint.setdefault("replan_times", 0)
+    checkpoint.setdefault("final_text", "")
+    checkpoint.setdefault("last_failed_feedback", "")
+    checkpoint.pop("result", None)
+    return await _drive_flow(
+        run_state, user_input, checkpoint,
+        pick_output=pick_output,
+        agent_invoke_with_retry=agent_invoke_with_retry,
+        cancel_token=cancel_token,
+        degrade=degrade,
+        resume=True,
+    )
+
+async def _drive_flow(
+    run_state: Dict[str, Any],
+    user_input: str,
+    checkpoint: Dict[str, Any],
+    *,
+    pick_output: Callable[[Any], str],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Any],
+    cancel_token: Optional[CancelToken],
+    degrade: DegradeSpec,
+    resume: bool,
+) -> Dict[str, Any]:
+    """新建 / 续跑共用：组装上下文、登记取消令牌、执行并记录终态"""
+    trace_id = run_state["trace_id"]
+    options = checkpoint["options"]
+    deadline_s, token_budget = options.get("deadline_s"), options.get("token_budget")
+    budget = RunBudget(deadline_s=deadline_s, max_tokens=token_budget) if (deadline_s or token_budget) else None
 
     ctx: Dict[str, Any] = {
-        "session_id": session_id,
+        "session_id": run_state.get("session_id"),
         "trace_id": trace_id,
-        "action": action,
+        "action": run_state.get("action_guess", "rewrite_letter"),
         "user_input": user_input,
-        "messages": [{"role": h.get("role","user"), "content": h.get("content","")} for h in history] + [
-            {"role":"user","content": user_input}
-        ],
-        "last_failed_feedback": ""
+        "messages": checkpoint["messages"],
+        "last_failed_feedback": checkpoint.get("last_failed_feedback", ""),
+        "budget": budget,
+        "best_text": checkpoint.get("final_text", ""),  # 目前通过校验的最佳结果（取消时交付）
+        "checkpoint": checkpoint,
+        "degrade": degrade,
     }
-    _log(trace_id, "Initial Prompt received")
+    if resume:
+        await _log(trace_id, f"Resumed from checkpoint ({len(checkpoint['steps'])} steps)")
+    else:
+        await asave_checkpoint(trace_id, checkpoint)
+        await _log(trace_id, "Initial Prompt received")
 
-    # 1) 规划 + 可行性评估
-    planner = make_llm_planner(max_loops=plan_max_loops)
-    set_todo_status(trace_id, "plan", "in_progress")
-    append_step(trace_id, "planner", "started", {"action": action})
+    token = cancel_token or CancelToken()
+    register(trace_id, token)
+    reset = set_current_token(token)
+    try:
+        result = await _run_flow(
+            ctx,
+            pick_output=pick_output,
+            agent_invoke_with_retry=agent_invoke_with_retry,
+            plan_max_loops=options.get("plan_max_loops", 3),
+            step_max_attempts=options.get("step_max_attempts", 2),
+            pass_threshold=options.get("pass_threshold", 0.75),
+            overall_replan_max=options.get("overall_replan_max", 1),
+        )
+        checkpoint["result"] = {k: result.get(k) for k in ("done", "plan_rationale", "final_text")}
+        await _checkpoint(ctx, ctx.get("steps") or [])
+        await aset_run_status(trace_id, "completed", {"done": result["done"]})
+        if resume:
+            result["resumed"] = True
+        return result
+    except Cancelled as e:
+        # 已取消：不再发起任何调用，交付目前通过校验的结果并把 trace 标记为 cancelled
+        reason = str(e) or token.reason or "cancelled"
+        await aappend_step(trace_id, "cancelled", "warn", {"reason": reason})
+        await aset_run_status(trace_id, "cancelled", {"reason": reason})
+        return await _flow_result(
+            ctx,
+            done=False,
+            cancelled=True,
+            plan_rationale=f"cancelled: {reason}",
+            checklist=[s.__dict__ for s in ctx.get("steps") or []],
+            final_text=ctx.get("best_text", ""),
+        )
+    except Exception as e:
+        # 其它异常：先把运行记为 failed（否则一直是 running，会被当成存活 / 孤儿运行），再原样抛出
+        # asyncio.CancelledError（进程关闭等）不在此列：保持 running，由续跑逻辑接管
+        err = {"error": f"{type(e).__name__}: {e}"}
+        try:
+            await aappend_step(trace_id, "failed", "error", err)
+            await aset_run_status(trace_id, "failed", err)
+        except Exception:
+            log.exception("failed to record failure of run %s", trace_id)
+        raise
+    finally:
+        reset_current_token(reset)
+        unregister(trace_id)
 
-    pr = planner(ctx)
-    if not pr.can_plan:
-        set_todo_status(trace_id, "plan", "failed")
-        append_step(trace_id, "planner", "failed", {"reason": pr.rationale})
-        return {
-            "trace_id": trace_id,
-            "session_id": session_id,
-            "done": False,
-            "plan_rationale": pr.rationale,
-            "checklist": [],
-            "final_text": "",
-        }
+_TODO_FIELDS = {f.name for f in fields(TodoStep)}
 
-    steps = pr.steps
+def _steps_from_checkpoint(items: List[Dict[str, Any]]) -> List[TodoStep]:
+    """检查点中的步骤 → TodoStep；中断时进行中的步骤回到 pending（保留已用尝试次数）"""
+    steps = [TodoStep(**{k: v for k, v in d.items() if k in _TODO_FIELDS}) for d in items]
     for s in steps:
-        s.max_attempts = step_max_attempts
+        if s.status in ("in_progress", "skipped"):
+            s.status = "pending"
+    return steps
+
+async def _checkpoint(ctx: Dict[str, Any], steps: List[TodoStep], **updates: Any) -> None:
+    """把当前步骤进度（产出、尝试次数、状态）与反馈写入检查点"""
+    cp = ctx["checkpoint"]
+    cp.update(updates)
+    cp["steps"] = [asdict(s) for s in steps]
+    cp["last_failed_feedback"] = ctx.get("last_failed_feedback", "")
+    await asave_checkpoint(ctx["trace_id"], cp)
 
-    set_todo_status(trace_id, "plan", "completed")
-    append_step(trace_id, "planner", "ok", {"steps": [s.title for s in steps], "rationale": pr.rationale})
+async def _flow_result(ctx: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+    trace_id, budget = ctx["trace_id"], ctx.get("budget")
+    out = {"trace_id": trace_id, "session_id": ctx.get("session_id"), **fields}
+    if ctx.get("window_tokens_saved"):
+        out["window_tokens_saved"] = ctx["window_tokens_saved"]
+    if ctx.get("degraded"):
+        out["degraded"] = sorted(ctx["degraded"])
+        await aappend_step(trace_id, "degrade", "warn", {"skipped": out["degraded"]})
+    if budget:
+        snap = budget.snapshot()
+        await aappend_step(trace_id, "budget", "exhausted" if snap["exhausted"] else "ok", snap)
+        out["budget"] = snap
+    return out
 
-    executor  = make_executor(agent_invoke_with_retry=agent_invoke_with_retry, pick_output=pick_output)
-    validator = make_llm_validator(pass_threshold=pass_threshold)
+async def _run_flow(
+    ctx: Dict[str, Any],
+    *,
+    pick_output: Callable[[Any], str],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Any],
+    plan_max_loops: int,
+    step_max_attempts: int,
+    pass_threshold: float,
+    overall_replan_max: int,
+) -> Dict[str, Any]:
+    """arun_textual_flow 的主体：规划 → 逐步执行/校验 → 总体复评（可重规划）"""
+    trace_id = ctx["trace_id"]
+    action   = ctx["action"]
+    budget: Optional[RunBudget] = ctx.get("budget")
+    cp = ctx["checkpoint"]
+
+    # 1) 规划 + 可行性评估（续跑且检查点已有计划时跳过）
+    if cp.get("steps"):
+        pr = PlanResult(can_plan=True, rationale=cp.get("plan_rationale") or "", steps=_steps_from_checkpoint(cp["steps"]))
+        steps = pr.steps
+        await aappend_step(trace_id, "planner", "resumed", {
+            "steps": [s.title for s in steps],
+            "completed": [s.title for s in steps if s.status == "completed"],
+            "replan_times": cp.get("replan_times", 0),
+        })
+    else:
+        if _degrade_level(ctx) >= DEGRADE_NO_RETRY:
+            plan_max_loops = 1
+            _note_degraded(ctx, "plan_loops")
+        planner = make_async_llm_planner(max_loops=plan_max_loops)
+        await aset_todo_status(trace_id, "plan", "in_progress")
+        await aappend_step(trace_id, "planner", "started", {"action": action})
+
+        pr = await planner(ctx)
+        if not pr.can_plan:
+            await aset_todo_status(trace_id, "plan", "failed")
+            await aappend_step(trace_id, "planner", "failed", {"reason": pr.rationale})
+            return await _flow_result(
+                ctx,
+                done=False,
+                plan_rationale=pr.rationale,
+                checklist=[],
+                final_text="",
+            )
+
+        steps = pr.steps
+        for s in steps:
+            s.max_attempts = step_max_attempts
 
-    def _execute_all(current_steps: List[TodoStep]) -> Tuple[List[TodoStep], str]:
+        await aset_todo_status(trace_id, "plan", "completed")
+        await aappend_step(trace_id, "planner", "ok", {"steps": [s.title for s in steps], "rationale": pr.rationale})
+        await _checkpoint(ctx, steps, plan_rationale=pr.rationale)
+
+    executor  = make_async_executor(agent_invoke_with_retry=agent_invoke_with_retry, pick_output=pick_output)
+    validator = make_async_llm_validator(pass_threshold=pass_threshold)
+
+    def _can_retry(step: TodoStep) -> bool:
+        if step.attempts >= step.max_attempts:
+            return False
+        if _degrade_level(ctx) >= DEGRADE_NO_RETRY:
+            _note_degraded(ctx, "retry")
+            return False
+        if budget and budget.nearly_exhausted():
+            budget.skip(f"retry:{step.title}")
+            return False
+        return True
+
+    async def _execute_all(current_steps: List[TodoStep]) -> Tuple[List[TodoStep], str]:
         final_text = ""
+        ctx["steps"] = current_steps  # 供链式步骤（input_from）读取上游产出
         for idx, step in enumerate(current_steps):
+            # 已完成的步骤（重规划复用旧产物 / 从检查点续跑）：不再执行/校验
+            if step.status == "completed":
+                if step.reused_from:
+                    await aappend_step(trace_id, "executor", "reused", {"step": step.title, "from": step.reused_from})
+                else:
+                    await aappend_step(trace_id, "executor", "resumed", {"step": step.title})
+                await aset_todo_status(trace_id, f"step-{idx+1}", "completed")
+                if "text" in step.outputs:  final_text = step.outputs["text"]
+                if "final" in step.outputs: final_text = step.outputs["final"]
+                continue
+            # 续跑：中断前已用尽重试而失败的步骤保持 failed
+            if step.status == "failed" and step.attempts >= step.max_attempts:
+                continue
+
+            # 预算耗尽：后续步骤不再执行
+            if budget and budget.exhausted():
+                step.status = "skipped"
+                budget.skip(f"step:{step.title}")
+                await aset_todo_status(trace_id, f"step-{idx+1}", "skipped")
+                continue
+
+            step.input_sig = _step_input_sig(ctx, step)
             # 执行（带重试 + must_fix）
             while True:
-                set_todo_status(trace_id, f"step-{idx+1}", "in_progress")
-                append_step(trace_id, "executor", "started", {"step": step.title, "attempt": step.attempts+1})
+                await _checkpoint(ctx, current_steps)  # 每次尝试前落盘：尝试次数、上次反馈、已完成步骤的产出
+                await aset_todo_status(trace_id, f"step-{idx+1}", "in_progress")
+                await aappend_step(trace_id, "executor", "started", {"step": step.title, "attempt": step.attempts+1})
                 step.status   = "in_progress"
                 step.attempts += 1
                 try:
-                    out = executor(ctx, step) or {}
+                    # 每个步骤一个检查点草稿子线程（会话:运行:步骤）：重试沿用本步骤的对话，不混入其它步骤 / 并发请求；
+                    # 会话线程只记录每轮问答，草稿子线程在运行结束后由调用方删除
+                    with scoped_thread(trace_id, step.id):
+                        out = await executor(ctx, step) or {}
+                    step.outputs.pop("memo_hit", None)
                     step.outputs.update(out)
-                    append_step(trace_id, "executor", "ok", {"outputs_keys": list(out.keys()), "tool": out.get("used_tool")})
-                except Exception as e:
-                    append_step(trace_id, "executor", "error", {"error": repr(e)})
-                    if step.attempts < step.max_attempts:
+                    await aappend_step(trace_id, "executor", "ok", {
+                        "outputs_keys": list(out.keys()),
+                        "tool": out.get("used_tool"),
+                        "memo_hit": bool(out.get("memo_hit")),
+                        "input_from": step.input_from,
+                    })
+                except Exception as e:  # Cancelled 为 BaseException，不会在此被当作普通失败重试
+                    await aappend_step(trace_id, "executor", "error", {"error": repr(e)})
+                    if _can_retry(step):
                         step.status = "pending"
-                        set_todo_status(trace_id, f"step-{idx+1}", "pending")
+                        await aset_todo_status(trace_id, f"step-{idx+1}", "pending")
                         continue
                     step.status = "failed"
-                    set_todo_status(trace_id, f"step-{idx+1}", "failed")
+                    await aset_todo_status(trace_id, f"step-{idx+1}", "failed")
                     break  # 放弃该步，继续后续
 
                 # 校验
                 if step.need_validation:
-                    set_todo_status(trace_id, f"step-{idx+1}-validate", "in_progress")
-                    passed, fb = validator(ctx, step, current_steps)
-                    append_step(trace_id, "validator", "ok" if passed else "warn", {"step": step.title, "feedback": fb})
-                    set_validation(trace_id, passed, [fb] if fb else [])
+                    await aset_todo_status(trace_id, f"step-{idx+1}-validate", "in_progress")
+                    try:
+                        passed, fb = await validator(ctx, step, current_steps)
+                    except BudgetExceeded as e:
+                        passed, fb = False, f"预算耗尽，未完成校验：{e}"
+                    await aappend_step(trace_id, "validator", "ok" if passed else "warn", {"step": step.title, "feedback": fb})
+                    await aset_validation(trace_id, passed, [fb] if fb else [])
                     if not passed:
-                        if step.attempts < step.max_attempts:
+                        _memo_settle(ctx, step, False)
+                        if _can_retry(step):
                             step.status = "pending"
-                            set_todo_status(trace_id, f"step-{idx+1}-validate", "pending")
+                            await aset_todo_status(trace_id, f"step-{idx+1}-validate", "pending")
                             ctx["last_failed_feedback"] = fb
                             continue  # 再试同一步
                         else:
                             step.status = "failed"
-                            set_todo_status(trace_id, f"step-{idx+1}", "failed")
+                            await aset_todo_status(trace_id, f"step-{idx+1}", "failed")
                             break
 
                 # 通过
+                _memo_settle(ctx, step, True)
                 step.status = "completed"
-                set_todo_status(trace_id, f"step-{idx+1}", "completed")
-                set_todo_status(trace_id, f"step-{idx+1}-validate", "completed")
+                await aset_todo_status(trace_id, f"step-{idx+1}", "completed")
+                await aset_todo_status(trace_id, f"step-{idx+1}-validate", "completed")
                 if "text" in step.outputs:  final_text = step.outputs["text"]
                 if "final" in step.outputs: final_text = step.outputs["final"]
+                ctx["best_text"] = final_text or ctx.get("best_text", "")
                 break
+            await _checkpoint(ctx, current_steps, final_text=ctx.get("best_text", ""))
         return current_steps, final_text
 
     # 2) 执行清单（第一次）
-    steps, final_text = _execute_all(steps)
+    steps, final_text = await _execute_all(steps)
 
     # 3) Planner 总体复评（可重规划≤overall_replan_max）
-    replan_times = 0
+    replan_times = cp.get("replan_times", 0)
     while True:
-        overall_ok, rationale, new_steps = planner_overall_review(ctx, steps, {"final_text": final_text})
-        append_step(trace_id, "planner_review", "ok" if overall_ok else "warn", {"rationale": rationale})
+        # 预算将尽：跳过总体复评，直接交付当前通过校验的结果
+        if budget and budget.nearly_exhausted():
+            budget.skip("overall_review")
+            await aappend_step(trace_id, "planner_review", "skipped", {"reason": "budget"})
+            return await _flow_result(
+                ctx,
+                done=all(s.status == "completed" or not s.need_validation for s in steps) and bool(final_text),
+                plan_rationale=f"{pr.rationale} | budget: overall review skipped",
+                checklist=[s.__dict__ for s in steps],
+                final_text=final_text,
+            )
+        # 过载降级：跳过总体复评
+        if _degrade_level(ctx) >= DEGRADE_NO_REVIEW:
+            _note_degraded(ctx, "overall_review")
+            return await _flow_result(
+                ctx,
+                done=all(s.status == "completed" or not s.need_validation for s in steps) and bool(final_text),
+                plan_rationale=f"{pr.rationale} | degraded: overall review skipped",
+                checklist=[s.__dict__ for s in steps],
+                final_text=final_text,
+            )
+        try:
+            overall_ok, rationale, new_steps = await aplanner_overall_review(ctx, steps, {"final_text": final_text})
+        except BudgetExceeded as e:
+            overall_ok, rationale, new_steps = False, f"budget: {e}", []
+        await aappend_step(trace_id, "planner_review", "ok" if overall_ok else "warn", {"rationale": rationale})
 
         if overall_ok or replan_times >= overall_replan_max or not new_steps:
             done = overall_ok and all(s.status == "completed" or not s.need_validation for s in steps)
-            return {
-                "trace_id": trace_id,
-                "session_id": session_id,
-                "done": done,
-                "plan_rationale": pr.rationale if overall_ok else f"overall_review: {rationale}",
-                "checklist": [s.__dict__ for s in steps],
-                "final_text": final_text,
-            }
+            return await _flow_result(
+                ctx,
+                done=done,
+                plan_rationale=pr.rationale if overall_ok else f"overall_review: {rationale}",
+                checklist=[s.__dict__ for s in steps],
+                final_text=final_text,
+            )
 
-        # 触发重规划：用新清单重跑
+        # 触发重规划：与已执行清单比对，仅重跑新增/变更的步骤
         replan_times += 1
-        append_step(trace_id, "planner", "replan", {"times": replan_times, "new_steps": [s.title for s in new_steps]})
+        reused, rerun = reuse_completed_steps(ctx, steps, new_steps)
+        await aappend_step(trace_id, "planner", "replan", {
+            "times": replan_times,
+            "new_steps": [s.title for s in new_steps],
+            "reused": reused,
+            "rerun": rerun,
+        })
         for s in new_steps:
             s.max_attempts = step_max_attempts
         # 重置失败反馈，执行新清单
         ctx["last_failed_feedback"] = ""
-        # 重跑
-        steps, final_text = _execute_all(new_steps)
+        await _checkpoint(ctx, new_steps, replan_times=replan_times, plan_rationale=pr.rationale)
+        # 重跑（复用步直接跳过）；若新清单未产出通过校验的结果，保留上一轮的
+        steps, rerun_text = await _execute_all(new_steps)
+        final_text = rerun_text or final_text
+
+
+def run_textual_flow(
+    *,
+    user_input: str,
+    session_id: Optional[str],
+    history: List[Dict[str, str]],
+    pick_output: Callable[[Any], str],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Dict[str, Any]],
+    plan_max_loops: int = 3,
+    step_max_attempts: int = 2,
+    pass_threshold: float = 0.75,
+    overall_replan_max: Optional[int] = None,
+    deadline_s: Optional[float] = None,
+    token_budget: Optional[int] = None,
+    trace_id: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+    degrade: DegradeSpec = None,
+) -> Dict[str, Any]:
+    """同步入口：arun_textual_flow 的薄封装（流程与参数完全一致）。"""
+    return _run_sync(arun_textual_flow(
+        user_input=user_input,
+        session_id=session_id,
+        history=history,
+        pick_output=pick_output,
+        agent_invoke_with_retry=agent_invoke_with_retry,
+        plan_max_loops=plan_max_loops,
+        step_max_attempts=step_max_attempts,
+        pass_threshold=pass_threshold,
+        overall_replan_max=overall_replan_max,
+        deadline_s=deadline_s,
+        token_budget=token_budget,
+        trace_id=trace_id,
+        cancel_token=cancel_token,
+        degrade=degrade,
+    ))
+
+def resume_textual_flow(
+    trace_id: str,
+    *,
+    pick_output: Callable[[Any], str],
+    agent_invoke_with_retry: Callable[[List[Dict[str, str]]], Dict[str, Any]],
+    cancel_token: Optional[CancelToken] = None,
+    degrade: DegradeSpec = None,
+) -> Dict[str, Any]:
+    """同步入口：aresume_textual_flow 的薄封装。"""
+    return _run_sync(aresume_textual_flow(
+        trace_id,
+        pick_output=pick_output,
+        agent_invoke_with_retry=agent_invoke_with_retry,
+        cancel_token=cancel_token,
+        degrade=degrade,
+    ))
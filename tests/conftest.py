@@ -0,0 +1,47 @@
+# tests/conftest.py
+"""
+测试公共夹具
+- src/ 与 examples/research/ 加入 sys.path（未 pip install -e . 时也能导入）
+- 导入期需要的环境变量给占位值；运行态目录放到临时目录；关闭限流中间件
+- fake_redis：用 fakeredis（同一 FakeServer 的同步 / 异步客户端）替换 deepagents.redis_utils 的连接
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for p in (os.path.join(ROOT, "src"), os.path.join(ROOT, "examples", "research")):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+_TMP = tempfile.mkdtemp(prefix="deepagents-tests-")
+os.environ.setdefault("SILICONFLOW_API_KEY", "test")
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("RUN_DIR", os.path.join(_TMP, "run_store"))
+os.environ.setdefault("MEMORY_DIR", os.path.join(_TMP, "mem_store"))
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # 幂等释放走 Lua 脚本
+    from deepagents import redis_utils
+
+    server = fakeredis.FakeServer()
+    sync = fakeredis.FakeRedis(server=server, decode_responses=True)
+    clients = {}
+
+    def _async_client():
+        # 与 get_async_redis 一致：按事件循环各建一个客户端
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        return clients[loop]
+
+    monkeypatch.setattr(redis_utils, "rds", sync)
+    monkeypatch.setattr(redis_utils, "_release_script", sync.register_script(redis_utils._LUA_RELEASE))
+    monkeypatch.setattr(redis_utils, "get_async_redis", _async_client)
+    return sync
@@ -0,0 +1,59 @@
+# tests/test_cancellation.py
+"""待生效取消（排队中就被取消的 trace）有界；DELETE /state/{trace_id} 对未知 / 已结束运行不登记取消"""
+import pytest
+
+from deepagents import cancellation
+from deepagents.cancellation import CancelToken
+
+@pytest.fixture(autouse=True)
+def _clean_precancelled():
+    cancellation._precancelled.clear()
+    yield
+    cancellation._precancelled.clear()
+
+def test_precancel_applies_on_register():
+    assert cancellation.cancel("queued-1", "deleted") is False
+    tok = CancelToken()
+    cancellation.register("queued-1", tok)
+    try:
+        assert tok.cancelled and tok.reason == "deleted"
+    finally:
+        cancellation.unregister("queued-1")
+
+def test_precancelled_is_bounded_by_size_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cancellation.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(cancellation, "CANCEL_PENDING_MAX", 3)
+    for i in range(5):
+        cancellation.cancel(f"t{i}")
+    assert list(cancellation._precancelled) == ["t2", "t3", "t4"]
+
+    now[0] += cancellation.CANCEL_PENDING_TTL_S
+    tok = CancelToken()
+    cancellation.register("t4", tok)  # 过期的待生效取消不再作用于新运行
+    cancellation.unregister("t4")
+    assert not tok.cancelled
+
+    cancellation.cancel("fresh")
+    assert list(cancellation._precancelled) == ["fresh"]  # 过期的一并清除
+
+@pytest.fixture
+def client():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    research_agent = pytest.importorskip("research_agent")
+    from fastapi.testclient import TestClient
+    return research_agent, TestClient(research_agent.app)
+
+def test_delete_state_unknown_and_terminal_runs(client):
+    _, c = client
+    assert c.delete("/state/no-such-trace").status_code == 404
+    assert "no-such-trace" not in cancellation._precancelled
+
+    from deepagents.run_state import create_run_state, set_run_status
+
+    create_run_state("s1", "hello", trace_id="t-failed")
+    set_run_status("t-failed", "failed")
+    body = c.delete("/state/t-failed").json()
+    assert body["cancel_requested"] is False and body["status"] == "failed"
+    assert "t-failed" not in cancellation._precancelled
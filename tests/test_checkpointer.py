@@ -0,0 +1,124 @@
+# tests/test_checkpointer.py
+"""检查点线程：latest_turn 保留 system 提示；会话线程续接、步骤草稿子线程随运行删除；删除会话时连同子线程；每次 agent 调用都带 thread_id"""
+import pytest
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from deepagents import checkpointer as cp
+
+def test_latest_turn_keeps_leading_system_messages():
+    hinted = [{"role": "system", "content": "必须按以下修正点调整结果：更简洁"}, {"role": "user", "content": "{...}"}]
+    assert cp.latest_turn(hinted) == hinted
+
+    msgs = [
+        {"role": "system", "content": "sys"},
+        {"role": "user", "content": "old question"},
+        {"role": "assistant", "content": "old answer"},
+        {"role": "user", "content": "new question"},
+        {"role": "system", "content": "fix guidance"},
+    ]
+    assert cp.latest_turn(msgs) == [msgs[0], msgs[3], msgs[4]]
+    assert cp.latest_turn([{"role": "system", "content": "only"}]) == [{"role": "system", "content": "only"}]
+
+def test_scoped_thread_nests_under_current_thread():
+    with cp.scoped_thread("run", "step"):
+        assert cp.thread_config() == {}  # 未设置会话线程：不启用
+    with cp.use_thread("s1"):
+        with cp.scoped_thread("run-1", "step-a"):
+            assert cp.thread_config() == {"configurable": {"thread_id": "s1:run-1:step-a"}}
+        assert cp.current_thread() == "s1"
+
+def _graph(saver):
+    g = StateGraph(MessagesState)
+    g.add_node("agent", lambda s: {"messages": [("ai", "ok")]})
+    g.add_edge(START, "agent")
+    g.add_edge("agent", END)
+    return g.compile(checkpointer=saver)
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_delete_thread_removes_scoped_children(backend, tmp_path, monkeypatch):
+    if backend == "sqlite":
+        monkeypatch.setattr(cp, "CHECKPOINT_SQLITE_PATH", str(tmp_path / "cp.sqlite"))
+    saver = cp.make_checkpointer(backend)
+    app = _graph(saver)
+    for tid in ("s1", "s1:run:a", "s1:run:b", "s10:run:a"):
+        app.invoke({"messages": [("user", "hi")]}, config=cp.thread_config(tid))
+
+    cp.delete_thread(saver, "s1")
+
+    alive = {tid for tid in ("s1", "s1:run:a", "s1:run:b", "s10:run:a")
+             if saver.get_tuple(cp.thread_config(tid)) is not None}
+    assert alive == {"s10:run:a"}
+
+@pytest.fixture
+def checkpointed_agent(monkeypatch):
+    research_agent = pytest.importorskip("research_agent")
+    saver = cp.make_checkpointer("memory")
+    monkeypatch.setattr(research_agent, "agent_checkpointer", saver)
+    monkeypatch.setattr(research_agent, "agent", _graph(saver))
+    monkeypatch.setattr(research_agent, "RETRY_ATTEMPTS", 1)
+    monkeypatch.setattr(research_agent, "_sleep_backoff", lambda i: None)
+    return research_agent, saver
+
+def test_invoke_outside_use_thread_gets_a_thread(checkpointed_agent):
+    research_agent, _ = checkpointed_agent
+    res = research_agent.invoke_agent_with_retry([{"role": "user", "content": "hi"}])
+    assert "messages" in res  # 不是重试耗尽后的回显兜底
+
+def test_debug_report_uses_session_thread(checkpointed_agent, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    research_agent, saver = checkpointed_agent
+    monkeypatch.setattr(research_agent, "load_memory", lambda *a, **k: [{"role": "user", "content": "old"}])
+    client = TestClient(research_agent.app)
+    for text in ("one", "two"):
+        r = client.post("/debug", json={"user_input": text}, headers={"X-Session-Id": "dbg"})
+        assert r.status_code == 200
+    contents = [m.content for m in saver.get_tuple(cp.thread_config("dbg")).checkpoint["channel_values"]["messages"]]
+    assert contents == ["old", "one", "ok", "two", "ok"]  # 第二次只发最新一轮，历史来自检查点
+
+def test_session_thread_is_resumed_and_step_threads_dropped(checkpointed_agent, monkeypatch):
+    research_agent, saver = checkpointed_agent
+    old = [{"role": "user", "content": "old q"}, {"role": "assistant", "content": "old a"}]
+    monkeypatch.setattr(research_agent, "load_memory", lambda *a, **k: list(old))
+
+    history = research_agent._session_history("s2", 8)
+    assert history == old  # 会话线程尚无检查点：文件记忆作种子
+    research_agent._record_turn("s2", history, "q1", "a1")
+
+    def _no_file_memory(*a, **k):
+        raise AssertionError("history should come from the session thread")
+    monkeypatch.setattr(research_agent, "load_memory", _no_file_memory)
+    history = research_agent._session_history("s2", 8)
+    assert [h["content"] for h in history] == ["old q", "old a", "q1", "a1"]
+    research_agent._record_turn("s2", history, "q2", "a2")  # 只追加最新一轮
+    assert [h["content"] for h in research_agent._session_history("s2", 3)] == ["a1", "q2", "a2"]
+
+    app = _graph(saver)
+    for step in ("step-1", "step-2"):
+        app.invoke({"messages": [("user", "draft")]}, config=cp.thread_config(f"s2:t1:{step}"))
+    research_agent._drop_run_threads("s2", "t1")
+    assert saver.get_tuple(cp.thread_config("s2:t1:step-1")) is None
+    assert saver.get_tuple(cp.thread_config("s2:t1:step-2")) is None
+    assert saver.get_tuple(cp.thread_config("s2")) is not None
+
+def test_generate_records_turn_and_drops_step_threads(checkpointed_agent, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    from deepagents.run_state import create_run_state
+
+    research_agent, saver = checkpointed_agent
+
+    async def fake_flow(**kw):
+        create_run_state(kw["session_id"], kw["user_input"], kw["trace_id"])
+        with cp.scoped_thread(kw["trace_id"], "step-1"):
+            await kw["agent_invoke_with_retry"](kw["history"] + [{"role": "user", "content": kw["user_input"]}])
+        return {"trace_id": kw["trace_id"], "final_text": f"out-{kw['user_input']}", "done": True}
+
+    monkeypatch.setattr(research_agent, "arun_textual_flow", fake_flow)
+    client = TestClient(research_agent.app)
+    for text in ("a", "b"):
+        assert client.post("/generate", json={"user_input": text, "session_id": "g1"}).status_code == 200
+
+    assert sorted(saver.storage) == ["g1"]
+    assert [h["content"] for h in research_agent._session_history("g1", 8)] == ["a", "out-a", "b", "out-b"]
@@ -0,0 +1,53 @@
+# tests/test_chunking.py
+"""长文本分块：中文按句切、拼接还原分隔、去掉块首重复的上一句；修正点下发到每一块"""
+from deepagents.chunking import map_reduce_text, split_text, stitch
+
+CJK = "".join(f"第{i}句讲的是研究经历里的具体细节。" for i in range(12))
+EN = " ".join(f"Sentence {i} describes the research project in detail." for i in range(12))
+
+def _joined(chunks):
+    return "".join(c.sep + c.text for c in chunks)
+
+def test_cjk_paragraph_splits_on_sentence_ends():
+    chunks = split_text(CJK, max_tokens=60, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(c.text.endswith("。") for c in chunks)
+    assert all(c.sep == "" for c in chunks)
+    assert _joined(chunks) == CJK
+
+def test_separators_are_restored():
+    en = split_text(EN, max_tokens=30, overlap_tokens=0)
+    assert len(en) > 1 and all(c.sep == " " for c in en[1:])
+    assert _joined(en) == EN
+
+    paras = "第一段。" * 10 + "\n\n" + "第二段。" * 10
+    chunks = split_text(paras, max_tokens=45, overlap_tokens=0)
+    assert [c.sep for c in chunks] == ["", "\n\n"]
+    assert stitch(chunks, [c.text for c in chunks]) == paras
+
+def test_overlap_context_is_previous_tail():
+    chunks = split_text(CJK, max_tokens=60, overlap_tokens=20)
+    assert chunks[0].context == ""
+    assert all(chunks[i - 1].text.endswith(c.context) and c.context for i, c in enumerate(chunks) if i)
+
+def test_stitch_drops_repeated_head_and_chatter():
+    chunks = split_text(CJK, max_tokens=60, overlap_tokens=0)
+    last = "第" + chunks[0].text.rsplit("。第", 1)[-1]
+    outputs = [c.text for c in chunks]
+    outputs[1] = f"好的，以下是本段结果：\n{last}{outputs[1]}"
+    assert stitch(chunks, outputs) == CJK
+
+def test_fix_guidance_reaches_every_chunk():
+    prompts = []
+
+    def call(prompt, user_text):
+        prompts.append(prompt)
+        return user_text.rpartition("【本段】\n")[2] or user_text
+
+    out = map_reduce_text(CJK, "润色", call, max_tokens=60, parallelism=1, fix_guidance="保留数字")
+    assert len(prompts) > 1 and all("【必须修正点】保留数字" in p for p in prompts)
+    assert out == CJK
+
+    prompts.clear()
+    map_reduce_text("短文本。", "润色", call, fix_guidance="保留数字")
+    assert prompts == ["润色\n\n【必须修正点】保留数字\n（请按上述修正点调整结果，只输出最终结果，不要解释。）"]
@@ -0,0 +1,100 @@
+# tests/test_idempotency.py
+"""Idempotency-Key：redis_utils 的认领 / 完成 / 释放 / 等待，以及 /generate 重放已存结果"""
+import asyncio
+import time
+
+import pytest
+
+from deepagents import redis_utils
+
+def test_claim_then_duplicate_sees_pending(fake_redis):
+    assert redis_utils.claim_idempotent("k1", "fp", "owner-a") == (True, None)
+    claimed, rec = redis_utils.claim_idempotent("k1", "fp", "owner-b")
+    assert not claimed
+    assert rec["status"] == "pending" and rec["owner"] == "owner-a" and rec["fingerprint"] == "fp"
+
+def test_complete_is_replayed_to_duplicates(fake_redis):
+    redis_utils.claim_idempotent("k2", "fp", "owner-a")
+    redis_utils.complete_idempotent("k2", "fp", {"answer": 42})
+    claimed, rec = redis_utils.claim_idempotent("k2", "fp", "owner-b")
+    assert not claimed
+    assert rec["status"] == "done" and rec["result"] == {"answer": 42}
+    assert fake_redis.ttl("idemp:k2") > redis_utils.IDEMPOTENCY_PENDING_TTL
+
+def test_release_only_by_owner_and_only_pending(fake_redis):
+    redis_utils.claim_idempotent("k3", "fp", "owner-a")
+    assert not redis_utils.release_idempotent("k3", "owner-b")
+    assert redis_utils.release_idempotent("k3", "owner-a")
+    assert redis_utils.get_idempotent("k3") is None
+    # 释放后可重新认领；已完成的结果不会被释放
+    assert redis_utils.claim_idempotent("k3", "fp", "owner-b")[0]
+    redis_utils.complete_idempotent("k3", "fp", {"ok": True})
+    assert not redis_utils.release_idempotent("k3", "owner-b")
+    assert redis_utils.get_idempotent("k3")["status"] == "done"
+
+def test_wait_times_out_while_pending(fake_redis):
+    redis_utils.claim_idempotent("k4", "fp", "owner-a")
+    t0 = time.monotonic()
+    assert redis_utils.wait_idempotent("k4", timeout=0.3, poll_interval=0.05) is None
+    assert time.monotonic() - t0 >= 0.3
+
+def test_wait_returns_completed_record(fake_redis):
+    redis_utils.claim_idempotent("k5", "fp", "owner-a")
+    redis_utils.complete_idempotent("k5", "fp", "done!")
+    assert redis_utils.wait_idempotent("k5", timeout=1)["result"] == "done!"
+
+def test_async_helpers_share_records(fake_redis):
+    async def scenario():
+        assert await redis_utils.aclaim_idempotent("k6", "fp", "owner-a") == (True, None)
+        claimed, rec = await redis_utils.aclaim_idempotent("k6", "fp", "owner-b")
+        assert not claimed and rec["owner"] == "owner-a"
+        assert await redis_utils.await_idempotent("k6", timeout=0.2, poll_interval=0.05) is None
+        assert await redis_utils.arelease_idempotent("k6", "owner-a")
+        assert await redis_utils.aclaim_idempotent("k6", "fp", "owner-b") == (True, None)
+        await redis_utils.acomplete_idempotent("k6", "fp", {"n": 1})
+        assert (await redis_utils.await_idempotent("k6", timeout=1))["result"] == {"n": 1}
+
+    asyncio.run(scenario())
+    assert redis_utils.get_idempotent("k6")["status"] == "done"
+
+# ========================= /generate 重放 =========================
+@pytest.fixture
+def server(fake_redis, monkeypatch):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    research_agent = pytest.importorskip("research_agent")
+    calls = []
+
+    async def fake_generate(q, request, x_session_id, x_tenant_id, x_priority):
+        calls.append(q.user_input)
+        return {"trace_id": f"t{len(calls)}", "output": q.user_input.upper()}
+
+    monkeypatch.setattr(research_agent, "_generate", fake_generate)
+    return research_agent, calls
+
+def test_generate_replays_stored_result(server):
+    from fastapi.testclient import TestClient
+
+    research_agent, calls = server
+    client = TestClient(research_agent.app)
+    body = {"user_input": "write a statement", "session_id": "s1"}
+    headers = {"Idempotency-Key": "gen-1"}
+
+    first = client.post("/generate", json=body, headers=headers)
+    second = client.post("/generate", json=body, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json() == {"trace_id": "t1", "output": "WRITE A STATEMENT"}
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert calls == ["write a statement"]
+
+def test_generate_rejects_key_reuse_with_different_body(server):
+    from fastapi.testclient import TestClient
+
+    research_agent, calls = server
+    client = TestClient(research_agent.app)
+    headers = {"Idempotency-Key": "gen-2"}
+    assert client.post("/generate", json={"user_input": "a", "session_id": "s1"}, headers=headers).status_code == 200
+    assert client.post("/generate", json={"user_input": "b", "session_id": "s1"}, headers=headers).status_code == 422
+    assert calls == ["a"]
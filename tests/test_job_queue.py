@@ -0,0 +1,22 @@
+# tests/test_job_queue.py
+"""LocalJobQueue：结束的任务记录按 result_ttl 清除（含死信）"""
+from deepagents import job_queue
+from deepagents.job_queue import LocalJobQueue
+
+def test_finished_records_expire_after_result_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(job_queue.time, "time", lambda: now[0])
+    q = LocalJobQueue(max_attempts=1, result_ttl=60)
+
+    done = q.enqueue({"n": 1})
+    q.ack(q.reserve(0)["job_id"], "ok")
+    dead = q.enqueue({"n": 2})
+    q.nack(q.reserve(0)["job_id"], "boom")
+    running = q.enqueue({"n": 3})
+    q.reserve(0)
+    assert q.get(done)["status"] == "done" and q.dead_letters() == [dead]
+
+    now[0] += 61
+    assert q.get(done) is None and q.get(dead) is None
+    assert q.dead_letters() == []
+    assert q.get(running)["status"] == "running"  # 未结束的任务不受影响
@@ -0,0 +1,37 @@
+# tests/test_offload.py
+"""run_blocking：阻塞调用卸载到专用线程池时，事件循环延迟保持在阈值以下"""
+import asyncio
+import contextvars
+import time
+
+from deepagents.offload import LoopLagMonitor, run_blocking
+
+LAG_THRESHOLD_S = 0.1
+
+async def _lag_while(work) -> float:
+    monitor = LoopLagMonitor(interval=0.01, warn_s=1.0)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    await work()
+    await asyncio.sleep(0.05)  # 让采样任务记下阻塞期间的那次唤醒
+    await monitor.stop()
+    return monitor.max
+
+def test_run_blocking_keeps_loop_responsive():
+    async def offloaded():
+        await asyncio.gather(*(run_blocking(time.sleep, 0.3) for _ in range(4)))
+
+    async def inline():
+        time.sleep(0.3)  # 对照：直接在循环里阻塞
+
+    assert asyncio.run(_lag_while(offloaded)) < LAG_THRESHOLD_S
+    assert asyncio.run(_lag_while(inline)) > LAG_THRESHOLD_S
+
+def test_run_blocking_carries_contextvars():
+    var = contextvars.ContextVar("var", default=None)
+
+    async def scenario():
+        var.set("trace-1")
+        return await run_blocking(var.get)
+
+    assert asyncio.run(scenario()) == "trace-1"
@@ -0,0 +1,30 @@
+# tests/test_pdf_extract.py
+"""PDF 进程池：spawn 子进程只加载 pdf_extract（不连带 langgraph / SiliconFlowClient），未配置 API key 也能提取"""
+import sys
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+from deepagents import pdf_extract
+
+def _heavy_modules_in_worker():
+    return sorted(m for m in sys.modules if m.startswith(("langgraph", "langchain", "deepagents.siliconflow_client")))
+
+@pytest.fixture
+def fresh_pool(monkeypatch):
+    monkeypatch.delenv("SILICONFLOW_API_KEY", raising=False)
+    pdf_extract.shutdown_pdf_pool()  # 子进程按当前环境重新 spawn
+    yield
+    pdf_extract.shutdown_pdf_pool()
+
+def test_parallel_extraction_without_api_key(fresh_pool):
+    data = pdf_extract._synthetic_pdf(pages=32, lines=2)
+    pdf_extract.metrics.reset()
+    chunks = list(pdf_extract.iter_pdf_text(data, workers=2, chunk_pages=8, max_pages=0, max_bytes=0))
+    assert len(chunks) == 4
+    assert "Page 0 line 0" in chunks[0] and "Page 31 line 1" in chunks[-1]
+    counters = pdf_extract.metrics.snapshot()["counters"]
+    assert counters["pdf_pages"] == {"mode=parallel": 32} and "pdf_pool_broken" not in counters
+
+    assert pdf_extract._get_pool(2).submit(_heavy_modules_in_worker).result(timeout=60) == []
@@ -0,0 +1,39 @@
+# tests/test_rate_limit.py
+"""限流规则：轮询类只读接口单独计桶、更宽松，不消耗提交接口的配额"""
+import pytest
+
+from deepagents.rate_limit import RateLimitMiddleware, RateLimiter, RateRule, load_rules, match_rule
+
+def test_poll_endpoints_match_their_own_rule():
+    rules = load_rules("")
+    assert match_rule(rules, "/jobs/abc", "GET")[0] == "GET /jobs/"
+    assert match_rule(rules, "/state/t1", "GET")[0] == "GET /state"
+    assert match_rule(rules, "/states", "GET")[0] == "GET /state"
+    assert match_rule(rules, "/jobs", "POST")[0] == "default"
+    assert match_rule(rules, "/state/t1", "DELETE")[0] == "default"
+    assert match_rule(rules, "/jobs/abc")[0] == "default"  # 未给方法时不匹配带方法的规则
+
+    rules = load_rules('{"/jobs": {"algorithm": "sliding_log", "limit": 5, "window": 60}, "GET /state": null}')
+    assert match_rule(rules, "/jobs/abc", "GET")[0] == "GET /jobs/"  # 更长的前缀优先
+    assert match_rule(rules, "/jobs", "GET")[0] == "/jobs"
+    assert match_rule(rules, "/state/t1", "GET")[0] == "default"
+
+def test_polling_does_not_drain_submit_quota(fake_redis):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from deepagents import redis_utils
+
+    app = FastAPI()
+    app.get("/jobs/{job_id}")(lambda job_id: {"job_id": job_id})
+    app.post("/jobs")(lambda: {"ok": True})
+    rules = {"default": RateRule(rate=0.001, burst=2), "GET /jobs/": RateRule(rate=0.001, burst=5)}
+    limiter = RateLimiter(rds=fake_redis, async_client=redis_utils.get_async_redis)
+    app.add_middleware(RateLimitMiddleware, limiter=limiter, rules=rules)
+    client = TestClient(app)
+    headers = {"X-Tenant-Id": "t1"}
+
+    polls = [client.get("/jobs/j1", headers=headers).status_code for _ in range(6)]
+    assert polls == [200] * 5 + [429]
+    assert [client.post("/jobs", headers=headers).status_code for _ in range(3)] == [200, 200, 429]
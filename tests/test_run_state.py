@@ -0,0 +1,17 @@
+# tests/test_run_state.py
+"""运行状态落盘：同一 trace 的并发读-改-写不丢更新，也不残留临时文件"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from deepagents import run_state
+
+def test_concurrent_appends_are_not_lost(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_state, "RUN_DIR", str(tmp_path))
+    trace_id = run_state.create_run_state("s1", "hello")["trace_id"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: run_state.append_step(trace_id, f"step-{i}", "ok"), range(64)))
+
+    names = [s["name"] for s in run_state.load_state(trace_id)["steps"]]
+    assert sorted(names) == sorted(f"step-{i}" for i in range(64))
+    assert os.listdir(tmp_path) == [f"{trace_id}.json"]
@@ -0,0 +1,41 @@
+# tests/test_state.py
+"""state reducers：不原地修改已发出的快照；父子 state 增量"""
+from langgraph.graph import END, START, StateGraph
+
+from deepagents.state import DeepAgentState, file_reducer, list_extend, project_state, state_delta
+
+def test_reducers_return_new_containers():
+    l, d = ["a"], {"x": "1"}
+    assert list_extend(l, ["b"]) == ["a", "b"] and l == ["a"]
+    assert file_reducer(d, {"y": "2"}) == {"x": "1", "y": "2"} and d == {"x": "1"}
+
+def test_streamed_value_snapshots_are_not_mutated():
+    def step(n):
+        return lambda state: {"rewritten_texts": [f"t{n}"], "files": {f"f{n}": f"p{n}"}}
+
+    g = StateGraph(DeepAgentState)
+    g.add_node("a", step(1))
+    g.add_node("b", step(2))
+    g.add_node("c", step(3))
+    g.add_edge(START, "a")
+    g.add_edge("a", "b")
+    g.add_edge("b", "c")
+    g.add_edge("c", END)
+
+    snaps = list(g.compile().stream({"messages": []}, stream_mode="values"))
+    texts = [s.get("rewritten_texts") for s in snaps[1:]]
+    files = [s.get("files") for s in snaps[1:]]
+    assert texts == [["t1"], ["t1", "t2"], ["t1", "t2", "t3"]]
+    assert files == [{"f1": "p1"}, {"f1": "p1", "f2": "p2"}, {"f1": "p1", "f2": "p2", "f3": "p3"}]
+    assert snaps[1]["rewritten_texts"] is not snaps[2]["rewritten_texts"]
+
+def test_state_delta_returns_only_new_items():
+    parent = {"rewritten_texts": ["a", "b"], "files": {"x": "1"}, "document_name": "cv"}
+    sent = project_state(parent, "*")
+    result = {
+        **sent,
+        "rewritten_texts": list_extend(sent["rewritten_texts"], ["c"]),
+        "files": file_reducer(sent["files"], {"x": "1", "y": "2"}),
+    }
+    assert state_delta(DeepAgentState, sent, result) == {"rewritten_texts": ["c"], "files": {"y": "2"}}
+    assert parent == {"rewritten_texts": ["a", "b"], "files": {"x": "1"}, "document_name": "cv"}
@@ -0,0 +1,55 @@
+# tests/test_sub_agent.py
+"""task_batch 并发执行：超时任务经子取消令牌真正停下，父令牌取消传递到所有任务"""
+import threading
+import time
+
+import pytest
+
+from deepagents import sub_agent
+from deepagents.cancellation import Cancelled, CancelToken, check_cancelled, reset_current_token, set_current_token
+
+def _wait_for(cond, timeout: float = 1.0) -> None:
+    # 被放弃的任务在池线程里收尾，_run_jobs 返回时可能还没记下停止原因
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+@pytest.fixture
+def fake_dispatch(monkeypatch):
+    stopped = {}
+
+    def _dispatch(agents, state, description, subagent_type):
+        # 模拟子代理：每 10ms 一个检查点（相当于每次 LLM / 工具调用前的 cancel_config 检查）
+        deadline = time.monotonic() + float(description)
+        try:
+            while time.monotonic() < deadline:
+                check_cancelled()
+                time.sleep(0.01)
+        except Cancelled as e:
+            stopped[subagent_type] = str(e)
+            raise
+        return {}, f"{subagent_type} done", True
+
+    monkeypatch.setattr(sub_agent, "_dispatch", _dispatch)
+    return stopped
+
+def test_timed_out_job_is_cancelled(fake_dispatch):
+    jobs = [{"description": "0.05", "subagent_type": "fast"}, {"description": "5", "subagent_type": "slow"}]
+    results = sub_agent._run_jobs(None, {}, jobs, max_concurrency=2, timeout_s=0.2)
+    assert results[0] == ({}, "fast done", True)
+    assert results[1][2] is False and "timed out" in results[1][1]
+    _wait_for(lambda: "slow" in fake_dispatch)
+    assert fake_dispatch == {"slow": "timeout"}
+
+def test_parent_cancel_reaches_every_job(fake_dispatch):
+    parent = CancelToken()
+    threading.Timer(0.1, parent.cancel, args=("client gone",)).start()
+    reset = set_current_token(parent)
+    try:
+        with pytest.raises(Cancelled):
+            sub_agent._run_jobs(None, {}, [{"description": "5", "subagent_type": n} for n in "ab"], 2, 0)
+    finally:
+        reset_current_token(reset)
+    _wait_for(lambda: len(fake_dispatch) == 2)
+    assert fake_dispatch == {"a": "client gone", "b": "client gone"}
+    assert not parent._callbacks  # 子令牌已从父令牌注销
@@ -0,0 +1,62 @@
+# tests/test_tri_role_scheduler.py
+"""Executor memo：只复用通过校验的产物；重试不命中 memo。直连工具单独收到修正点"""
+import asyncio
+
+from deepagents import tool_dispatch
+from deepagents import tri_role_scheduler as trs
+
+def _executor(calls):
+    async def agent(msgs):
+        calls.append(msgs)
+        return {"rewritten_text": f"out-{len(calls)}"}
+    return trs.make_async_executor(agent_invoke_with_retry=agent, pick_output=lambda r: r["rewritten_text"])
+
+def _step(id_: str, attempts: int = 1) -> trs.TodoStep:
+    return trs.TodoStep(id=id_, title="润色第一段", tool_hint="custom_unregistered_tool", attempts=attempts)
+
+def test_memo_reuses_only_validated_outputs():
+    calls = []
+    ex = _executor(calls)
+    ctx = {"user_input": "原文", "last_failed_feedback": "更简洁"}
+
+    first = asyncio.run(ex(ctx, _step("a")))
+    trs._memo_settle(ctx, _step("a"), False)  # 校验驳回：不入 memo
+    again = asyncio.run(ex(ctx, _step("b")))
+    assert len(calls) == 2 and not again.get("memo_hit")
+
+    trs._memo_settle(ctx, _step("b"), True)   # 通过：同输入的其它步骤可复用
+    hit = asyncio.run(ex(ctx, _step("c")))
+    assert len(calls) == 2 and hit["memo_hit"] and hit["text"] == again["text"] != first["text"]
+
+def test_retry_with_same_fix_guidance_bypasses_memo():
+    calls = []
+    ex = _executor(calls)
+    ctx = {"user_input": "原文", "last_failed_feedback": "更简洁"}
+    asyncio.run(ex(ctx, _step("a")))
+    trs._memo_settle(ctx, _step("a"), True)
+    retry = asyncio.run(ex(ctx, _step("b", attempts=2)))
+    assert len(calls) == 2 and not retry.get("memo_hit")
+
+def test_direct_dispatch_passes_fix_guidance_separately():
+    seen = []
+
+    def chunked(text, model, fix_guidance=""):
+        seen.append(("chunked", text, fix_guidance))
+        return "ok"
+
+    def plain(text, model):
+        seen.append(("plain", text))
+        return "ok"
+
+    tool_dispatch.register_direct_tool("chunked_tool", chunked)
+    tool_dispatch.register_direct_tool("plain_tool", plain)
+    try:
+        ex = trs.make_async_executor(agent_invoke_with_retry=None, pick_output=lambda r: r)
+        ctx = {"user_input": "原文", "last_failed_feedback": "更简洁"}
+        for hint in ("chunked_tool", "plain_tool"):
+            asyncio.run(ex(ctx, trs.TodoStep(id=hint, title="润色第一段", tool_hint=hint)))
+    finally:
+        tool_dispatch.unregister_direct_tool("chunked_tool")
+        tool_dispatch.unregister_direct_tool("plain_tool")
+    assert seen[0] == ("chunked", "原文", "更简洁")
+    assert seen[1][0] == "plain" and seen[1][1].startswith("原文\n\n【必须修正点】更简洁")